@@ -1,17 +1,34 @@
-from flask import Flask, request, jsonify, send_file
+from flask import (Flask, Response, request, jsonify, send_file, g, has_request_context,
+                   stream_with_context)
 from flask_cors import CORS
 from pypdf import PdfReader, PdfWriter
 from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject,
-                           FloatObject, NameObject, NumberObject)
+                           EncodedStreamObject, FloatObject, IndirectObject,
+                           NameObject, NumberObject)
 from reportlab.pdfgen import canvas
+import base64
+import hashlib
 import hmac
 import io
 import os
 import re
 import json
+import socket
+import multiprocessing
+import threading
+import tempfile
+import time
+import uuid
 import zipfile
+import zlib
 import requests
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as DelaiFuturDepasse
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from pdf_optim import LinearisationIncoherente, lineariser_pdf, optimiser_pdf
+import supabase_http
 from html import unescape as _unescape   # décode TOUTES les entités HTML (&Acirc; -> Â, &eacute; -> é…)
 
 app = Flask(__name__)
@@ -21,7 +38,7 @@ app = Flask(__name__)
 CORS(app, origins=[
     'https://persoproject-portail.ademw1499.workers.dev',
     'http://localhost:5173',
-])
+], expose_headers=['X-Zip-Compression', 'X-PDF-Taille', 'X-Cache-Etat', 'X-Suivant'])   # mesures lisibles depuis le portail
 # Taille maximale des requêtes (audit 04/08, H2) : uploads PDF et JSON bornés.
 app.config['MAX_CONTENT_LENGTH'] = 15 * 1024 * 1024
 
@@ -81,35 +98,152 @@ def cvt(x, y):
     return (x * SCALE_X, 842 - (y * SCALE_Y))
 
 _ISO_DATE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
-def txt(c, t, x, y, s=10):
-    t = str(t)
+def _texte(v):
+    t = str(v)
     # Filet de sécurité : le frontend envoie parfois la date brute AAAA-MM-JJ
     # (input HTML date) au lieu de JJ/MM/AAAA. On la remet à l'endroit.
     m = _ISO_DATE.match(t)
     if m:
         t = f'{m.group(3)}/{m.group(2)}/{m.group(1)}'
-    c.setFont("Helvetica", s)
-    c.drawString(*cvt(x, y), t)
+    return t
 
 def newcan():
     p = io.BytesIO()
     return p, canvas.Canvas(p, pagesize=(595, 842))
 
-def merge(tpl, pkt, npg=1):
-    pkt.seek(0)
-    ov = PdfReader(pkt)
-    rd = PdfReader(tpl)
+# ============== GABARITS : templates analysés UNE fois par worker ==============
+# Avant : chaque téléchargement relisait et ré-analysait le PDF depuis le disque
+# (PdfReader(tpl) / wr.append(tpl)), y compris l'Offre (~750 Ko) et la
+# Procuration (~800 Ko). On garde désormais, par worker, le lecteur pypdf déjà
+# résolu (pages, ressources, flux) ; chaque requête en tire une copie (clone
+# pypdf dans SON writer) — le gabarit partagé n'est jamais modifié.
+_ICI = os.path.dirname(os.path.abspath(__file__))
+_GABARITS = {}
+_GABARITS_VERROU = threading.Lock()
+
+
+def _chemin_gabarit(tpl):
+    return tpl if os.path.isabs(tpl) else os.path.join(_ICI, tpl)
+
+
+def _gabarit(tpl):
+    """Template analysé (cache du worker) : {'lecteur', 'octets', 'nb_pages',
+    'empreinte', 'verrou', 'parse_ms'}, pages tournées déjà redressées (cf. _redresser).
+    Le verrou sérialise les lectures du flux partagé (PdfReader n'est pas
+    thread-safe, et le serveur de dev est multi-thread)."""
+    chemin = _chemin_gabarit(tpl)
+    gab = _GABARITS.get(chemin)
+    if gab is not None:
+        return gab
+    with _GABARITS_VERROU:
+        gab = _GABARITS.get(chemin)
+        if gab is None:
+            t0 = time.perf_counter()
+            with open(chemin, 'rb') as f:
+                octets = f.read()
+            rd = PdfReader(io.BytesIO(octets))
+            if any(pg.get('/Rotate') for pg in rd.pages):
+                octets = _redresser(rd)
+                rd = PdfReader(io.BytesIO(octets))
+            # Résout tout de suite pages, ressources et flux : le cache interne
+            # du lecteur les garde, les copies suivantes ne touchent plus au disque.
+            for pg in rd.pages:
+                pg.get(NameObject('/Resources'))
+                c = pg.get(NameObject('/Contents'))
+                if c is not None:
+                    c.get_object()
+            gab = {'lecteur': rd, 'octets': octets, 'nb_pages': len(rd.pages),
+                   'empreinte': hashlib.sha256(octets).hexdigest(),
+                   'verrou': threading.Lock(),
+                   'parse_ms': round((time.perf_counter() - t0) * 1000, 1)}
+            _GABARITS[chemin] = gab
+    return gab
+
+
+def _redresser(rd):
+    """Template dont des pages sont tournées (ex: PROCURATION.pdf en paysage,
+    /Rotate 270) -> octets d'un template équivalent aux pages droites.
+    Les calques sont dessinés en portrait 595x842 : sans ça le texte atterrit
+    hors de la zone visible. Fait une fois au chargement, plus à chaque requête."""
     wr = PdfWriter()
-    for i in range(len(rd.pages)):
-        pg = rd.pages[i]
-        # Si le template est tourné (ex: PROCURATION.pdf en paysage /Rotate 270),
-        # on "remet la page droite" avant de fusionner, sinon le texte de l'overlay
-        # (dessiné en portrait 595x842) atterrit hors de la zone visible.
+    wr.append(rd)
+    for pg in wr.pages:
         if pg.get('/Rotate'):
             pg.transfer_rotation_to_content()
-        if i < len(ov.pages):
+    out = io.BytesIO()
+    wr.write(out)
+    return out.getvalue()
+
+
+def _prechauffer_gabarits():
+    """Au démarrage du worker : analyse tous les TEMPLATES et journalise le coût.
+    Un template absent n'empêche pas le démarrage (il lèvera à la génération)."""
+    t0 = time.perf_counter()
+    n = 0
+    for cle, fn in TEMPLATES.items():
+        try:
+            _gabarit(fn)
+            n += 1
+        except Exception as e:
+            print(f"[GABARITS] {cle} ({fn}) illisible : {e}")
+    print(f"[GABARITS] {n}/{len(TEMPLATES)} templates analysés en "
+          f"{(time.perf_counter() - t0) * 1000:.0f} ms")
+
+
+_prechauffer_gabarits()
+
+
+class _chrono:
+    """Mesure un bloc et l'ajoute à l'en-tête Server-Timing de la réponse
+    (visible dans l'onglet Réseau du navigateur). Hors requête : ne fait rien."""
+    def __init__(self, nom):
+        self.nom = nom
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if has_request_context():
+            ms = (time.perf_counter() - self.t0) * 1000
+            chronos = g.setdefault('chronos', {})
+            chronos[self.nom] = chronos.get(self.nom, 0.0) + ms
+        return False
+
+
+@app.after_request
+def _server_timing(resp):
+    chronos = g.get('chronos')
+    if chronos:
+        resp.headers['Server-Timing'] = ', '.join(
+            f'{nom};dur={ms:.1f}' for nom, ms in chronos.items())
+    tailles = _ligne_tailles_pdf()       # cf. _compter_tailles
+    if tailles:
+        resp.headers['X-PDF-Taille'] = tailles
+    return resp
+
+
+def _copie_gabarit(tpl):
+    """PdfWriter contenant une copie du template, à modifier librement."""
+    gab = _gabarit(tpl)
+    wr = PdfWriter()
+    with _chrono('gabarit'), gab['verrou']:
+        wr.append(gab['lecteur'])
+    return wr
+
+
+def merge(tpl, pkt, npg=1, dessinees=None):
+    """Fusionne le calque `pkt` page à page sur une copie du template.
+    dessinees : index des pages de calque qui portent réellement du texte ; les
+    autres (pages vierges, ex. pages 2-3 du Mensura) ne sont pas fusionnées et
+    la page du template passe intacte. None = toutes."""
+    pkt.seek(0)
+    ov = PdfReader(pkt)
+    wr = _copie_gabarit(tpl)
+    for i, pg in enumerate(wr.pages):
+        # Pages déjà droites : cf. _redresser() au chargement du gabarit.
+        if i < len(ov.pages) and (dessinees is None or i in dessinees):
             pg.merge_page(ov.pages[i])
-        wr.add_page(pg)
     out = io.BytesIO()
     wr.write(out)
     out.seek(0)
@@ -128,6 +262,162 @@ def get_static_document_bytes(doc_key):
 def get_bundle_for_document(doc_type):
     return DOCUMENT_BUNDLES.get(doc_type, [])
 
+
+# --- ZIP en flux ----------------------------------------------------------------
+# zipfile sait écrire vers une sortie NON « seekable » : il ne revient alors jamais
+# en arrière pour compléter l'en-tête local, il pose le drapeau « data descriptor »
+# (bit 3) et écrit CRC/tailles APRÈS les données. Chaque entrée peut donc partir
+# vers le client dès qu'elle est écrite ; seul le répertoire central (quelques
+# centaines d'octets) attend la fin.
+class _FluxZip:
+    """Sortie append-only pour zipfile : accumule ce qui est écrit jusqu'au
+    prochain vider(). Pas de seek() -> zipfile passe en mode data descriptor."""
+    def __init__(self):
+        self._morceaux = []
+        self._pos = 0
+
+    def write(self, b):
+        self._morceaux.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def vider(self):
+        out = b''.join(self._morceaux)
+        self._morceaux = []
+        return out
+
+
+# Compression PAR ENTRÉE. La plupart de nos PDF (flux Flate) et les .docx (déjà
+# des ZIP) ne gagnent que 2 à 8 % au deflate, pour ~15 ms de CPU par document ;
+# l'Offre (-29 %) ou la Procuration (-11 %) y gagnent vraiment. On compresse un
+# échantillon (début/milieu/fin) en zlib niveau 1 : gain < 10 % -> STORED.
+# ZIP_COMPRESSION=deflate force l'ancien comportement (mesures A/B).
+_ZIP_ECHANTILLON = 16 * 1024
+_ZIP_GAIN_MIN = 0.10
+
+
+def _politique_zip():
+    return 'deflate' if os.environ.get('ZIP_COMPRESSION', '').lower() == 'deflate' else 'auto'
+
+
+def _methode_zip(octets):
+    """ZIP_STORED si `octets` est déjà compressé (gain deflate < 10 %), sinon ZIP_DEFLATED."""
+    if _politique_zip() == 'deflate':
+        return zipfile.ZIP_DEFLATED
+    k = _ZIP_ECHANTILLON
+    if len(octets) <= 3 * k:
+        echantillon = octets
+    else:
+        milieu = len(octets) // 2
+        echantillon = octets[:k] + octets[milieu:milieu + k] + octets[-k:]
+    if not echantillon:
+        return zipfile.ZIP_STORED
+    gain = 1 - len(zlib.compress(echantillon, 1)) / len(echantillon)
+    return zipfile.ZIP_DEFLATED if gain >= _ZIP_GAIN_MIN else zipfile.ZIP_STORED
+
+
+def _ecrire_entree(zf, nom, octets):
+    """Ajoute une entrée avec la compression choisie ; renvoie 'stored'/'deflated'."""
+    methode = _methode_zip(octets)
+    zf.writestr(nom, octets, compress_type=methode)
+    return 'stored' if methode == zipfile.ZIP_STORED else 'deflated'
+
+
+# Documents statiques (STATIC_DOCUMENTS) : leur entrée ZIP est préparée UNE fois
+# par worker (octets déjà compressés + CRC + tailles) puis recopiée telle quelle
+# dans chaque archive — ni lecture disque, ni CRC, ni deflate par requête.
+_ENTREES_STATIQUES = {}
+_ENTREES_STATIQUES_VERROU = threading.Lock()
+
+
+def entree_zip_statique(doc_key):
+    """Entrée ZIP prête à recopier pour un document statique, ou None s'il manque :
+    {'nom', 'methode', 'crc', 'taille', 'brut', 'date'} ('brut' = données telles
+    qu'écrites dans l'archive, donc déjà deflatées si methode = ZIP_DEFLATED)."""
+    cle = (doc_key, _politique_zip())
+    entree = _ENTREES_STATIQUES.get(cle)
+    if entree is not None:
+        return entree
+    with _ENTREES_STATIQUES_VERROU:
+        entree = _ENTREES_STATIQUES.get(cle)
+        if entree is None:
+            octets, nom = get_static_document_bytes(doc_key)
+            if not octets:
+                return None                # pas mis en cache : fichier peut-être à venir
+            methode = _methode_zip(octets)
+            brut = octets
+            if methode == zipfile.ZIP_DEFLATED:
+                z = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)   # idem zipfile
+                brut = z.compress(octets) + z.flush()
+            entree = _ENTREES_STATIQUES[cle] = {
+                'nom': nom, 'methode': methode, 'crc': zlib.crc32(octets),
+                'taille': len(octets), 'brut': brut,
+                'date': time.localtime()[:6]}
+    return entree
+
+
+# Attributs internes de ZipFile utilisés par _recopier_entree (stables de 3.8 à
+# 3.13). S'ils disparaissent d'une version de Python, on repasse par writestr().
+_ZIP_INTERNES = ('_writecheck', 'fp', 'start_dir', '_didModify', 'NameToInfo', 'filelist')
+
+
+def _recopier_entree(zf, entree):
+    """Écrit une entrée préparée (entree_zip_statique) dans l'archive `zf`.
+    zipfile n'a pas d'API pour des données déjà compressées : on pose l'en-tête
+    local nous-mêmes (CRC et tailles connus : pas de data descriptor) puis on
+    enregistre le ZipInfo pour le répertoire central, comme le fait writestr().
+    Internes absents (autre version de zipfile) -> writestr() classique : plus
+    lent (recompression), jamais faux."""
+    if not all(hasattr(zf, a) for a in _ZIP_INTERNES):
+        brut = entree['brut']
+        octets = zlib.decompress(brut, -15) if entree['methode'] == zipfile.ZIP_DEFLATED else brut
+        zf.writestr(zipfile.ZipInfo(entree['nom'], date_time=entree['date']), octets,
+                    compress_type=entree['methode'])
+        return 'stored' if entree['methode'] == zipfile.ZIP_STORED else 'deflated'
+    zi = zipfile.ZipInfo(entree['nom'], date_time=entree['date'])
+    zi.compress_type = entree['methode']
+    zi.external_attr = 0o600 << 16            # comme writestr()
+    zi.CRC = entree['crc']
+    zi.file_size = entree['taille']
+    zi.compress_size = len(entree['brut'])
+    zf._writecheck(zi)
+    zi.header_offset = zf.fp.tell()
+    zf.fp.write(zi.FileHeader(False))
+    zf.fp.write(entree['brut'])
+    zf.filelist.append(zi)
+    zf.NameToInfo[zi.filename] = zi
+    zf.start_dir = zf.fp.tell()
+    zf._didModify = True
+    return 'stored' if zi.compress_type == zipfile.ZIP_STORED else 'deflated'
+
+
+def zip_en_flux(entrees):
+    """Générateur d'archive ZIP : entrees = itérable de (nom, contenu), consommé
+    au fur et à mesure ; contenu = octets, ou entrée préparée (dict, cf.
+    entree_zip_statique) recopiée telle quelle. Mémoire bornée par la plus
+    grosse entrée, pas par la somme ; le premier octet part dès la première
+    entrée prête.
+    Les en-têtes HTTP sont partis avant le choix des entrées : le choix par
+    entrée ne va qu'au journal [ZIP]. Rien dans le commentaire de l'archive :
+    elle part chez le client, et WinRAR / 7-Zip l'affichent."""
+    sortie = _FluxZip()
+    with zipfile.ZipFile(sortie, 'w') as zf:
+        for nom, contenu in entrees:
+            if isinstance(contenu, dict):
+                methode = _recopier_entree(zf, contenu)
+                print(f"[ZIP] {nom} : {methode}, préparée")
+            else:
+                methode = _ecrire_entree(zf, nom, contenu)
+                print(f"[ZIP] {nom} : {methode}")
+            yield sortie.vider()
+    yield sortie.vider()                 # répertoire central
+
 # Compat frontend : pour l'Offre en FR, le frontend envoie 4 morceaux
 # (offre1, offre2, offre3, offre4) alors que le backend génère l'Offre en un
 # seul document de 20 pages. On regroupe ces morceaux en un unique 'offre'.
@@ -181,34 +471,23 @@ def save_employeur(form_data):
             'statut': statut,
             'updated_at': datetime.now().isoformat(),
         }
-        r = requests.post(
-            f"{SUPABASE_URL}/rest/v1/employeurs?on_conflict=num_entreprise",
-            headers={
-                'apikey': SUPABASE_KEY,
-                'Authorization': f'Bearer {SUPABASE_KEY}',
-                'Content-Type': 'application/json',
-                'Prefer': 'resolution=merge-duplicates,return=minimal',
-            },
-            json=row, timeout=10,
-        )
+        def _upsert(payload):
+            return supabase_http.post(
+                f"{SUPABASE_URL}/rest/v1/employeurs?on_conflict=num_entreprise",
+                headers={**_supabase_headers(), 'Content-Type': 'application/json',
+                         'Prefer': 'resolution=merge-duplicates,return=minimal'},
+                json=payload, timeout=10)
+        # Colonne 'statut' absente de la base : sondée d'avance, jamais envoyée.
+        r = _envoyer_selon_schema('employeurs', _upsert, row, ('statut',))
         if r.status_code >= 300 and row.get('statut'):
-            # Échec lié au statut (colonne absente, OU valeur 'standby' refusée par un
-            # enum/contrainte) : on RE-sauvegarde sans le statut plutôt que de PERDRE le
+            # Valeur 'standby' refusée par un enum/contrainte (la sonde ne voit que
+            # les colonnes) : on RE-sauvegarde sans le statut plutôt que de PERDRE le
             # dossier. Il reste alors avec statut vide -> le Suivi des dossiers affiche
             # quand même « Lancer l'encodage » (le robot, lui, ne prend que 'pending').
             print(f"[SUPABASE] statut '{row['statut']}' refusé ({r.status_code}: {r.text[:120]}) "
                   f"-> nouvel essai sans statut")
             row.pop('statut', None)
-            r = requests.post(
-                f"{SUPABASE_URL}/rest/v1/employeurs?on_conflict=num_entreprise",
-                headers={
-                    'apikey': SUPABASE_KEY,
-                    'Authorization': f'Bearer {SUPABASE_KEY}',
-                    'Content-Type': 'application/json',
-                    'Prefer': 'resolution=merge-duplicates,return=minimal',
-                },
-                json=row, timeout=10,
-            )
+            r = _upsert(row)
         if r.status_code >= 300:
             print(f"[SUPABASE] échec sauvegarde {r.status_code}: {r.text[:200]}")
         else:
@@ -235,6 +514,9 @@ def debug_config():
     template_status = {}
     for key, filename in TEMPLATES.items():
         template_status[key] = {"filename": filename, "exists": os.path.exists(filename)}
+        gab = _GABARITS.get(_chemin_gabarit(filename))
+        if gab:
+            template_status[key].update(pages=gab['nb_pages'], parse_ms=gab['parse_ms'])
     static_status = {}
     for key, (filename, display) in STATIC_DOCUMENTS.items():
         static_status[key] = {
@@ -244,63 +526,455 @@ def debug_config():
         }
     return jsonify({
         "templates": template_status, "static_documents": static_status,
-        "document_bundles": DOCUMENT_BUNDLES, "supported_languages": ["fr", "nl"]
+        "document_bundles": DOCUMENT_BUNDLES, "supported_languages": ["fr", "nl"],
+        "cache_pdf": cache_pdf_stats(), "cache_etats": cache_etats_stats(),
+        "supabase_http": supabase_http.stats(), "cache_auth": auth_cache_stats(),
+        "schema": schema_stats(),
+        "repertoires": repertoires_stats()
     })
 
 # ============== LECTURE EMPLOYEURS (pour le portail) ==============
 def _supabase_headers():
     return {'apikey': SUPABASE_KEY, 'Authorization': f'Bearer {SUPABASE_KEY}'}
 
-def verify_user_token(req):
-    """Vérifie le token Supabase de l'utilisateur connecté (login gestionnaire).
-    Le frontend envoie 'Authorization: Bearer <access_token>'. On le valide
-    auprès de Supabase Auth. Retourne l'email de l'utilisateur si valide, sinon None."""
-    if not SUPABASE_URL or not SUPABASE_KEY:
+# ---- Colonnes optionnelles (schéma Supabase) ----
+# Certaines colonnes n'existent pas encore partout (ALTER pas fait sur toutes les
+# bases) : statut/manquants/institutions… d'employeurs, avantages de prestations.
+# Plutôt que d'envoyer la requête complète puis de la REJOUER sans la colonne
+# quand PostgREST se plaint, on sonde une fois les colonnes optionnelles de chaque
+# table (select=<cols>&limit=0 : aucune ligne lue ; si ça échoue, colonne par
+# colonne) et on construit directement la bonne requête -> un seul aller-retour.
+# Résultat gardé SCHEMA_TTL secondes (600 par défaut) par processus ; oublié dès
+# qu'une erreur de colonne revient malgré tout (ALTER fait/défait entre-temps).
+_SCHEMA = {}                 # (table, colonne) -> (présente, lu_a)
+_SCHEMA_VERROU = threading.Lock()
+
+
+def _schema_ttl():
+    try:
+        return max(0, int(os.environ.get('SCHEMA_TTL', '600')))
+    except ValueError:
+        return 600
+
+
+def _sonder(table, colonnes):
+    """True si `select=<colonnes>` passe, False si PostgREST répond « colonne
+    inconnue » (cf. _erreur_de_colonne), None si on n'a pas pu savoir (réseau,
+    401/403/404, 429, 5xx…) : None n'est pas mis en cache, un incident passager
+    ne fait donc pas retirer des colonnes pendant SCHEMA_TTL."""
+    try:
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/{table}?select={','.join(colonnes)}&limit=0",
+                              headers=_supabase_headers(), timeout=10)
+    except Exception:
         return None
-    auth = req.headers.get('Authorization', '')
-    if not auth.startswith('Bearer '):
+    if r.status_code < 300:
+        return True
+    return False if _erreur_de_colonne(r) else None
+
+
+def _colonnes_presentes(table, colonnes):
+    """Sous-ensemble de `colonnes` qui existe dans `table`. Une colonne qu'on n'a
+    pas pu sonder est supposée présente (comportement d'avant la sonde)."""
+    maintenant, ttl = time.time(), _schema_ttl()
+    with _SCHEMA_VERROU:
+        connues = {c: _SCHEMA[(table, c)][0] for c in colonnes
+                   if (table, c) in _SCHEMA and maintenant - _SCHEMA[(table, c)][1] < ttl}
+    inconnues = [c for c in colonnes if c not in connues]
+    if inconnues:
+        ok = _sonder(table, inconnues)
+        if ok is False and len(inconnues) > 1:       # au moins une absente : laquelle ?
+            sondes = {c: _sonder(table, [c]) for c in inconnues}
+        else:
+            sondes = dict.fromkeys(inconnues, ok)
+        with _SCHEMA_VERROU:
+            for c, present in sondes.items():
+                if present is not None:
+                    _SCHEMA[(table, c)] = (present, maintenant)
+        connues.update({c: present is not False for c, present in sondes.items()})
+        print(f"[SCHEMA] {table}: " + ', '.join(f"{c}={'oui' if connues[c] else 'non'}"
+                                                for c in inconnues))
+    return frozenset(c for c in colonnes if connues[c])
+
+
+_CODES_COLONNE_INCONNUE = ('42703', 'PGRST204')   # lecture (Postgres), écriture (PostgREST)
+
+
+def _erreur_de_colonne(r):
+    """Réponse PostgREST « colonne inconnue », d'après son champ `code` seulement :
+    d'autres erreurs parlent aussi de « column » (NOT NULL 23502, CHECK 23514…)
+    et ne doivent pas faire oublier le schéma."""
+    if r.status_code >= 500:
+        return False
+    try:
+        erreur = json.loads(r.text or '{}')
+    except ValueError:
+        return False
+    return isinstance(erreur, dict) and erreur.get('code') in _CODES_COLONNE_INCONNUE
+
+
+def _envoyer_selon_schema(table, envoyer, payload, optionnelles):
+    """envoyer(payload) -> réponse, sans les colonnes optionnelles absentes de
+    `table`. Si une erreur de colonne revient quand même, le schéma connu est
+    oublié, resondé, et la requête renvoyée une fois SI elle change."""
+    def _reduire():
+        presentes = _colonnes_presentes(table, [c for c in optionnelles if c in payload])
+        return {k: v for k, v in payload.items() if k not in optionnelles or k in presentes}
+    envoye = _reduire()
+    r = envoyer(envoye)
+    if r.status_code >= 300 and _erreur_de_colonne(r):
+        vider_cache_schema(table)
+        reduit = _reduire()
+        if reduit != envoye:
+            r = envoyer(reduit)
+    return r
+
+
+def vider_cache_schema(table=None):
+    with _SCHEMA_VERROU:
+        for k in [k for k in _SCHEMA if table is None or k[0] == table]:
+            del _SCHEMA[k]
+
+
+def schema_stats():
+    with _SCHEMA_VERROU:
+        return {f"{t}.{c}": v[0] for (t, c), v in sorted(_SCHEMA.items())}
+
+# ---- Vérification des jetons du portail ----
+# Avant : un aller-retour synchrone vers /auth/v1/user à CHAQUE requête
+# authentifiée (et parfois deux, via _lecture_auth). Désormais :
+# 1. vérification LOCALE du JWT Supabase — signature + exp/nbf + aud :
+#    - HS256 (secret JWT « legacy » du projet) si SUPABASE_JWT_SECRET est défini ;
+#    - ES256/RS256 (clés asymétriques) via le JWKS public du projet, mis en cache
+#      JWKS_TTL secondes (600) et relu aussitôt qu'un `kid` inconnu apparaît
+#      (rotation de clés), au plus une fois toutes les 30 s ; paquet
+#      `cryptography` (épinglé dans requirements.txt ; absent, on passe à l'étape 2) ;
+# 2. sinon (pas de secret, algo/clé inconnus) : validation distante comme avant,
+#    et le résultat est gardé dans un cache TTL borné jeton -> email
+#    (AUTH_CACHE_TTL s, 300 par défaut, jamais au-delà de l'exp du jeton ;
+#    AUTH_CACHE_MAX entrées, 1024). AUTH_CACHE=0 coupe le cache.
+# Les jetons acceptés localement passent aussi par ce cache (la vérif ECDSA
+# coûte ~0,1 ms, un hit quelques µs). Les refus ne sont jamais mis en cache.
+# Signature HS256 refusée : le secret local est peut-être périmé (rotation côté
+# Supabase) -> on demande à Supabase Auth, au plus AUTH_REPLI_MINUTE fois par
+# minute (20) : des jetons forgés ne font pas du worker un relais vers Supabase.
+_AUTH_CACHE = OrderedDict()     # empreinte du jeton -> (email, expire_a)
+_AUTH_VERROU = threading.Lock()
+_AUTH_STATS = {'hit': 0, 'local': 0, 'distant': 0, 'refus': 0, 'repli_hs256': 0}
+_AUTH_REPLI = {'debut': 0.0, 'n': 0}    # fenêtre d'une minute des replis HS256
+_JWKS = {'cles': {}, 'lu_a': 0.0}
+_JWKS_VERROU = threading.Lock()
+_NON_VERIFIABLE = object()      # le jeton n'a pas pu être jugé localement
+
+
+def _auth_cache_params():
+    if os.environ.get('AUTH_CACHE', '1') == '0':
+        return 0, 0
+    try:
+        ttl = max(0, int(os.environ.get('AUTH_CACHE_TTL', '300')))
+        maxi = max(0, int(os.environ.get('AUTH_CACHE_MAX', '1024')))
+    except ValueError:
+        ttl, maxi = 300, 1024
+    return ttl, maxi
+
+
+def _b64url(s):
+    return base64.urlsafe_b64decode(s + '=' * (-len(s) % 4))
+
+
+def _jwks_ttl():
+    try:
+        return max(30, int(os.environ.get('JWKS_TTL', '600')))
+    except ValueError:
+        return 600
+
+
+def _cle_jwks(kid):
+    """Clé publique (objet cryptography) du JWKS pour `kid`, ou None. Un kid
+    inconnu déclenche une relecture du JWKS (rotation), bornée à 1 / 30 s."""
+    maintenant = time.time()
+    with _JWKS_VERROU:
+        cle = _JWKS['cles'].get(kid)
+        age = maintenant - _JWKS['lu_a']
+        if cle is not None and age < _jwks_ttl():
+            return cle
+        if age < 30:
+            return cle
+        _JWKS['lu_a'] = maintenant
+    try:
+        from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    except ImportError:
         return None
-    token = auth.split(' ', 1)[1].strip()
-    if not token:
+    try:
+        r = supabase_http.get(f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json", timeout=5)
+        cles = {}
+        for k in (r.json() or {}).get('keys', []) if r.status_code == 200 else []:
+            if k.get('kty') == 'EC' and k.get('crv') == 'P-256':
+                cles[k.get('kid')] = ec.EllipticCurvePublicNumbers(
+                    int.from_bytes(_b64url(k['x']), 'big'), int.from_bytes(_b64url(k['y']), 'big'),
+                    ec.SECP256R1()).public_key()
+            elif k.get('kty') == 'RSA':
+                cles[k.get('kid')] = rsa.RSAPublicNumbers(
+                    int.from_bytes(_b64url(k['e']), 'big'),
+                    int.from_bytes(_b64url(k['n']), 'big')).public_key()
+    except Exception as e:
+        print(f"[AUTH] JWKS illisible: {e}")
+        return _JWKS['cles'].get(kid)
+    with _JWKS_VERROU:
+        if cles:
+            _JWKS['cles'] = cles
+        return _JWKS['cles'].get(kid)
+
+
+def _repli_hs256_permis():
+    """Quota de replis distants après une signature HS256 refusée (cf. ci-dessus)."""
+    try:
+        maxi = max(0, int(os.environ.get('AUTH_REPLI_MINUTE', '20')))
+    except ValueError:
+        maxi = 20
+    maintenant = time.time()
+    with _AUTH_VERROU:
+        if maintenant - _AUTH_REPLI['debut'] >= 60:
+            _AUTH_REPLI['debut'], _AUTH_REPLI['n'] = maintenant, 0
+        if _AUTH_REPLI['n'] >= maxi:
+            return False
+        _AUTH_REPLI['n'] += 1
+        _AUTH_STATS['repli_hs256'] += 1
+        return True
+
+
+def _signature_ok(alg, kid, signe, signature):
+    """True/False si la signature a pu être vérifiée, _NON_VERIFIABLE sinon."""
+    if alg == 'HS256':
+        secret = os.environ.get('SUPABASE_JWT_SECRET')
+        if not secret:
+            return _NON_VERIFIABLE
+        attendu = hmac.new(secret.encode(), signe, hashlib.sha256).digest()
+        if hmac.compare_digest(attendu, signature):
+            return True
+        if _repli_hs256_permis():
+            print("[AUTH] signature HS256 refusée localement : vérification par Supabase "
+                  "(SUPABASE_JWT_SECRET à jour ?)")
+            return _NON_VERIFIABLE
+        return False
+    if alg not in ('ES256', 'RS256'):
+        return _NON_VERIFIABLE
+    cle = _cle_jwks(kid)
+    if cle is None:
+        return _NON_VERIFIABLE
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, padding
+    from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+    try:
+        if alg == 'ES256':
+            if len(signature) != 64:
+                return False
+            der = encode_dss_signature(int.from_bytes(signature[:32], 'big'),
+                                       int.from_bytes(signature[32:], 'big'))
+            cle.verify(der, signe, ec.ECDSA(hashes.SHA256()))
+        else:
+            cle.verify(signature, signe, padding.PKCS1v15(), hashes.SHA256())
+        return True
+    except (InvalidSignature, TypeError, ValueError):
+        return False
+
+
+def _verifier_jwt_local(token):
+    """-> (email, exp) si le jeton est valide, None s'il est invalide (signature,
+    expiration, audience), _NON_VERIFIABLE s'il faut demander à Supabase."""
+    try:
+        h64, p64, s64 = token.split('.')
+        entete = json.loads(_b64url(h64))
+        charge = json.loads(_b64url(p64))
+        signature = _b64url(s64)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(entete, dict) or not isinstance(charge, dict):
         return None
+    ok = _signature_ok(entete.get('alg'), entete.get('kid'), f"{h64}.{p64}".encode(), signature)
+    if ok is _NON_VERIFIABLE:
+        return _NON_VERIFIABLE
+    maintenant = time.time()
+    exp = charge.get('exp')
+    if not ok or not isinstance(exp, (int, float)) or exp <= maintenant:
+        return None
+    if isinstance(charge.get('nbf'), (int, float)) and charge['nbf'] > maintenant + 30:
+        return None
+    aud = charge.get('aud')
+    if 'authenticated' not in (aud if isinstance(aud, list) else [aud]):
+        return None     # clé anon/service, pas une session utilisateur
+    return charge.get('email') or 'inconnu', exp
+
+
+def _verifier_jwt_distant(token):
+    """Validation par Supabase Auth (chemin historique) -> (email, exp) ou None."""
     try:
-        r = requests.get(
+        r = supabase_http.get(
             f"{SUPABASE_URL}/auth/v1/user",
             headers={'apikey': SUPABASE_KEY, 'Authorization': f'Bearer {token}'},
             timeout=10)
         if r.status_code != 200:
             return None
         # Retourne l'email de l'utilisateur (sert de "poste de traitement" par défaut).
-        return (r.json() or {}).get('email') or 'inconnu'
+        email = (r.json() or {}).get('email') or 'inconnu'
     except Exception:
         return None
+    try:
+        exp = json.loads(_b64url(token.split('.')[1])).get('exp')
+    except (ValueError, TypeError, IndexError, AttributeError):
+        exp = None
+    return email, exp if isinstance(exp, (int, float)) else None
+
+
+def auth_cache_stats():
+    with _AUTH_VERROU:
+        return dict(_AUTH_STATS, entrees=len(_AUTH_CACHE))
+
+
+def vider_cache_auth():
+    with _AUTH_VERROU:
+        _AUTH_CACHE.clear()
+        for k in _AUTH_STATS:
+            _AUTH_STATS[k] = 0
+        _AUTH_REPLI['debut'], _AUTH_REPLI['n'] = 0.0, 0
+    with _JWKS_VERROU:
+        _JWKS['cles'], _JWKS['lu_a'] = {}, 0.0
+
+
+def verify_user_token(req):
+    """Vérifie le token Supabase de l'utilisateur connecté (login gestionnaire).
+    Le frontend envoie 'Authorization: Bearer <access_token>'. Validé localement
+    si possible, sinon auprès de Supabase Auth (cf. ci-dessus). Retourne l'email
+    de l'utilisateur si valide, sinon None."""
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        return None
+    auth = req.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return None
+    token = auth.split(' ', 1)[1].strip()
+    if not token:
+        return None
+    cle = hashlib.sha256(token.encode()).hexdigest()
+    maintenant = time.time()
+    ttl, maxi = _auth_cache_params()
+    with _AUTH_VERROU:
+        entree = _AUTH_CACHE.get(cle)
+        if entree is not None and entree[1] > maintenant:
+            _AUTH_CACHE.move_to_end(cle)
+            _AUTH_STATS['hit'] += 1
+            return entree[0]
+        if entree is not None:
+            del _AUTH_CACHE[cle]
+    res = _verifier_jwt_local(token)
+    source = 'local'
+    if res is _NON_VERIFIABLE:
+        res, source = _verifier_jwt_distant(token), 'distant'
+    with _AUTH_VERROU:
+        if res is None:
+            _AUTH_STATS['refus'] += 1
+            return None
+        _AUTH_STATS[source] += 1
+        email, exp = res
+        expire_a = maintenant + ttl if exp is None else min(maintenant + ttl, exp)
+        if maxi and expire_a > maintenant:
+            _AUTH_CACHE[cle] = (email, expire_a)
+            _AUTH_CACHE.move_to_end(cle)
+            while len(_AUTH_CACHE) > maxi:
+                _AUTH_CACHE.popitem(last=False)
+    return email
+
+# Colonnes §10 lues par la liste du portail, pas encore créées sur toutes les bases.
+_EMPLOYEURS_COLS_OPT = ('statut', 'numero_employeur', 'manquants', 'message', 'data')
+
+def _guillemets_postgrest(texte):
+    """Valeur de filtre PostgREST entre guillemets : , ( ) : n'y structurent plus
+    le filtre ; " et \\ y sont échappés par une barre oblique inverse."""
+    return '"' + texte.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _motif_recherche(q):
+    """Texte saisi -> motif ilike PostgREST (sous-chaîne), entre guillemets. Les
+    jokers LIKE (% _) deviennent le joker PostgREST *."""
+    q = q.strip()
+    return _guillemets_postgrest('*' + re.sub(r'[%_]', '*', q) + '*') if q else None
+
+
+def _curseur_employeurs(ligne):
+    """Curseur opaque de pagination par clé : (updated_at, num_entreprise) de la
+    dernière ligne servie ; updated_at peut être null (lignes servies en dernier)."""
+    brut = json.dumps([ligne.get('updated_at'), ligne.get('num_entreprise')]).encode()
+    return base64.urlsafe_b64encode(brut).decode().rstrip('=')
+
+
+def _filtre_apres(curseur):
+    """Curseur -> filtre PostgREST « strictement après » dans l'ordre
+    updated_at desc nulls last, num_entreprise desc. ValueError si le curseur
+    est illisible."""
+    try:
+        maj, num = json.loads(_b64url(curseur))
+    except Exception:
+        raise ValueError("curseur 'apres' invalide")
+    if not isinstance(maj, (str, type(None))) or not isinstance(num, str):
+        raise ValueError("curseur 'apres' invalide")
+    num = _guillemets_postgrest(num)
+    if maj is None:                      # déjà dans les lignes sans updated_at
+        return f"and(updated_at.is.null,num_entreprise.lt.{num})"
+    maj = _guillemets_postgrest(maj)
+    return (f"or(updated_at.lt.{maj},and(updated_at.eq.{maj},num_entreprise.lt.{num}),"
+            f"updated_at.is.null)")
+
 
 @app.route('/employeurs', methods=['GET'])
 def list_employeurs():
-    """Liste/recherche les employeurs enregistrés (pour le portail)."""
+    """Liste/recherche les employeurs enregistrés (pour le portail).
+    Query : q (sous-chaîne du nom ou du numéro d'entreprise, cherchée PAR
+    Supabase — ilike), limit (50 par défaut, 200 max), apres (curseur de la page
+    suivante, renvoyé dans l'en-tête X-Suivant), data=0 (sans le blob `data`,
+    pour la recherche au fil de la frappe). Réponse : liste, comme avant."""
     if not SUPABASE_URL or not SUPABASE_KEY:
         return jsonify({"error": "Supabase non configuré"}), 503
     if not verify_user_token(request):
         return jsonify({"error": "Non authentifié"}), 401
-    q = (request.args.get('q') or '').strip().lower()
+    q = (request.args.get('q') or '').strip()
     try:
-        base = f"{SUPABASE_URL}/rest/v1/employeurs?order=updated_at.desc&limit=500"
-        # colonnes §10 (statut/manquants/…) : si elles n'existent pas encore en base,
-        # PostgREST renvoie 400 -> on retombe sur les colonnes de base (ne casse rien).
+        limite = min(max(int(request.args.get('limit') or 50), 1), 200)
+    except ValueError:
+        return jsonify({"error": "limit doit être un entier"}), 400
+    filtres = []
+    motif = _motif_recherche(q)
+    if motif:
+        filtres.append(f"or(nom_societe.ilike.{motif},num_entreprise.ilike.{motif})")
+    if request.args.get('apres'):
+        try:
+            filtres.append(_filtre_apres(request.args['apres']))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    try:
+        # colonnes §10 (statut/manquants/…) : seules celles qui existent en base sont
+        # demandées (sonde du schéma, cf. _colonnes_presentes) -> un seul SELECT.
         # `data` est inclus pour que le portail calcule LUI-MÊME ce qui manque à un
         # règlement (sans dépendre du robot Prisma qui écrit `manquants`).
-        r = requests.get(base + "&select=num_entreprise,nom_societe,email,statut,"
-                         "numero_employeur,manquants,message,data,updated_at",
-                         headers=_supabase_headers(), timeout=10)
-        if r.status_code >= 300:
-            r = requests.get(base + "&select=num_entreprise,nom_societe,email,updated_at",
-                             headers=_supabase_headers(), timeout=10)
+        optionnelles = [c for c in _EMPLOYEURS_COLS_OPT
+                        if c != 'data' or request.args.get('data') != '0']
+        presentes = _colonnes_presentes('employeurs', optionnelles)
+        cols = ['num_entreprise', 'nom_societe', 'email',
+                *(c for c in optionnelles if c in presentes), 'updated_at']
+        # Recherche, tri et page faits par PostgREST : on ne transfère que `limite`
+        # lignes (+1 pour savoir s'il y a une suite). Tri stable par clé
+        # (updated_at, num_entreprise) -> pagination sans OFFSET.
+        params = {'select': ','.join(cols), 'limit': limite + 1,
+                  'order': 'updated_at.desc.nullslast,num_entreprise.desc'}
+        if filtres:
+            params['and'] = f"({','.join(filtres)})"
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/employeurs", params=params,
+                              headers=_supabase_headers(), timeout=10)
+        if r.status_code >= 300 and _erreur_de_colonne(r):
+            vider_cache_schema('employeurs')   # resondé à la prochaine requête
         rows = r.json() if r.status_code < 300 else []
-        if q:
-            rows = [x for x in rows
-                    if q in (x.get('nom_societe') or '').lower()
-                    or q in (x.get('num_entreprise') or '').lower()]
-        return jsonify(rows[:50]), 200
+        resp = jsonify(rows[:limite])
+        if len(rows) > limite:
+            resp.headers['X-Suivant'] = _curseur_employeurs(rows[limite - 1])
+        return resp, 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -314,7 +988,7 @@ def get_employeur(num):
     try:
         import urllib.parse
         nq = urllib.parse.quote(num)
-        r = requests.get(
+        r = supabase_http.get(
             f"{SUPABASE_URL}/rest/v1/employeurs?num_entreprise=eq.{nq}&select=*&limit=1",
             headers=_supabase_headers(), timeout=10)
         rows = r.json() if r.status_code < 300 else []
@@ -342,7 +1016,7 @@ def completer_employeur():
     try:
         import urllib.parse
         nq = urllib.parse.quote(num)
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/employeurs?num_entreprise=eq.{nq}&select=data,statut&limit=1",
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/employeurs?num_entreprise=eq.{nq}&select=data,statut&limit=1",
                          headers=_supabase_headers(), timeout=10)
         rows = r.json() if r.status_code < 300 else []
         if not rows:
@@ -353,7 +1027,7 @@ def completer_employeur():
         # ne doit pas déclencher l'encodage — seul le bouton « Lancer l'encodage » le fait.
         nouveau_statut = 'standby' if rows[0].get('statut') == 'standby' else 'pending'
         hdr = {**_supabase_headers(), 'Content-Type': 'application/json', 'Prefer': 'return=representation'}
-        pr = requests.patch(
+        pr = supabase_http.patch(
             f"{SUPABASE_URL}/rest/v1/employeurs?num_entreprise=eq.{nq}",
             json={'data': data, 'statut': nouveau_statut, 'updated_at': datetime.utcnow().isoformat()},
             headers=hdr, timeout=10)
@@ -382,7 +1056,7 @@ def encoder_employeur():
         nq = urllib.parse.quote(num)
         hdr = {**_supabase_headers(), 'Content-Type': 'application/json',
                'Prefer': 'return=representation'}
-        pr = requests.patch(
+        pr = supabase_http.patch(
             f"{SUPABASE_URL}/rest/v1/employeurs?num_entreprise=eq.{nq}",
             json={'statut': 'pending', 'updated_at': datetime.utcnow().isoformat()},
             headers=hdr, timeout=10)
@@ -397,37 +1071,180 @@ def encoder_employeur():
 
 
 # ============== ÉTAT DE PRESTATIONS (parser) ==============
-def parse_etat_prestation(reader):
-    """Lit un état de prestation Prisma (PDF texte) -> client, période, travailleurs."""
-    lines = []
-    for pg in reader.pages:
-        lines += [l.rstrip() for l in (pg.extract_text() or '').splitlines()]
-    full = "\n".join(lines)
-    client = lines[1].strip() if len(lines) > 1 else ""
-    onss = (re.search(r"No ONSS:\s*([\d-]+)", full) or [None, ""])[1]
-    # Numéro d'employeur Prisma : 1re ligne type "0012/002586" -> 2586
-    mnum = re.search(r"^\s*\d+/0*(\d+)", lines[0]) if lines else None
-    numero_employeur = mnum.group(1) if mnum else ""
-    per = re.search(r"(\d{2}/\d{2}/\d{4})\s*jusqu'au\s*(\d{2}/\d{2}/\d{4})", full)
-    periode = {"debut": per.group(1), "fin": per.group(2)} if per else {}
-    workers = []
-    for i, l in enumerate(lines):
-        m = re.match(r"^(\d{4,5})([A-ZÀ-Ÿ][^\d].*)$", l)
+# Les états Prisma font parfois plusieurs centaines de pages : on ne garde jamais
+# tout le texte. Les pages sont extraites une à une et leurs lignes passent dans
+# _scanner_etat, qui ne garde que les blocs travailleurs en cours (un bloc =
+# _FENETRE_ETAT lignes) ; seules les données retenues s'accumulent.
+# PRESTATIONS_PAGES_MAX borne le nombre de pages lues (au-delà, le résultat est
+# marqué « tronque »).
+_FENETRE_ETAT = 15
+
+
+def _pages_max_etat():
+    try:
+        return max(1, int(os.environ.get('PRESTATIONS_PAGES_MAX', '1000')))
+    except ValueError:
+        return 1000
+
+
+def _lignes_etat(reader, pages_max):
+    """Lignes de l'état, page par page. Le cache d'objets du lecteur est vidé
+    après chaque page : le flux décodé d'une page lue ne reste pas en mémoire."""
+    for n, pg in enumerate(reader.pages):
+        if n >= pages_max:
+            return
+        texte = pg.extract_text() or ''
+        reader.resolved_objects.clear()
+        for l in texte.splitlines():
+            yield l.rstrip()
+
+
+# Automate à un seul passage, motifs compilés une fois. Un bloc travailleur
+# commence sur une ligne « 12345NOM » suivie de « No.rég.nat » et couvre cette
+# ligne et les 14 suivantes : il reste « ouvert » pendant ces lignes, chacune
+# n'étant examinée qu'une fois, sans recoller de tranches.
+_RE_TRAVAILLEUR = re.compile(r"^(\d{4,5})([A-ZÀ-Ÿ][^\d].*)$")
+_RE_NISS = re.compile(r"No\.rég\.nat\.:\s*([\d.]+\s+\d{3}-\d{2})(\d+,\d{2})?")
+_RE_MOIS = re.compile(r"Mois\s+(\d+)")
+_RE_MOIS_EN_FIN = re.compile(r"Mois$")          # « Mois » puis le nombre à la ligne
+_RE_NOMBRE = re.compile(r"\s*(\d+)")
+_RE_DATE = re.compile(r"\d{2}/\d{2}/\d{4}")
+_RE_ONSS = re.compile(r"No ONSS:\s*([\d-]+)")
+_RE_PERIODE = re.compile(r"(\d{2}/\d{2}/\d{4})\s*jusqu'au\s*(\d{2}/\d{2}/\d{4})")
+_RE_NUM_EMPLOYEUR = re.compile(r"^\s*\d+/0*(\d+)")
+
+
+def _avancer_bloc(bloc, l):
+    """Passe la ligne suivante `l` au bloc ouvert : régime (« Mois N », 1re
+    occurrence du bloc) et date d'entrée (1re date à partir de la 3e ligne).
+    Renvoie False quand le bloc n'a plus rien à chercher (il est refermé)."""
+    w = bloc['w']
+    if not w['regime']:
+        m = _RE_NOMBRE.match(l) if bloc['mois'] else None
+        if not m and 'Mois' in l:
+            m = _RE_MOIS.search(l)
+            bloc['mois'] = not m and _RE_MOIS_EN_FIN.search(l) is not None
+        elif not m:
+            bloc['mois'] = bloc['mois'] and not l.strip()
+        if m:
+            w['regime'] = m.group(1)
+    if not w['date_entree'] and bloc['vues'] >= 2 and '/' in l:
+        m = _RE_DATE.search(l)
+        if m:
+            w['date_entree'] = m.group(0)
+    bloc['vues'] += 1
+    return bloc['vues'] < _FENETRE_ETAT and not (w['regime'] and w['date_entree'])
+
+
+def _scanner_etat(lignes):
+    """Lignes d'un état (itérable, parcouru une seule fois) -> données structurées."""
+    entete, workers, ouverts = [], [], []
+    recentes = deque(maxlen=3)           # en-tête : 3 dernières lignes non vides
+    onss = per = candidat = None
+    for l in lignes:
+        if len(entete) < 2:
+            entete.append(l)
+        if (onss is None or per is None) and l.strip():
+            # une valeur peut passer à la ligne (\s* des motifs), lignes vides comprises
+            recentes.append(l)
+            if onss is None and any('No ONSS:' in r for r in recentes):
+                onss = _RE_ONSS.search("\n".join(recentes))
+            if per is None and any("jusqu'au" in r for r in recentes):
+                per = _RE_PERIODE.search("\n".join(recentes))
         # un vrai travailleur : la ligne suivante commence par "No.rég.nat"
-        if not m or i + 1 >= len(lines) or not lines[i + 1].lstrip().startswith("No.rég.nat"):
-            continue
-        bloc = "\n".join(lines[i:i + 15])
-        reg = re.search(r"No\.rég\.nat\.:\s*([\d.]+\s+\d{3}-\d{2})(\d+,\d{2})?", lines[i + 1])
-        regime = re.search(r"Mois\s+(\d+)", bloc)
-        entree = re.search(r"(\d{2}/\d{2}/\d{4})", "\n".join(lines[i + 2:i + 15]))
-        workers.append({
-            "matricule": m.group(1), "nom": m.group(2).strip(),
-            "niss": reg.group(1) if reg else "",
-            "heures_jour": (reg.group(2) if reg and reg.group(2) else ""),
-            "regime": regime.group(1) if regime else "",
-            "date_entree": entree.group(1) if entree else "",
-        })
-    return {"client": client, "onss": onss, "numero_employeur": numero_employeur, "periode": periode, "travailleurs": workers}
+        if candidat and l.lstrip().startswith("No.rég.nat"):
+            reg = _RE_NISS.search(l)
+            bloc = {'vues': 0, 'mois': False, 'w': {
+                "matricule": candidat.group(1), "nom": candidat.group(2).strip(),
+                "niss": reg.group(1) if reg else "",
+                "heures_jour": (reg.group(2) if reg and reg.group(2) else ""),
+                "regime": "", "date_entree": ""}}
+            workers.append(bloc['w'])
+            if _avancer_bloc(bloc, candidat.string):
+                ouverts.append(bloc)
+        if ouverts:
+            ouverts = [b for b in ouverts if _avancer_bloc(b, l)]
+        candidat = _RE_TRAVAILLEUR.match(l) if l[:1].isdigit() else None
+    client = entete[1].strip() if len(entete) > 1 else ""
+    # Numéro d'employeur Prisma : 1re ligne type "0012/002586" -> 2586
+    mnum = _RE_NUM_EMPLOYEUR.search(entete[0]) if entete else None
+    return {"client": client, "onss": onss[1] if onss else "",
+            "numero_employeur": mnum.group(1) if mnum else "",
+            "periode": {"debut": per.group(1), "fin": per.group(2)} if per else {},
+            "travailleurs": workers}
+
+
+def parse_etat_prestation(reader, pages_max=None):
+    """Lit un état de prestation Prisma (PDF texte) -> client, période, travailleurs.
+    Mémoire bornée : une page extraite à la fois, seuls les blocs en cours gardés."""
+    if pages_max is None:
+        pages_max = _pages_max_etat()
+    r = _scanner_etat(_lignes_etat(reader, pages_max))
+    r["tronque"] = len(reader.pages) > pages_max
+    return r
+
+# Cache des états déjà lus : les gestionnaires renvoient souvent le même état
+# (rafraîchissement de page, collègue sur la même période). Clé = SHA-256 de
+# l'upload (calculé pendant la recopie, sans relecture) + version du parser +
+# limite de pages ; un état identique est resservi sans extraction de texte.
+# LRU en mémoire, CACHE_ETATS_MAX entrées (64 par défaut) ; CACHE_ETATS=0 coupe.
+# À incrémenter dès que la sortie de parse_etat_prestation change.
+_VERSION_PARSER_ETAT = 2
+_CACHE_ETATS = OrderedDict()     # clé -> résultat, du moins au plus récent
+_CACHE_ETATS_VERROU = threading.Lock()
+_CACHE_ETATS_STATS = {'hit': 0, 'miss': 0}
+
+
+def _cache_etats_max():
+    if os.environ.get('CACHE_ETATS', '1') == '0':
+        return 0
+    try:
+        return max(0, int(os.environ.get('CACHE_ETATS_MAX', '64')))
+    except ValueError:
+        return 64
+
+
+def _etat_en_cache(cle):
+    with _CACHE_ETATS_VERROU:
+        r = _CACHE_ETATS.get(cle)
+        if r is not None:
+            _CACHE_ETATS.move_to_end(cle)
+        _CACHE_ETATS_STATS['hit' if r is not None else 'miss'] += 1
+        return r
+
+
+def _memoriser_etat(cle, resultat, maxi):
+    with _CACHE_ETATS_VERROU:
+        _CACHE_ETATS[cle] = resultat
+        _CACHE_ETATS.move_to_end(cle)
+        while len(_CACHE_ETATS) > maxi:
+            _CACHE_ETATS.popitem(last=False)
+
+
+def _recopier_upload(f, dest):
+    """Recopie l'upload `f` par morceaux dans le fichier `dest` -> SHA-256 (hex)."""
+    empreinte = hashlib.sha256()
+    for morceau in iter(lambda: f.stream.read(1 << 16), b''):
+        empreinte.update(morceau)
+        dest.write(morceau)
+    return empreinte.hexdigest()
+
+
+def _cle_etat(empreinte, pages_max):
+    return f"{empreinte}:{_VERSION_PARSER_ETAT}:{pages_max}"
+
+
+def cache_etats_stats():
+    with _CACHE_ETATS_VERROU:
+        return dict(_CACHE_ETATS_STATS, entrees=len(_CACHE_ETATS))
+
+
+def vider_cache_etats():
+    with _CACHE_ETATS_VERROU:
+        _CACHE_ETATS.clear()
+        for k in _CACHE_ETATS_STATS:
+            _CACHE_ETATS_STATS[k] = 0
+
 
 @app.route('/parse-prestations', methods=['POST'])
 def parse_prestations():
@@ -440,9 +1257,120 @@ def parse_prestations():
     if not f:
         return jsonify({"error": "Aucun fichier"}), 400
     try:
-        return jsonify(parse_etat_prestation(PdfReader(f))), 200
+        # upload recopié par morceaux dans un fichier temporaire : pypdf y lit
+        # à la demande au lieu de garder le PDF entier en mémoire
+        with tempfile.TemporaryFile() as tmp:
+            pages_max = _pages_max_etat()
+            cle = _cle_etat(_recopier_upload(f, tmp), pages_max)
+            maxi = _cache_etats_max()
+            resultat = _etat_en_cache(cle) if maxi else None
+            if resultat is not None:
+                etat_cache = 'hit'
+            else:
+                etat_cache = 'miss' if maxi else 'off'
+                tmp.seek(0)
+                with _chrono('parse'):
+                    resultat = parse_etat_prestation(PdfReader(tmp), pages_max=pages_max)
+                if maxi:
+                    _memoriser_etat(cle, resultat, maxi)
+        rep = jsonify(resultat)
+        rep.headers['X-Cache-Etat'] = etat_cache
+        return rep, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# --- Plusieurs états en une requête ---------------------------------------------
+# En fin de mois, une gestionnaire charge des dizaines d'états (un par client).
+# /parse-prestations-lot les reçoit en un seul multipart (champ `files` répété)
+# et les répartit sur le pool de processus de /download-all-zip (ZIP_PROCESSUS) :
+# l'extraction pypdf est du pur CPU. Chaque fichier passe d'abord par le cache
+# des états ; il est lu depuis un fichier temporaire, le processus ne reçoit que
+# son chemin. Deux fichiers identiques (même clé de cache) ne sont lus qu'une fois.
+# Réponse : un résultat par nom de fichier, avec son erreur et sa durée.
+LOT_ETATS_MAX = 100
+
+
+def _parser_etat_fichier(chemin, pages_max):
+    """Exécuté dans le pool (ou sur place) : chemin d'un état -> (résultat, ms)."""
+    t0 = time.perf_counter()
+    with open(chemin, 'rb') as fh:
+        r = parse_etat_prestation(PdfReader(fh), pages_max=pages_max)
+    return r, (time.perf_counter() - t0) * 1000
+
+
+def _parser_etat_sur_place(chemin, pages_max):
+    t0 = time.perf_counter()
+    try:
+        return _parser_etat_fichier(chemin, pages_max) + (None,)
+    except Exception as e:
+        return None, (time.perf_counter() - t0) * 1000, e
+
+
+def parser_etats(chemins, pages_max):
+    """Chemins d'états -> [(résultat | None, ms, erreur | None)] DANS L'ORDRE,
+    en parallèle sur le pool ; une erreur ne concerne que son fichier. ms : durée
+    de lecture mesurée par le processus ; en cas d'erreur, temps écoulé côté
+    worker depuis la soumission (jamais None)."""
+    if _taille_pool() <= 1 or len(chemins) <= 1:
+        return [_parser_etat_sur_place(c, pages_max) for c in chemins]
+    t0 = time.perf_counter()
+    futurs = [_soumettre(_parser_etat_fichier, c, pages_max) for c in chemins]
+    sorties = []
+    for chemin, futur in zip(chemins, futurs):
+        try:
+            sorties.append(_attendre(futur, lambda c=chemin: _parser_etat_fichier(c, pages_max))
+                           + (None,))
+        except Exception as e:
+            sorties.append((None, (time.perf_counter() - t0) * 1000, e))
+    return sorties
+
+
+@app.route('/parse-prestations-lot', methods=['POST'])
+def parse_prestations_lot():
+    """Plusieurs états Prisma -> {"fichiers": {nom: {ok, ms, cache, resultat | error}},
+    "ordre": [noms dans l'ordre d'envoi], "ms": durée totale}."""
+    if not verify_user_token(request):
+        return jsonify({"error": "Non authentifié"}), 401
+    fichiers = request.files.getlist('files') or request.files.getlist('file')
+    if not fichiers:
+        return jsonify({"error": "Aucun fichier"}), 400
+    if len(fichiers) > LOT_ETATS_MAX:
+        return jsonify({"error": f"{LOT_ETATS_MAX} fichiers maximum par lot"}), 400
+    t0 = time.perf_counter()
+    pages_max, maxi = _pages_max_etat(), _cache_etats_max()
+    sortie, a_lire = {}, {}              # a_lire : clé de cache -> (chemin, [noms])
+    try:
+        with tempfile.TemporaryDirectory() as dossier:
+            for i, f in enumerate(fichiers):
+                base = f.filename or f'etat_{i + 1}.pdf'
+                nom, n = base, 2
+                while nom in sortie:         # deux fichiers du même nom : « x.pdf (2) »
+                    nom, n = f'{base} ({n})', n + 1
+                chemin = os.path.join(dossier, f'{i}.pdf')
+                with open(chemin, 'wb') as dest:
+                    cle = _cle_etat(_recopier_upload(f, dest), pages_max)
+                r = _etat_en_cache(cle) if maxi else None
+                sortie[nom] = {"ok": True, "ms": 0.0, "cache": "hit", "resultat": r}
+                if r is None:
+                    a_lire.setdefault(cle, (chemin, []))[1].append(nom)
+            with _chrono('parse'):
+                lus = parser_etats([c for c, _noms in a_lire.values()], pages_max)
+        for (cle, (_c, noms)), (r, ms, err) in zip(a_lire.items(), lus):
+            if err is not None:
+                print(f"[ETATS] {', '.join(noms)} : {err}")
+                entree = {"ok": False, "ms": round(ms, 1), "error": str(err)}
+            else:
+                entree = {"ok": True, "ms": round(ms, 1), "cache": "miss" if maxi else "off",
+                          "resultat": r}
+            for nom in noms:
+                sortie[nom] = entree
+            if maxi and err is None:
+                _memoriser_etat(cle, r, maxi)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    return jsonify({"fichiers": sortie, "ordre": list(sortie),   # jsonify trie les clés
+                    "ms": round((time.perf_counter() - t0) * 1000, 1)}), 200
 
 # ============== PRESTATIONS -> PRISMA (pont avec l'automatisation Mode D) ==============
 # Correspondance codes portail -> codes paie Prisma.
@@ -521,21 +1449,18 @@ def save_prestations():
     }
     avantages = d.get('avantages')
     if avantages:
-        row['avantages'] = avantages  # nécessite la colonne 'avantages' (sinon repli auto ci-dessous)
+        row['avantages'] = avantages  # colonne 'avantages' : omise si absente (sonde du schéma)
 
     def _push(payload):
-        return requests.post(
+        return supabase_http.post(
             f"{SUPABASE_URL}/rest/v1/prestations?on_conflict=employeur,periode,poste",
             headers={**_supabase_headers(), 'Content-Type': 'application/json',
                      'Prefer': 'resolution=merge-duplicates,return=minimal'},
             json=payload, timeout=10)
     try:
-        r = _push(row)
-        # Repli : si la colonne 'avantages' n'existe pas encore, on réessaie sans, pour
-        # ne jamais bloquer l'enregistrement des prestations.
-        if r.status_code >= 300 and 'avantages' in row and 'avantages' in (r.text or ''):
-            row.pop('avantages', None)
-            r = _push(row)
+        # Sans la colonne 'avantages' en base, le push part sans elle : on ne bloque
+        # jamais l'enregistrement des prestations.
+        r = _envoyer_selon_schema('prestations', _push, row, ('avantages',))
         if r.status_code >= 300:
             return jsonify({"error": f"Supabase {r.status_code}: {r.text[:200]}"}), 500
         return jsonify({"ok": True, "employeur": employeur, "periode": periode,
@@ -561,7 +1486,7 @@ def get_prestations():
         import urllib.parse
         q = (f"employeur=eq.{urllib.parse.quote(employeur)}"
              f"&periode=eq.{urllib.parse.quote(periode)}&select=*&limit=1")
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/prestations?{q}", headers=_supabase_headers(), timeout=10)
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/prestations?{q}", headers=_supabase_headers(), timeout=10)
         rows = r.json() if r.status_code < 300 else []
         if not rows:
             return jsonify({"error": "Aucune prestation trouvée pour cet employeur/période"}), 404
@@ -584,7 +1509,7 @@ def prestations_mes():
         q = (f"poste=in.({urllib.parse.quote(postes)})"
              f"&select=employeur,periode,client_nom,statut,poste,updated_at,etats"
              f"&order=updated_at.desc&limit=200")
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/prestations?{q}", headers=_supabase_headers(), timeout=10)
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/prestations?{q}", headers=_supabase_headers(), timeout=10)
         rows = r.json() if r.status_code < 300 else []
         # allège : nb travailleurs au lieu du détail etats
         for row in (rows if isinstance(rows, list) else []):
@@ -612,7 +1537,7 @@ def prestations_a_traiter():
         import urllib.parse
         q = (f"statut=eq.a_traiter&poste=eq.{urllib.parse.quote(poste)}"
              f"&select=*&order=updated_at.asc")
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/prestations?{q}", headers=_supabase_headers(), timeout=10)
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/prestations?{q}", headers=_supabase_headers(), timeout=10)
         rows = r.json() if r.status_code < 300 else []
         return jsonify(rows if isinstance(rows, list) else []), 200
     except Exception as e:
@@ -643,7 +1568,7 @@ def prestations_marquer_traite():
         q = (f"employeur=eq.{urllib.parse.quote(employeur)}"
              f"&periode=eq.{urllib.parse.quote(periode)}"
              f"&poste=eq.{urllib.parse.quote(poste)}")
-        r = requests.patch(
+        r = supabase_http.patch(
             f"{SUPABASE_URL}/rest/v1/prestations?{q}",
             headers={**_supabase_headers(), 'Content-Type': 'application/json', 'Prefer': 'return=minimal'},
             json={'statut': statut, 'updated_at': datetime.now().isoformat()}, timeout=10)
@@ -670,7 +1595,7 @@ def save_roster():
     row = {'employeur': employeur, 'client_nom': d.get('client') or '',
            'travailleurs': travailleurs, 'updated_at': datetime.now().isoformat()}
     try:
-        r = requests.post(
+        r = supabase_http.post(
             f"{SUPABASE_URL}/rest/v1/rosters?on_conflict=employeur",
             headers={**_supabase_headers(), 'Content-Type': 'application/json',
                      'Prefer': 'resolution=merge-duplicates,return=minimal'},
@@ -694,7 +1619,7 @@ def get_roster():
     try:
         import urllib.parse
         q = f"employeur=eq.{urllib.parse.quote(employeur)}&select=*&limit=1"
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/rosters?{q}", headers=_supabase_headers(), timeout=10)
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/rosters?{q}", headers=_supabase_headers(), timeout=10)
         rows = r.json() if r.status_code < 300 else []
         return jsonify(rows[0] if rows else {"employeur": employeur, "travailleurs": []}), 200
     except Exception as e:
@@ -722,7 +1647,7 @@ def paie_lancer():
         'statut': 'pending', 'evenements': [],
     }
     try:
-        r = requests.post(
+        r = supabase_http.post(
             f"{SUPABASE_URL}/rest/v1/paie_jobs",
             headers={**_supabase_headers(), 'Content-Type': 'application/json', 'Prefer': 'return=representation'},
             json=row, timeout=10)
@@ -746,7 +1671,7 @@ def paie_a_traiter():
         import urllib.parse
         q = (f"statut=eq.pending&poste=eq.{urllib.parse.quote(poste)}"
              f"&select=*&order=created_at.asc")
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/paie_jobs?{q}", headers=_supabase_headers(), timeout=10)
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/paie_jobs?{q}", headers=_supabase_headers(), timeout=10)
         return jsonify(r.json() if r.status_code < 300 else []), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -767,7 +1692,7 @@ def paie_maj():
     if 'evenements' in d:
         patch['evenements'] = d['evenements']
     try:
-        r = requests.patch(
+        r = supabase_http.patch(
             f"{SUPABASE_URL}/rest/v1/paie_jobs?id=eq.{int(job_id)}",
             headers={**_supabase_headers(), 'Content-Type': 'application/json', 'Prefer': 'return=minimal'},
             json=patch, timeout=10)
@@ -784,7 +1709,7 @@ def paie_job(job_id):
         return jsonify({"error": "Non authentifié"}), 401
     try:
         q = f"id=eq.{job_id}&select=*&limit=1"
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/paie_jobs?{q}", headers=_supabase_headers(), timeout=10)
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/paie_jobs?{q}", headers=_supabase_headers(), timeout=10)
         rows = r.json() if r.status_code < 300 else []
         if not rows:
             return jsonify({"error": "Job introuvable"}), 404
@@ -813,7 +1738,7 @@ def affiliations_a_traiter():
         return jsonify({"error": "Supabase non configuré"}), 503
     try:
         q = "statut=in.(pending,a_encoder)&order=created_at.asc&select=*"
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/employeurs?{q}",
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/employeurs?{q}",
                          headers=_supabase_headers(), timeout=15)
         return jsonify(r.json() if r.status_code < 300 else []), 200
     except Exception as e:
@@ -826,8 +1751,8 @@ _AFFIL_COLS_OPT = ('manquants', 'institutions')
 @app.route('/affiliations/maj', methods=['POST'])
 def affiliations_maj():
     """Le veilleur met à jour une affiliation : statut, n° employeur, message, date de
-    traitement, et éventuellement checklist/institutions. Si une colonne optionnelle
-    n'existe pas encore, on retente sans elle (au lieu d'échouer)."""
+    traitement, et éventuellement checklist/institutions. Une colonne optionnelle
+    qui n'existe pas encore en base n'est pas envoyée (sonde du schéma)."""
     if not _veilleur_autorise(request):
         return jsonify({"error": "Non autorisé"}), 401
     if not SUPABASE_URL or not SUPABASE_KEY:
@@ -846,12 +1771,9 @@ def affiliations_maj():
     url = f"{SUPABASE_URL}/rest/v1/employeurs?id=eq.{id_}"
     hdr = {**_supabase_headers(), 'Content-Type': 'application/json', 'Prefer': 'return=minimal'}
     try:
-        r = requests.patch(url, headers=hdr, json=champs, timeout=15)
-        if r.status_code >= 300:
-            absentes = [c for c in _AFFIL_COLS_OPT if c in champs and c in (r.text or '')]
-            if absentes:
-                champs = {k: v for k, v in champs.items() if k not in absentes}
-                r = requests.patch(url, headers=hdr, json=champs, timeout=15)
+        r = _envoyer_selon_schema(
+            'employeurs', lambda p: supabase_http.patch(url, headers=hdr, json=p, timeout=15),
+            champs, _AFFIL_COLS_OPT)
         if r.status_code >= 300:
             return jsonify({"error": f"Supabase {r.status_code}: {r.text[:200]}"}), 500
         return jsonify({"ok": True}), 200
@@ -868,7 +1790,7 @@ def affiliations_recuperer_orphelines():
     if not SUPABASE_URL or not SUPABASE_KEY:
         return jsonify({"error": "Supabase non configuré"}), 503
     try:
-        r = requests.patch(
+        r = supabase_http.patch(
             f"{SUPABASE_URL}/rest/v1/employeurs?statut=eq.processing",
             headers={**_supabase_headers(), 'Content-Type': 'application/json',
                      'Prefer': 'return=representation'},
@@ -903,7 +1825,7 @@ def affiliations_creer():
         'updated_at': datetime.now().isoformat(),
     }
     try:
-        r = requests.post(
+        r = supabase_http.post(
             f"{SUPABASE_URL}/rest/v1/employeurs?on_conflict=num_entreprise",
             headers={**_supabase_headers(), 'Content-Type': 'application/json',
                      'Prefer': 'resolution=merge-duplicates,return=representation'},
@@ -926,7 +1848,7 @@ def affiliations_liste():
         return jsonify({"error": "Supabase non configuré"}), 503
     try:
         cols = "id,num_entreprise,nom_societe,statut,numero_employeur,updated_at"
-        r = requests.get(
+        r = supabase_http.get(
             f"{SUPABASE_URL}/rest/v1/employeurs?select={cols}&order=updated_at.desc&limit=200",
             headers=_supabase_headers(), timeout=15)
         return jsonify(r.json() if r.status_code < 300 else []), 200
@@ -1065,7 +1987,7 @@ def lectures_demande():
         return jsonify({"error": "numéro de dossier Prisma requis (chiffres seulement)"}), 400
     if not d.get('forcer'):
         try:
-            r = requests.get(
+            r = supabase_http.get(
                 _cmd_url("?commande=eq.lecture_fiche&statut=eq.done"
                          f"&args->>numero=eq.{numero}"
                          "&order=traite_at.desc&limit=1&select=id,traite_at,resultat"),
@@ -1085,7 +2007,7 @@ def lectures_demande():
         except Exception:
             pass                     # cache indisponible -> lecture normale
     try:
-        r = requests.post(
+        r = supabase_http.post(
             _cmd_url(),
             headers={**_supabase_headers(), 'Content-Type': 'application/json',
                      'Prefer': 'return=representation'},
@@ -1109,7 +2031,7 @@ def lectures_a_faire():
     if not SUPABASE_URL or not SUPABASE_KEY:
         return jsonify({"error": "Supabase non configuré"}), 503
     try:
-        r = requests.patch(
+        r = supabase_http.patch(
             _cmd_url("?commande=eq.lecture_fiche&statut=eq.pending"),
             headers={**_supabase_headers(), 'Content-Type': 'application/json',
                      'Prefer': 'return=representation'},
@@ -1150,7 +2072,7 @@ def lectures_resultat():
               "resultat": json.dumps(corps, ensure_ascii=False),
               "traite_at": datetime.now().isoformat()}
     try:
-        r = requests.patch(_cmd_url(f"?id=eq.{id_}"),
+        r = supabase_http.patch(_cmd_url(f"?id=eq.{id_}"),
                            headers={**_supabase_headers(), 'Content-Type': 'application/json',
                                     'Prefer': 'return=minimal'},
                            json=champs, timeout=15)
@@ -1173,7 +2095,7 @@ def lectures_etat():
     if not re.fullmatch(r'\d{1,12}', id_):
         return jsonify({"error": "id requis (entier)"}), 400
     try:
-        r = requests.get(_cmd_url(f"?id=eq.{id_}&select=id,statut,resultat,created_at"),
+        r = supabase_http.get(_cmd_url(f"?id=eq.{id_}&select=id,statut,resultat,created_at"),
                          headers=_supabase_headers(), timeout=15)
         rows = r.json() if r.status_code < 300 else []
         if not rows:
@@ -1490,7 +2412,7 @@ def fdp_liste():
         q = "select=*&order=id.asc&limit=500"
         if mois:
             q = f"mois=eq.{mois}&" + q
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/suivi_fdp?{q}",
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/suivi_fdp?{q}",
                          headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
@@ -1515,12 +2437,12 @@ def fdp_upsert():
            'Prefer': 'return=representation'}
     try:
         if d.get('id'):
-            r = requests.patch(f"{SUPABASE_URL}/rest/v1/suivi_fdp?id=eq.{int(d['id'])}",
+            r = supabase_http.patch(f"{SUPABASE_URL}/rest/v1/suivi_fdp?id=eq.{int(d['id'])}",
                                json=row, headers=hdr, timeout=10)
         else:
             if not (row.get('mois') and str(row.get('entreprise') or '').strip()):
                 return jsonify({"error": "mois et entreprise requis"}), 400
-            r = requests.post(f"{SUPABASE_URL}/rest/v1/suivi_fdp",
+            r = supabase_http.post(f"{SUPABASE_URL}/rest/v1/suivi_fdp",
                               json=row, headers=hdr, timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
@@ -1540,7 +2462,7 @@ def fdp_supprimer():
     if not d.get('id'):
         return jsonify({"error": "id requis"}), 400
     try:
-        r = requests.delete(f"{SUPABASE_URL}/rest/v1/suivi_fdp?id=eq.{int(d['id'])}",
+        r = supabase_http.delete(f"{SUPABASE_URL}/rest/v1/suivi_fdp?id=eq.{int(d['id'])}",
                             headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
@@ -1549,6 +2471,67 @@ def fdp_supprimer():
         return jsonify({"error": str(e)}), 500
 
 
+# ============== RÉPERTOIRES EN CACHE (institutions, commissions) ==============
+# Chaque /reglement/generer relisait les deux répertoires (jusqu'à 1 000 lignes
+# chacun) et les réindexait, alors qu'ils changent quelques fois par mois. Ici :
+# cache par processus, REPERTOIRES_TTL secondes (600 par défaut, 0 = coupé),
+# vidé dès que CE processus écrit via /institutions|commissions/upsert|supprimer
+# (les autres workers voient la modification au plus tard après le TTL). L'index
+# (noms d'institutions normalisés, lookup des CP) est construit au chargement,
+# une fois. Un échec de lecture n'est PAS mis en cache.
+_REPERTOIRES = {}        # table -> (lu_a, lignes, index)
+_REPERTOIRES_VERROU = threading.Lock()
+
+
+def _repertoires_ttl():
+    try:
+        return max(0, int(os.environ.get('REPERTOIRES_TTL', '600')))
+    except ValueError:
+        return 600
+
+
+def _indexer_repertoire(table, lignes):
+    from reglement_gen import index_cp, index_institutions
+    return index_institutions(lignes) if table == 'institutions' else index_cp(lignes)
+
+
+def _repertoire(table):
+    """(lignes, index) du répertoire `table` ('institutions' | 'commissions'),
+    depuis le cache ou Supabase. ([], None) si indisponible."""
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        return [], None
+    ttl = _repertoires_ttl()
+    with _REPERTOIRES_VERROU:
+        entree = _REPERTOIRES.get(table)
+    if entree and time.time() - entree[0] < ttl:
+        return entree[1], entree[2]
+    try:
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/{table}?select=*&limit=1000",
+                              headers=_supabase_headers(), timeout=10)
+        lignes = r.json() if r.status_code < 300 else None
+    except Exception:
+        lignes = None
+    if not isinstance(lignes, list):
+        return [], None
+    index = _indexer_repertoire(table, lignes)
+    if ttl:
+        with _REPERTOIRES_VERROU:
+            _REPERTOIRES[table] = (time.time(), lignes, index)
+    return lignes, index
+
+
+def vider_cache_repertoires(table=None):
+    with _REPERTOIRES_VERROU:
+        for t in [t for t in _REPERTOIRES if table is None or t == table]:
+            del _REPERTOIRES[t]
+
+
+def repertoires_stats():
+    """Lignes en cache par répertoire (pour /debug-config)."""
+    with _REPERTOIRES_VERROU:
+        return {t: len(e[1]) for t, e in _REPERTOIRES.items()}
+
+
 # ============== RÉPERTOIRE DES INSTITUTIONS ==============
 # Adresses des organismes (caisse vacances, assurance-loi, fonds, SEPPT, bureaux
 # de contrôle…), saisies UNE fois, réutilisées dans les règlements par leur nom.
@@ -1564,7 +2547,7 @@ def institutions_liste():
     if not SUPABASE_URL or not SUPABASE_KEY:
         return jsonify({"error": "Supabase non configuré"}), 503
     try:
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/institutions?select=*&order=type.asc,nom.asc&limit=1000",
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/institutions?select=*&order=type.asc,nom.asc&limit=1000",
                          headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
@@ -1586,14 +2569,15 @@ def institutions_upsert():
     hdr = {**_supabase_headers(), 'Content-Type': 'application/json', 'Prefer': 'return=representation'}
     try:
         if d.get('id'):
-            r = requests.patch(f"{SUPABASE_URL}/rest/v1/institutions?id=eq.{int(d['id'])}",
+            r = supabase_http.patch(f"{SUPABASE_URL}/rest/v1/institutions?id=eq.{int(d['id'])}",
                                json=row, headers=hdr, timeout=10)
         else:
             if not str(row.get('nom') or '').strip():
                 return jsonify({"error": "nom requis"}), 400
-            r = requests.post(f"{SUPABASE_URL}/rest/v1/institutions", json=row, headers=hdr, timeout=10)
+            r = supabase_http.post(f"{SUPABASE_URL}/rest/v1/institutions", json=row, headers=hdr, timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
+        vider_cache_repertoires('institutions')
         out = r.json()
         return jsonify(out[0] if isinstance(out, list) and out else out), 200
     except Exception as e:
@@ -1609,27 +2593,16 @@ def institutions_supprimer():
     if not d.get('id'):
         return jsonify({"error": "id requis"}), 400
     try:
-        r = requests.delete(f"{SUPABASE_URL}/rest/v1/institutions?id=eq.{int(d['id'])}",
+        r = supabase_http.delete(f"{SUPABASE_URL}/rest/v1/institutions?id=eq.{int(d['id'])}",
                             headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
+        vider_cache_repertoires('institutions')
         return jsonify({"ok": True}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-def _institutions_repertoire():
-    """Charge le répertoire (liste de dicts) depuis Supabase, ou []."""
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        return []
-    try:
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/institutions?select=*&limit=1000",
-                         headers=_supabase_headers(), timeout=10)
-        return r.json() if r.status_code < 300 and isinstance(r.json(), list) else []
-    except Exception:
-        return []
-
-
 # ============== RÉPERTOIRE DES COMMISSIONS PARITAIRES ==============
 # Par CP : n° + dénomination + temps plein (heures/semaine). Sert à pré-remplir
 # automatiquement le temps plein dans le règlement dès qu'on tape le n° de CP.
@@ -1644,7 +2617,7 @@ def commissions_liste():
     if not SUPABASE_URL or not SUPABASE_KEY:
         return jsonify({"error": "Supabase non configuré"}), 503
     try:
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/commissions?select=*&order=cp.asc&limit=1000",
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/commissions?select=*&order=cp.asc&limit=1000",
                          headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
@@ -1666,14 +2639,15 @@ def commissions_upsert():
     hdr = {**_supabase_headers(), 'Content-Type': 'application/json', 'Prefer': 'return=representation'}
     try:
         if d.get('id'):
-            r = requests.patch(f"{SUPABASE_URL}/rest/v1/commissions?id=eq.{int(d['id'])}",
+            r = supabase_http.patch(f"{SUPABASE_URL}/rest/v1/commissions?id=eq.{int(d['id'])}",
                                json=row, headers=hdr, timeout=10)
         else:
             if not str(row.get('cp') or '').strip():
                 return jsonify({"error": "n° CP requis"}), 400
-            r = requests.post(f"{SUPABASE_URL}/rest/v1/commissions", json=row, headers=hdr, timeout=10)
+            r = supabase_http.post(f"{SUPABASE_URL}/rest/v1/commissions", json=row, headers=hdr, timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
+        vider_cache_repertoires('commissions')
         out = r.json()
         return jsonify(out[0] if isinstance(out, list) and out else out), 200
     except Exception as e:
@@ -1689,26 +2663,16 @@ def commissions_supprimer():
     if not d.get('id'):
         return jsonify({"error": "id requis"}), 400
     try:
-        r = requests.delete(f"{SUPABASE_URL}/rest/v1/commissions?id=eq.{int(d['id'])}",
+        r = supabase_http.delete(f"{SUPABASE_URL}/rest/v1/commissions?id=eq.{int(d['id'])}",
                             headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
+        vider_cache_repertoires('commissions')
         return jsonify({"ok": True}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-def _commissions_repertoire():
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        return []
-    try:
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/commissions?select=*&limit=1000",
-                         headers=_supabase_headers(), timeout=10)
-        return r.json() if r.status_code < 300 and isinstance(r.json(), list) else []
-    except Exception:
-        return []
-
-
 # ============== CHANTIERS (tableau de bord partagé Dims <-> Claude PC06) ==============
 # La page « Chantiers » du portail et le Claude du PC 06 lisent/écrivent la MÊME
 # table Supabase `chantiers` : une seule source de vérité pour l'avancement.
@@ -1737,7 +2701,7 @@ def chantiers_liste():
     if not SUPABASE_URL or not SUPABASE_KEY:
         return jsonify({"error": "Supabase non configuré"}), 503
     try:
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/chantiers?select=*"
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/chantiers?select=*"
                          "&order=fiche.asc,ordre.asc,id.asc&limit=1000",
                          headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
@@ -1765,14 +2729,14 @@ def chantiers_upsert():
            'Prefer': 'return=representation'}
     try:
         if d.get('id'):
-            r = requests.patch(f"{SUPABASE_URL}/rest/v1/chantiers?id=eq.{int(d['id'])}",
+            r = supabase_http.patch(f"{SUPABASE_URL}/rest/v1/chantiers?id=eq.{int(d['id'])}",
                                json=row, headers=hdr, timeout=10)
         else:
             if not str(row.get('titre') or '').strip():
                 return jsonify({"error": "titre requis"}), 400
             row.setdefault('fiche', 'Divers')
             row['cree_par'] = qui
-            r = requests.post(f"{SUPABASE_URL}/rest/v1/chantiers", json=row,
+            r = supabase_http.post(f"{SUPABASE_URL}/rest/v1/chantiers", json=row,
                               headers=hdr, timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
@@ -1790,7 +2754,7 @@ def chantiers_supprimer():
     if not d.get('id'):
         return jsonify({"error": "id requis"}), 400
     try:
-        r = requests.delete(f"{SUPABASE_URL}/rest/v1/chantiers?id=eq.{int(d['id'])}",
+        r = supabase_http.delete(f"{SUPABASE_URL}/rest/v1/chantiers?id=eq.{int(d['id'])}",
                             headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
@@ -1814,7 +2778,7 @@ def itia_liste():
     if not SUPABASE_URL or not SUPABASE_KEY:
         return jsonify({"error": "Supabase non configuré"}), 503
     try:
-        r = requests.get(f"{SUPABASE_URL}/rest/v1/suivi_itia?select=*"
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/suivi_itia?select=*"
                          "&order=ordre.asc,id.asc&limit=1000",
                          headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
@@ -1842,13 +2806,13 @@ def itia_upsert():
            'Prefer': 'return=representation'}
     try:
         if d.get('id'):
-            r = requests.patch(f"{SUPABASE_URL}/rest/v1/suivi_itia?id=eq.{int(d['id'])}",
+            r = supabase_http.patch(f"{SUPABASE_URL}/rest/v1/suivi_itia?id=eq.{int(d['id'])}",
                                json=row, headers=hdr, timeout=10)
         else:
             if not str(row.get('titre') or '').strip():
                 return jsonify({"error": "titre requis"}), 400
             row['cree_par'] = qui
-            r = requests.post(f"{SUPABASE_URL}/rest/v1/suivi_itia", json=row,
+            r = supabase_http.post(f"{SUPABASE_URL}/rest/v1/suivi_itia", json=row,
                               headers=hdr, timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
@@ -1866,7 +2830,7 @@ def itia_supprimer():
     if not d.get('id'):
         return jsonify({"error": "id requis"}), 400
     try:
-        r = requests.delete(f"{SUPABASE_URL}/rest/v1/suivi_itia?id=eq.{int(d['id'])}",
+        r = supabase_http.delete(f"{SUPABASE_URL}/rest/v1/suivi_itia?id=eq.{int(d['id'])}",
                             headers=_supabase_headers(), timeout=10)
         if r.status_code >= 300:
             return jsonify({"error": r.text[:200]}), 500
@@ -1898,7 +2862,7 @@ def _fetch_storage(bucket, fn):
     if not fn or not SUPABASE_URL or not SUPABASE_KEY:
         return None
     try:
-        r = requests.get(
+        r = supabase_http.get(
             f"{SUPABASE_URL}/storage/v1/object/{bucket}/{fn}",
             headers={'apikey': SUPABASE_KEY, 'Authorization': f'Bearer {SUPABASE_KEY}'},
             timeout=20)
@@ -1931,12 +2895,15 @@ def _institutions_prisma(num):
         return None, None
     try:
         import urllib.parse
-        r = requests.get(
+        cols = _colonnes_presentes('employeurs', ('institutions', 'numero_employeur'))
+        if not cols:                      # colonnes pas encore créées : rien à lire
+            return None, None
+        r = supabase_http.get(
             f"{SUPABASE_URL}/rest/v1/employeurs"
             f"?num_entreprise=eq.{urllib.parse.quote(str(num))}"
-            f"&select=institutions,numero_employeur&limit=1",
+            f"&select={','.join(sorted(cols))}&limit=1",
             headers=_supabase_headers(), timeout=10)
-        if r.status_code >= 300:          # ex. 42703 : colonne pas encore créée
+        if r.status_code >= 300:
             return None, None
         rows = r.json()
         if not rows:
@@ -1999,11 +2966,14 @@ def reglement_generer():
     mid = (payload.get('horaire_modele') or '').strip()
     if mid:
         model_bytes = _fetch_horaire_model(mid)
-    cp_rep = _commissions_repertoire()
+    cp_rep, cp_index = [], None
     try:
         from reglement_gen import build_reglement, generer_doc_horaires
+        cp_rep, cp_index = _repertoire('commissions')
+        inst_rep, inst_index = _repertoire('institutions')
         regl = build_reglement(payload, identity, template_bytes, model_bytes,
-                               repertoire=_institutions_repertoire(), cp_repertoire=cp_rep)
+                               repertoire=inst_rep, cp_repertoire=cp_rep,
+                               inst_index=inst_index, cp_index=cp_index)
     except Exception as e:
         return jsonify({"error": f"Échec de la génération : {e}"}), 500
     # Tableaux d'horaires en annexe : FACULTATIFS depuis la loi du 1er juin 2026
@@ -2012,7 +2982,8 @@ def reglement_generer():
     horaires = None
     if payload.get('joindre_horaires'):
         try:
-            horaires = generer_doc_horaires(payload, identity, cp_repertoire=cp_rep)
+            horaires = generer_doc_horaires(payload, identity, cp_repertoire=cp_rep,
+                                            cp_index=cp_index)
         except Exception as e:
             print(f"[REGLEMENT] horaires ignorés (non bloquant) : {e}")
     base = re.sub(r'\D', '', str(num or '')) or 'employeur'
@@ -2020,12 +2991,16 @@ def reglement_generer():
     if horaires:
         # règlement + horaires (souvent très longs) dans un ZIP à 2 documents
         buf = io.BytesIO()
-        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
-            z.writestr(f'reglement_{base}.docx', regl)
-            z.writestr(f'horaires_{base}.docx', horaires)
+        choix = []
+        with zipfile.ZipFile(buf, 'w') as z:
+            for nom, octets in ((f'reglement_{base}.docx', regl),
+                                (f'horaires_{base}.docx', horaires)):
+                choix.append(f'{nom}={_ecrire_entree(z, nom, octets)}')
         buf.seek(0)
-        return send_file(buf, mimetype='application/zip', as_attachment=True,
-                         download_name=f'reglement_{base}.zip')
+        rep = send_file(buf, mimetype='application/zip', as_attachment=True,
+                        download_name=f'reglement_{base}.zip')
+        rep.headers['X-Zip-Compression'] = '; '.join([_politique_zip()] + choix)
+        return rep
     return send_file(io.BytesIO(regl), mimetype=DOCX, as_attachment=True,
                      download_name=f'reglement_{base}.docx')
 
@@ -2138,237 +3113,189 @@ def fill_mensura():
                         as_attachment=True, download_name='Contrat_Mensura.pdf')
     except Exception as e: return jsonify({"error": str(e)}), 500
 
-# ============== PDF GENERATION FUNCTIONS ==============
-def fill_employer_pdf(d):
-    p, c = newcan()
-    if d.get('recu_par'): txt(c, d['recu_par'], 235, 198)
-    f = d.get('forme_juridique', '')
-    if f == 'SRL': txt(c, 'X', 195, 235, 12)
-    elif f == 'SC': txt(c, 'X', 240, 235, 12)
-    elif f == 'SA': txt(c, 'X', 285, 235, 12)
-    elif f == 'ASBL': txt(c, 'X', 345, 235, 12)
-    elif f == 'PERSONNE PHYSIQUE': txt(c, 'X', 415, 235, 12)
-    if d.get('nom_societe'): txt(c, d['nom_societe'], 469, 277)
-    if d.get('nom_prenom_gerant'): txt(c, d['nom_prenom_gerant'], 469, 310)
-    if d.get('niss_gerant'): txt(c, d['niss_gerant'], 468, 344)
-    if d.get('adresse_siege_social_1'): txt(c, d['adresse_siege_social_1'], 466, 375)
-    if d.get('adresse_siege_social_2'): txt(c, d['adresse_siege_social_2'], 465, 409)
-    if d.get('adresse_exploitation_1'): txt(c, d['adresse_exploitation_1'], 466, 443)
-    if d.get('adresse_exploitation_2'): txt(c, d['adresse_exploitation_2'], 464, 478)
-    if d.get('telephone_gsm'): txt(c, d['telephone_gsm'], 461, 507)
-    if d.get('email'): txt(c, d['email'], 462, 539)
-    if d.get('num_entreprise'): txt(c, d['num_entreprise'], 462, 572)
-    if d.get('num_onss'): txt(c, d['num_onss'], 462, 604)
-    if d.get('assurance_loi'): txt(c, d['assurance_loi'], 464, 638)
-    if d.get('seppt'): txt(c, d['seppt'], 464, 669)
-    if d.get('secteur_activite'): txt(c, d['secteur_activite'], 464, 703)
-    r = d.get('reduction_premier', '')
-    if r == 'Oui': txt(c, 'X', 96, 768, 12)
-    elif r == 'Non': txt(c, 'X', 133, 768, 12)
-    if d.get('commission_paritaire'): txt(c, d['commission_paritaire'], 462, 802)
-    if d.get('indice_onss'): txt(c, d['indice_onss'], 463, 834)
-    if d.get('code_nace'): txt(c, d['code_nace'], 461, 868)
-    s = d.get('salaire_garanti', '')
-    if s == 'OUI': txt(c, 'X', 581, 899, 12)
-    elif s == 'NON': txt(c, 'X', 618, 899, 12)
-    c.showPage()
-    if d.get('regime_horaire'): txt(c, d['regime_horaire'], 357, 148)
-    for day, y in [('lundi',228),('mardi',247),('mercredi',266),('jeudi',285),('vendredi',304),('samedi',331),('dimanche',351)]:
-        if d.get(f'{day}_matin_de'): txt(c, d[f'{day}_matin_de'], 213, y, 9)
-        if d.get(f'{day}_matin_a'): txt(c, d[f'{day}_matin_a'], 276, y, 9)
-        if d.get(f'{day}_pause_de'): txt(c, d[f'{day}_pause_de'], 363, y, 9)
-        if d.get(f'{day}_pause_a'): txt(c, d[f'{day}_pause_a'], 423, y, 9)
-        if d.get(f'{day}_apres_de'): txt(c, d[f'{day}_apres_de'], 522, y, 9)
-        if d.get(f'{day}_apres_a'): txt(c, d[f'{day}_apres_a'], 585, y, 9)
-    if d.get('cameras'): txt(c, d['cameras'], 427, 387)
-    if d.get('trousse_secours'): txt(c, d['trousse_secours'], 400, 453)
-    if d.get('vetements_fourniture') == 'Oui': txt(c, 'X', 348, 486, 12)
-    elif d.get('vetements_fourniture') == 'Non': txt(c, 'X', 385, 485, 12)
-    if d.get('vetements_entretien') == 'Oui': txt(c, 'X', 347, 518, 12)
-    elif d.get('vetements_entretien') == 'Non': txt(c, 'X', 388, 518, 12)
-    if d.get('primes'): txt(c, d['primes'], 394, 552)
-    if d.get('secretariat_actuel'): txt(c, d['secretariat_actuel'], 394, 583)
-    if d.get('nom_comptable'): txt(c, d['nom_comptable'], 390, 617)
-    if d.get('coord_comptable'): txt(c, d['coord_comptable'], 390, 648)
-    o = d.get('origine', '')
-    if o == 'Internet': txt(c, 'X', 173, 683, 12)
-    elif o == 'Comptable': txt(c, 'X', 342, 683, 12)
-    elif o == 'Client': txt(c, 'X', 174, 716, 12)
-    elif o == 'Autre': txt(c, 'X', 341, 716, 12)
-    if d.get('date_signature'): txt(c, d['date_signature'], 177, 843)
-    c.save()
-    return merge(TEMPLATES['employer'], p, 2).getvalue()
-
-def fill_travailleur_pdf(d):
-    p, c = newcan()
-    if d.get('contrat_email'): txt(c, 'X', 296, 135, 12)
-    if d.get('contrat_fax'): txt(c, 'X', 364, 135, 12)
-    if d.get('contrat_poste'): txt(c, 'X', 415, 134, 12)
-    if d.get('contrat_main'): txt(c, 'X', 477, 136, 12)
-    if d.get('nom_employeur'): txt(c, d['nom_employeur'], 384, 203)
-    cv = d.get('civilite', '')
-    if cv == 'Mr': txt(c, 'X', 141, 259, 12)
-    elif cv == 'Mme': txt(c, 'X', 298, 260, 12)
-    elif cv == 'Melle': txt(c, 'X', 459, 260, 12)
-    if d.get('nom_prenom'): txt(c, d['nom_prenom'], 383, 286)
-    if d.get('adresse_1'): txt(c, d['adresse_1'], 378, 313)
-    if d.get('adresse_2'): txt(c, d['adresse_2'], 378, 340)
-    if d.get('date_lieu_naissance'): txt(c, d['date_lieu_naissance'], 377, 366)
-    if d.get('niss'): txt(c, d['niss'], 376, 392)
-    if d.get('nationalite'): txt(c, d['nationalite'], 378, 421)
-    if d.get('carte_identite'): txt(c, 'X', 133, 449, 12)
-    if d.get('permis_travail'): txt(c, 'X', 133, 470, 12)
-    if d.get('permis_date'): txt(c, d['permis_date'], 471, 466)
-    et = d.get('etat_civil', '')
-    if et == 'Marie': txt(c, 'X', 283, 532, 12)
-    elif et == 'Veuf': txt(c, 'X', 475, 533, 12)
-    elif et == 'Celibataire': txt(c, 'X', 283, 559, 12)
-    elif et == 'Separe': txt(c, 'X', 476, 561, 12)
-    elif et == 'Divorce': txt(c, 'X', 283, 586, 12)
-    elif et == 'Cohabitation': txt(c, 'X', 473, 585, 12)
-    if d.get('conjoint_charge'): txt(c, 'X', 90, 634, 12)
-    if d.get('enfants_charge'): txt(c, 'X', 289, 635, 12)
-    if d.get('autre_charge'): txt(c, 'X', 91, 655, 12)
-    if d.get('nb_enfants'): txt(c, d['nb_enfants'], 604, 635)
-    if d.get('nb_handicapes'): txt(c, d['nb_handicapes'], 604, 653)
-    if d.get('date_entree'): txt(c, d['date_entree'], 223, 729)
-    if d.get('date_sortie'): txt(c, d['date_sortie'], 515, 731)
-    ct = d.get('categorie', '')
-    if ct == 'Employe': txt(c, 'X', 260, 757, 12)
-    elif ct == 'Ouvrier': txt(c, 'X', 347, 758, 12)
-    elif ct == 'Chef': txt(c, 'X', 428, 757, 12)
-    elif ct == 'Autre': txt(c, 'X', 562, 758, 12)
-    if d.get('fonction'): txt(c, d['fonction'], 261, 791)
-    tc = d.get('type_contrat', '')
-    if tc == 'CDD': txt(c, 'X', 283, 826, 12)
-    elif tc == 'CDI': txt(c, 'X', 283, 845, 12)
-    elif tc == 'Etudiant': txt(c, 'X', 284, 870, 12)
-    elif tc == 'Remplacement': txt(c, 'X', 474, 824, 12)
-    elif tc == 'Nettement defini': txt(c, 'X', 475, 847, 12)
-    rg = d.get('regime_horaire', '')
-    if rg == 'Temps plein': txt(c, 'X', 257, 900, 12)
-    elif rg == 'Temps partiel': txt(c, 'X', 384, 900, 12)
-    c.showPage()
-    hr = d.get('horaire_type', '')
-    if hr == 'Fixe': txt(c, 'X', 258, 99, 12)
-    elif hr == 'Variable': txt(c, 'X', 385, 99, 12)
-    if d.get('heures_semaine'): txt(c, d['heures_semaine'], 291, 127)
-    sch = [('lundi',202,188,276,355,418,514,584),('mardi',200,205,271,360,412,512,576),
-           ('mercredi',200,223,275,362,429,512,577),('jeudi',200,241,271,356,421,513,581),
-           ('vendredi',200,258,273,357,421,513,583),('samedi',208,275,276,355,419,512,579),
-           ('dimanche',207,294,270,354,424,513,582)]
-    for day,x1,y,x2,x3,x4,x5,x6 in sch:
-        if d.get(f'{day}_matin_de'): txt(c, d[f'{day}_matin_de'], x1, y, 9)
-        if d.get(f'{day}_matin_a'): txt(c, d[f'{day}_matin_a'], x2, y, 9)
-        if d.get(f'{day}_pause_de'): txt(c, d[f'{day}_pause_de'], x3, y, 9)
-        if d.get(f'{day}_pause_a'): txt(c, d[f'{day}_pause_a'], x4, y, 9)
-        if d.get(f'{day}_apres_de'): txt(c, d[f'{day}_apres_de'], x5, y, 9)
-        if d.get(f'{day}_apres_a'): txt(c, d[f'{day}_apres_a'], x6, y, 9)
-    if d.get('remuneration'): txt(c, d['remuneration'], 335, 319)
-    if d.get('compte_bancaire'): txt(c, d['compte_bancaire'], 337, 347)
-    if d.get('avantage_nourriture'): txt(c, 'X', 134, 401, 12)
-    if d.get('avantage_vetements'): txt(c, 'X', 133, 431, 12)
-    if d.get('avantage_voiture'): txt(c, 'X', 134, 455, 12)
-    if d.get('avantage_gsm'): txt(c, 'X', 134, 484, 12)
-    if d.get('avantage_autre'): txt(c, 'X', 134, 512, 12)
-    if d.get('prime_nuit'): txt(c, 'X', 176, 547, 12)
-    if d.get('prime_weekend'): txt(c, 'X', 240, 546, 12)
-    if d.get('prime_froid'): txt(c, 'X', 345, 547, 12)
-    if d.get('prime_autre'): txt(c, d['prime_autre'], 418, 547)
-    if d.get('transport_train'): txt(c, 'X', 95, 601, 12)
-    if d.get('transport_tram'): txt(c, 'X', 167, 602, 12)
-    if d.get('transport_metro'): txt(c, 'X', 235, 602, 12)
-    if d.get('transport_bus'): txt(c, 'X', 313, 602, 12)
-    if d.get('transport_voiture'): txt(c, 'X', 374, 602, 12)
-    if d.get('transport_pieds'): txt(c, 'X', 462, 601, 12)
-    if d.get('transport_velo'): txt(c, 'X', 540, 600, 12)
-    if d.get('km'): txt(c, d['km'], 331, 627)
-    if d.get('chomage_depuis'): txt(c, d['chomage_depuis'], 375, 657)
-    if d.get('c131'): txt(c, 'X', 135, 686, 12)
-    if d.get('carte_activa'): txt(c, 'X', 136, 716, 12)
-    if d.get('carte_recue'): txt(c, 'X', 312, 711, 12)
-    if d.get('faire_demande'): txt(c, 'X', 291, 743, 12)
-    if d.get('cpas_depuis'): txt(c, d['cpas_depuis'], 355, 768)
-    if d.get('date_signature'): txt(c, d['date_signature'], 139, 813)
-    c.save()
-    return merge(TEMPLATES['travailleur'], p, 2).getvalue()
-
-def fill_independant_pdf(d):
-    p, c = newcan()
-    if d.get('contrat_email'): txt(c, 'X', 296, 133, 12)
-    if d.get('contrat_fax'): txt(c, 'X', 363, 133, 12)
-    if d.get('contrat_poste'): txt(c, 'X', 414, 134, 12)
-    if d.get('contrat_main'): txt(c, 'X', 476, 133, 12)
-    cv = d.get('civilite', '')
-    if cv == 'Mr': txt(c, 'X', 139, 203, 12)
-    elif cv == 'Mme': txt(c, 'X', 300, 203, 12)
-    elif cv == 'Melle': txt(c, 'X', 459, 203, 12)
-    if d.get('nom_prenom'): txt(c, d['nom_prenom'], 395, 233)
-    if d.get('adresse_1'): txt(c, d['adresse_1'], 392, 258)
-    if d.get('adresse_2'): txt(c, d['adresse_2'], 388, 286)
-    if d.get('date_lieu_naissance'): txt(c, d['date_lieu_naissance'], 392, 312)
-    if d.get('niss'): txt(c, d['niss'], 391, 340)
-    if d.get('nationalite'): txt(c, d['nationalite'], 386, 367)
-    if d.get('carte_identite'): txt(c, 'X', 133, 396, 12)
-    et = d.get('etat_civil', '')
-    if et == 'Marie': txt(c, 'X', 283, 457, 12)
-    elif et == 'Veuf': txt(c, 'X', 472, 458, 12)
-    elif et == 'Celibataire': txt(c, 'X', 281, 484, 12)
-    elif et == 'Separe': txt(c, 'X', 475, 483, 12)
-    elif et == 'Divorce': txt(c, 'X', 283, 510, 12)
-    elif et == 'Cohabitation': txt(c, 'X', 474, 511, 12)
-    if d.get('conjoint_charge'): txt(c, 'X', 91, 559, 12)
-    if d.get('enfants_charge'): txt(c, 'X', 288, 561, 12)
-    if d.get('autre_charge'): txt(c, 'X', 91, 580, 12)
-    if d.get('nb_enfants'): txt(c, d['nb_enfants'], 606, 559)
-    if d.get('nb_handicapes'): txt(c, d['nb_handicapes'], 607, 579)
-    if d.get('remuneration'): txt(c, d['remuneration'], 350, 639)
-    if d.get('loi_sociale'): txt(c, 'X', 133, 683, 12)
-    if d.get('loi_sociale_val'): txt(c, d['loi_sociale_val'], 322, 682)
-    if d.get('cheques_repas'): txt(c, 'X', 133, 709, 12)
-    if d.get('cheques_repas_val'): txt(c, d['cheques_repas_val'], 322, 709)
-    if d.get('voiture'): txt(c, 'X', 133, 737, 12)
-    if d.get('voiture_val'): txt(c, d['voiture_val'], 325, 736)
-    if d.get('autre'): txt(c, 'X', 134, 765, 12)
-    if d.get('autre_val'): txt(c, d['autre_val'], 325, 763)
-    if d.get('date_signature'): txt(c, d['date_signature'], 139, 808)
-    c.save()
-    return merge(TEMPLATES['independant'], p, 1).getvalue()
-
-def fill_att_accident_pdf(d, lang='fr'):
-    d = with_signatory_fallbacks(d)
-    p, c = newcan()
-    tpl = TEMPLATES['att_accident_nl'] if lang == 'nl' else TEMPLATES['att_accident_fr']
-    off = 12 if lang == 'nl' else 0
-    if d.get('nom_soussigne'): txt(c, d['nom_soussigne'], 283, 130+off)
-    if d.get('niss'): txt(c, d['niss'], 283, 144+off)
-    if d.get('domicile_1'): txt(c, d['domicile_1'], 283, 159+off)
-    if d.get('domicile_2'): txt(c, d['domicile_2'], 282, 174+off)
-    if d.get('qualite'): txt(c, d['qualite'], 284, 204+off)
-    if d.get('societe'): txt(c, d['societe'], 284, 222+off)
-    if d.get('etablie_1'): txt(c, d['etablie_1'], 284, 235+off)
-    if d.get('etablie_2'): txt(c, d['etablie_2'], 283, 251+off)
-    if d.get('date_signature'): txt(c, d['date_signature'], 237, 443+off)
-    c.save()
-    return merge(tpl, p, 1).getvalue()
+@app.route('/fill-lot', methods=['POST'])
+def fill_lot():
+    """Publipostage : {"doc_type": "seppt"|"accident"|"procuration",
+    "language_prefs": {...}, "lot": [données, ...]} -> un PDF, un exemplaire par
+    élément. Authentifié comme /download-all-zip (données de plusieurs clients)."""
+    if not verify_user_token(request):
+        return jsonify({"error": "Non authentifié"}), 401
+    data = request.get_json(silent=True) or {}
+    doc_type = data.get('doc_type')
+    lot = data.get('lot')
+    if doc_type not in LOT_DOCUMENTS:
+        return jsonify({"error": f"doc_type attendu parmi {', '.join(LOT_DOCUMENTS)}"}), 400
+    if not isinstance(lot, list) or not lot or not all(isinstance(d, dict) for d in lot):
+        return jsonify({"error": "lot : liste non vide d'objets attendue"}), 400
+    if len(lot) > LOT_MAX:
+        return jsonify({"error": f"lot limité à {LOT_MAX} exemplaires"}), 400
+    try:
+        pdf = remplir_lot(doc_type, lot, data.get('language_prefs') or {})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return send_file(io.BytesIO(pdf), mimetype='application/pdf', as_attachment=True,
+                     download_name=f'{doc_type}_lot_{len(lot)}.pdf')
 
-def fill_att_seppt_pdf(d, lang='fr'):
-    d = with_signatory_fallbacks(d)
-    p, c = newcan()
-    tpl = TEMPLATES['att_seppt_nl'] if lang == 'nl' else TEMPLATES['att_seppt_fr']
-    off = 11 if lang == 'nl' else 0
-    sig_y = 630 if lang == 'nl' else 548
-    if d.get('nom_soussigne'): txt(c, d['nom_soussigne'], 313, 129+off)
-    if d.get('niss'): txt(c, d['niss'], 313, 145+off)
-    if d.get('domicile_1'): txt(c, d['domicile_1'], 310, 160+off)
-    if d.get('domicile_2'): txt(c, d['domicile_2'], 309, 173+off)
-    if d.get('qualite'): txt(c, d['qualite'], 311, 205+off)
-    if d.get('societe'): txt(c, d['societe'], 311, 220+off)
-    if d.get('etablie_1'): txt(c, d['etablie_1'], 311, 236+off)
-    if d.get('etablie_2'): txt(c, d['etablie_2'], 309, 252+off)
-    if d.get('date_signature'): txt(c, d['date_signature'], 252, sig_y)
-    c.save()
-    return merge(tpl, p, 1).getvalue()
+# ============== PDF GENERATION FUNCTIONS ==============
+# --- Position des champs : UNE table par formulaire -----------------------------
+# Même principe que OFFRE_LAYOUT : la position des champs est une donnée, pas du
+# code. Espace virtuel 707x1000, origine haut-gauche (cf. cvt()). Clé = clé de
+# TEMPLATES ; valeur = liste des pages du calque, chaque page une liste d'entrées :
+#   (champ, x, y)            texte, taille 10
+#   (champ, x, y, taille)    texte, autre taille
+#   (champ, {valeur: (x, y)}) case à cocher : « X » (taille 12) selon la valeur
+#   (champ, {COCHE: (x, y)})  case à cocher : « X » si le champ est vrai
+# `champ` peut être un tuple de replis : la 1re valeur non vide l'emporte.
+# Ces tables sont compilées à l'import (_compiler) en un plan exécuté par un seul
+# moteur (_rendre) : cvt() et setFont ne sont plus refaits champ par champ.
+COCHE = True
+
+_JOURS_EMPLOYEUR = [('lundi', 228), ('mardi', 247), ('mercredi', 266), ('jeudi', 285),
+                    ('vendredi', 304), ('samedi', 331), ('dimanche', 351)]
+_COLONNES_EMPLOYEUR = [('matin_de', 213), ('matin_a', 276), ('pause_de', 363),
+                       ('pause_a', 423), ('apres_de', 522), ('apres_a', 585)]
+# Fiche travailleur : le scan n'est pas droit, chaque jour a ses propres x.
+_HORAIRE_TRAVAILLEUR = [('lundi', 188, (202, 276, 355, 418, 514, 584)),
+                        ('mardi', 205, (200, 271, 360, 412, 512, 576)),
+                        ('mercredi', 223, (200, 275, 362, 429, 512, 577)),
+                        ('jeudi', 241, (200, 271, 356, 421, 513, 581)),
+                        ('vendredi', 258, (200, 273, 357, 421, 513, 583)),
+                        ('samedi', 275, (208, 276, 355, 419, 512, 579)),
+                        ('dimanche', 294, (207, 270, 354, 424, 513, 582))]
+_PLAGES = ('matin_de', 'matin_a', 'pause_de', 'pause_a', 'apres_de', 'apres_a')
+
+
+def _decale(entrees, dy):
+    """Même bloc de champs, descendu de dy (version NL des attestations)."""
+    return [(e[0], e[1], e[2] + dy) + tuple(e[3:]) for e in entrees]
+
+
+_ATT_ACCIDENT = [('nom_soussigne', 283, 130), ('niss', 283, 144), ('domicile_1', 283, 159),
+                 ('domicile_2', 282, 174), ('qualite', 284, 204), ('societe', 284, 222),
+                 ('etablie_1', 284, 235), ('etablie_2', 283, 251), ('date_signature', 237, 443)]
+_ATT_SEPPT = [('nom_soussigne', 313, 129), ('niss', 313, 145), ('domicile_1', 310, 160),
+              ('domicile_2', 309, 173), ('qualite', 311, 205), ('societe', 311, 220),
+              ('etablie_1', 311, 236), ('etablie_2', 309, 252)]
+
+FORM_LAYOUT = {
+    'employer': [
+        [('recu_par', 235, 198),
+         ('forme_juridique', {'SRL': (195, 235), 'SC': (240, 235), 'SA': (285, 235),
+                              'ASBL': (345, 235), 'PERSONNE PHYSIQUE': (415, 235)}),
+         ('nom_societe', 469, 277), ('nom_prenom_gerant', 469, 310),
+         ('niss_gerant', 468, 344), ('adresse_siege_social_1', 466, 375),
+         ('adresse_siege_social_2', 465, 409), ('adresse_exploitation_1', 466, 443),
+         ('adresse_exploitation_2', 464, 478), ('telephone_gsm', 461, 507),
+         ('email', 462, 539), ('num_entreprise', 462, 572), ('num_onss', 462, 604),
+         ('assurance_loi', 464, 638), ('seppt', 464, 669), ('secteur_activite', 464, 703),
+         ('reduction_premier', {'Oui': (96, 768), 'Non': (133, 768)}),
+         ('commission_paritaire', 462, 802), ('indice_onss', 463, 834),
+         ('code_nace', 461, 868),
+         ('salaire_garanti', {'OUI': (581, 899), 'NON': (618, 899)})],
+        [('regime_horaire', 357, 148)]
+        + [(f'{jour}_{plage}', x, y, 9)
+           for jour, y in _JOURS_EMPLOYEUR for plage, x in _COLONNES_EMPLOYEUR]
+        + [('cameras', 427, 387), ('trousse_secours', 400, 453),
+           ('vetements_fourniture', {'Oui': (348, 486), 'Non': (385, 485)}),
+           ('vetements_entretien', {'Oui': (347, 518), 'Non': (388, 518)}),
+           ('primes', 394, 552), ('secretariat_actuel', 394, 583),
+           ('nom_comptable', 390, 617), ('coord_comptable', 390, 648),
+           ('origine', {'Internet': (173, 683), 'Comptable': (342, 683),
+                        'Client': (174, 716), 'Autre': (341, 716)}),
+           ('date_signature', 177, 843)],
+    ],
+    'travailleur': [
+        [('contrat_email', {COCHE: (296, 135)}), ('contrat_fax', {COCHE: (364, 135)}),
+         ('contrat_poste', {COCHE: (415, 134)}), ('contrat_main', {COCHE: (477, 136)}),
+         ('nom_employeur', 384, 203),
+         ('civilite', {'Mr': (141, 259), 'Mme': (298, 260), 'Melle': (459, 260)}),
+         ('nom_prenom', 383, 286), ('adresse_1', 378, 313), ('adresse_2', 378, 340),
+         ('date_lieu_naissance', 377, 366), ('niss', 376, 392), ('nationalite', 378, 421),
+         ('carte_identite', {COCHE: (133, 449)}), ('permis_travail', {COCHE: (133, 470)}),
+         ('permis_date', 471, 466),
+         ('etat_civil', {'Marie': (283, 532), 'Veuf': (475, 533), 'Celibataire': (283, 559),
+                         'Separe': (476, 561), 'Divorce': (283, 586),
+                         'Cohabitation': (473, 585)}),
+         ('conjoint_charge', {COCHE: (90, 634)}), ('enfants_charge', {COCHE: (289, 635)}),
+         ('autre_charge', {COCHE: (91, 655)}),
+         ('nb_enfants', 604, 635), ('nb_handicapes', 604, 653),
+         ('date_entree', 223, 729), ('date_sortie', 515, 731),
+         ('categorie', {'Employe': (260, 757), 'Ouvrier': (347, 758), 'Chef': (428, 757),
+                        'Autre': (562, 758)}),
+         ('fonction', 261, 791),
+         ('type_contrat', {'CDD': (283, 826), 'CDI': (283, 845), 'Etudiant': (284, 870),
+                           'Remplacement': (474, 824), 'Nettement defini': (475, 847)}),
+         ('regime_horaire', {'Temps plein': (257, 900), 'Temps partiel': (384, 900)})],
+        [('horaire_type', {'Fixe': (258, 99), 'Variable': (385, 99)}),
+         ('heures_semaine', 291, 127)]
+        + [(f'{jour}_{plage}', x, y, 9)
+           for jour, y, xs in _HORAIRE_TRAVAILLEUR for plage, x in zip(_PLAGES, xs)]
+        + [('remuneration', 335, 319), ('compte_bancaire', 337, 347),
+           ('avantage_nourriture', {COCHE: (134, 401)}),
+           ('avantage_vetements', {COCHE: (133, 431)}),
+           ('avantage_voiture', {COCHE: (134, 455)}), ('avantage_gsm', {COCHE: (134, 484)}),
+           ('avantage_autre', {COCHE: (134, 512)}),
+           ('prime_nuit', {COCHE: (176, 547)}), ('prime_weekend', {COCHE: (240, 546)}),
+           ('prime_froid', {COCHE: (345, 547)}), ('prime_autre', 418, 547),
+           ('transport_train', {COCHE: (95, 601)}), ('transport_tram', {COCHE: (167, 602)}),
+           ('transport_metro', {COCHE: (235, 602)}), ('transport_bus', {COCHE: (313, 602)}),
+           ('transport_voiture', {COCHE: (374, 602)}),
+           ('transport_pieds', {COCHE: (462, 601)}), ('transport_velo', {COCHE: (540, 600)}),
+           ('km', 331, 627), ('chomage_depuis', 375, 657),
+           ('c131', {COCHE: (135, 686)}), ('carte_activa', {COCHE: (136, 716)}),
+           ('carte_recue', {COCHE: (312, 711)}), ('faire_demande', {COCHE: (291, 743)}),
+           ('cpas_depuis', 355, 768), ('date_signature', 139, 813)],
+    ],
+    'independant': [
+        [('contrat_email', {COCHE: (296, 133)}), ('contrat_fax', {COCHE: (363, 133)}),
+         ('contrat_poste', {COCHE: (414, 134)}), ('contrat_main', {COCHE: (476, 133)}),
+         ('civilite', {'Mr': (139, 203), 'Mme': (300, 203), 'Melle': (459, 203)}),
+         ('nom_prenom', 395, 233), ('adresse_1', 392, 258), ('adresse_2', 388, 286),
+         ('date_lieu_naissance', 392, 312), ('niss', 391, 340), ('nationalite', 386, 367),
+         ('carte_identite', {COCHE: (133, 396)}),
+         ('etat_civil', {'Marie': (283, 457), 'Veuf': (472, 458), 'Celibataire': (281, 484),
+                         'Separe': (475, 483), 'Divorce': (283, 510),
+                         'Cohabitation': (474, 511)}),
+         ('conjoint_charge', {COCHE: (91, 559)}), ('enfants_charge', {COCHE: (288, 561)}),
+         ('autre_charge', {COCHE: (91, 580)}),
+         ('nb_enfants', 606, 559), ('nb_handicapes', 607, 579), ('remuneration', 350, 639),
+         ('loi_sociale', {COCHE: (133, 683)}), ('loi_sociale_val', 322, 682),
+         ('cheques_repas', {COCHE: (133, 709)}), ('cheques_repas_val', 322, 709),
+         ('voiture', {COCHE: (133, 737)}), ('voiture_val', 325, 736),
+         ('autre', {COCHE: (134, 765)}), ('autre_val', 325, 763),
+         ('date_signature', 139, 808)],
+    ],
+    'att_accident_fr': [_ATT_ACCIDENT],
+    'att_accident_nl': [_decale(_ATT_ACCIDENT, 12)],
+    'att_seppt_fr': [_ATT_SEPPT + [('date_signature', 252, 548)]],
+    'att_seppt_nl': [_decale(_ATT_SEPPT, 11) + [('date_signature', 252, 630)]],
+    'procuration': [
+        [('num_entreprise', 215, 115), ('denomination', 184, 135), ('rue', 119, 152),
+         ('numero', 440, 153), ('boite', 571, 153), ('code_postal', 145, 174),
+         ('commune', 286, 173), ('pays', 482, 174), ('num_onss', 476, 118),
+         ('num_affiliation_employeur', 274, 268), ('trimestre_debut', 202, 518),
+         ('trimestre_fin', 462, 520), ('date_signature', 186, 690),
+         ('niss_mandant', 241, 706), ('nom_mandant', 171, 726)],
+    ],
+    'dispense': [
+        [('nom_soussigne', 334, 188), ('qualite', 255, 206), ('societe', 463, 208),
+         ('num_entreprise', 514, 222), ('depuis_date', 187, 238),
+         ('checkbox_10pct', {COCHE: (91, 307)})],
+        [('checkbox_20pct', {COCHE: (90, 312)}),
+         ('etabli_lieu', 176, 761), ('etabli_date', 329, 761)],
+    ],
+    'mensura': [
+        [('nom_entreprise', 144, 236), ('siege_social_1', 148, 289),
+         ('siege_social_2', 147, 302), ('siege_exploitation', 167, 344),
+         ('telephone', 189, 371), ('gsm', 439, 368), ('email', 184, 410),
+         ('tva_bce', 210, 438), ('num_onss', 476, 437), ('compte_bancaire', 233, 467),
+         ('code_nace', 342, 519), ('nb_travailleurs', 617, 517)],
+        [],
+        [],
+        [('date_cours', 322, 125), ('fait_lieu', 181, 194), ('fait_date', 326, 197),
+         ('nom_delegue', 143, 442)],
+    ],
+}
 
 def make_overlay(draw_fn):
     """Create a single-page PDF overlay by calling draw_fn(canvas)"""
@@ -2399,18 +3326,22 @@ def _en_xobject(writer, page, etranger=False):
     être clonées dans le writer sinon les polices pointent dans le vide."""
     xo = DecodedStreamObject()
     xo.set_data(_octets_contenu(page))
-    mb = page.mediabox
+    res = page.get(NameObject('/Resources'), DictionaryObject())
+    if etranger:
+        res = res.get_object().clone(writer)
+    return writer._add_object(_en_forme(xo, page.mediabox, res))
+
+
+def _en_forme(xo, mb, res):
+    """Complète un flux en Form XObject couvrant la mediabox `mb`."""
     xo[NameObject('/Type')] = NameObject('/XObject')
     xo[NameObject('/Subtype')] = NameObject('/Form')
     xo[NameObject('/FormType')] = NumberObject(1)
     xo[NameObject('/BBox')] = ArrayObject([
         FloatObject(mb.left), FloatObject(mb.bottom),
         FloatObject(mb.right), FloatObject(mb.top)])
-    res = page.get(NameObject('/Resources'), DictionaryObject())
-    if etranger:
-        res = res.get_object().clone(writer)
     xo[NameObject('/Resources')] = res
-    return writer._add_object(xo)
+    return xo
 
 
 def merge_selective(tpl_path, overlays):
@@ -2426,14 +3357,15 @@ def merge_selective(tpl_path, overlays):
     confine leur état graphique. Vérifié identique au pixel sous pypdf 3.17.1
     (prod) et 6.14.2 (local), sur les 41 pages FR+NL.
     """
-    wr = PdfWriter()
-    wr.append(tpl_path)
+    wr = _copie_gabarit(tpl_path)
     for i, ov_bytes in overlays.items():
         if not (0 <= i < len(wr.pages)):
             continue
         page = wr.pages[i]
         ov_page = PdfReader(io.BytesIO(ov_bytes)).pages[0]
-        ref_tpl = _en_xobject(wr, page)                      # le fond, dessous
+        # Le fond, dessous : XObject précalculé (cf. _fond()) ; clone() remappe
+        # ses ressources sur les copies déjà faites par _copie_gabarit().
+        ref_tpl = wr._add_object(_fond(tpl_path, i)['objet'].clone(wr))
         ref_ovl = _en_xobject(wr, ov_page, etranger=True)    # notre texte, dessus
         xdict = DictionaryObject()
         xdict[NameObject('/__tpl')] = ref_tpl
@@ -2490,137 +3422,1255 @@ OFFRE_LAYOUT = {
 }
 
 
+# Champs de l'Offre : nom de position (OFFRE_LAYOUT) -> champ(s) du formulaire.
+_OFFRE_SOCIETE = {
+    'societe': 'nom_societe',
+    'adr1': ('adresse_1', 'adresse_siege_social_1'),
+    'adr2': ('adresse_2', 'adresse_siege_social_2'),
+    'tva': ('num_tva', 'num_entreprise'),
+    'repr': ('represente_par', 'nom_prenom_gerant'),
+}
+_OFFRE_MANDATAIRE = {
+    'soussigne': ('nom_soussigne', 'nom_prenom_gerant'),
+    'niss': ('niss', 'niss_gerant'),
+    'dom1': ('domicile_1', 'adresse_siege_social_1'),
+    'dom2': ('domicile_2', 'adresse_siege_social_2'),
+    'qualite': 'qualite',
+    'societe': ('societe', 'nom_societe'),
+    'adr1': ('adresse_1', 'adresse_siege_social_1'),
+    'adr2': ('adresse_2', 'adresse_siege_social_2'),
+    'tva': ('num_tva', 'num_entreprise'),
+    'date': ('date_signature', 'date_fait'),
+}
+OFFRE_CHAMPS = {
+    'cover': _OFFRE_SOCIETE,
+    'cond': {**_OFFRE_SOCIETE, 'jour': 'date_entree_jour', 'mois': 'date_entree_mois',
+             'annee': 'date_entree_annee', 'fait': ('date_fait', 'date_signature')},
+    'proc': _OFFRE_MANDATAIRE,
+    'mandat': _OFFRE_MANDATAIRE,
+}
+# Les coordonnées d'OFFRE_LAYOUT sont celles du bas des « ……… ». On remonte la
+# ligne de base de 7 pour que le texte se pose SUR la ligne pointillée au lieu
+# d'être barré par les points.
+OFFRE_BASELINE_ADJ = 7
+
+
+def _offre_vers_pages(lang):
+    """OFFRE_LAYOUT[lang] -> {index de page: entrées} au format de FORM_LAYOUT."""
+    L = OFFRE_LAYOUT[lang]
+    pages = {}
+    for bloc, idx in L['pages'].items():
+        champs = OFFRE_CHAMPS[bloc]
+        pages[idx] = [(champs[nom], x, y - OFFRE_BASELINE_ADJ)
+                      for nom, (x, y) in L[bloc].items() if nom in champs]
+    return pages
+
+
+# --- Compilation des tables et moteur de rendu unique ---------------------------
+_TEXTE, _CHOIX, _COCHE = 0, 1, 2
+
+
+def _compiler(pages, isoler=False):
+    """Table de champs -> plan exécutable. Coordonnées converties en points PDF
+    (cvt) une fois pour toutes, entrées regroupées par taille de police : le
+    moteur ne fait plus qu'un setFont par taille et par page.
+    isoler=True : calques posés par merge_selective (Form XObjects, cf. Offre)."""
+    if isinstance(pages, list):
+        pages = dict(enumerate(pages))
+    plan = []
+    for idx in sorted(pages):
+        par_taille = {}
+        for e in pages[idx]:
+            champ = e[0]
+            champs = champ if isinstance(champ, tuple) else (champ,)
+            if isinstance(e[1], dict):
+                if set(e[1]) == {COCHE}:
+                    op = (_COCHE, champs[0], cvt(*e[1][COCHE]))
+                else:
+                    op = (_CHOIX, champs[0], {v: cvt(*xy) for v, xy in e[1].items()})
+                taille = 12
+            else:
+                op = (_TEXTE, champs, cvt(e[1], e[2]))
+                taille = e[3] if len(e) > 3 else 10
+            par_taille.setdefault(taille, []).append(op)
+        plan.append((idx, tuple((t, tuple(ops)) for t, ops in par_taille.items())))
+    return {'pages': tuple(plan), 'nb_pages': (max(pages) + 1) if pages else 0,
+            'isoler': isoler}
+
+
+def _rendre(plan, d):
+    """Exécute un plan sur les données -> {index de page: [(taille, [(x, y, texte)])]}.
+    Seul ce qui est réellement à écrire figure dans le résultat."""
+    sortie = {}
+    for idx, groupes in plan['pages']:
+        page = []
+        for taille, ops in groupes:
+            traits = []
+            for genre, champ, arg in ops:
+                if genre == _TEXTE:
+                    v = next((d.get(c) for c in champ if d.get(c)), None)
+                    if v:
+                        traits.append((arg[0], arg[1], _texte(v)))
+                elif genre == _COCHE:
+                    if d.get(champ):
+                        traits.append((arg[0], arg[1], 'X'))
+                else:
+                    try:
+                        xy = arg.get(d.get(champ))
+                    except TypeError:              # valeur non hachable (liste…)
+                        xy = None
+                    if xy:
+                        traits.append((xy[0], xy[1], 'X'))
+            if traits:
+                page.append((taille, traits))
+        sortie[idx] = page
+    return sortie
+
+
+def _dessiner(c, groupes):
+    for taille, traits in groupes:
+        c.setFont("Helvetica", taille)
+        for x, y, t in traits:
+            c.drawString(x, y, t)
+
+
+def _calque_reportlab(pages, nb_pages):
+    """Calque multi-pages (une page de calque par page du template)."""
+    p, c = newcan()
+    for i in range(nb_pages):
+        _dessiner(c, pages.get(i, ()))
+        c.showPage()
+    c.save()
+    return p
+
+
+# --- Calque direct : opérateurs texte écrits dans le flux de la page -----------
+# Le calque reportlab coûte un aller-retour PDF complet par document (canvas ->
+# c.save() sérialise un PDF -> PdfReader le ré-analyse pour en extraire une page).
+# Ici on écrit directement BT/Tf/Td/Tj dans un flux pypdf, avec UNE police
+# Helvetica (WinAnsi, comme reportlab) partagée par toutes les pages du document.
+# Repli reportlab : texte hors WinAnsi (reportlab sait substituer des glyphes),
+# ou CALQUE_REPORTLAB=1 dans l'environnement.
+_POLICE_CALQUE = NameObject('/PPHelv')
+
+
+def _calque_reportlab_force():
+    return os.environ.get('CALQUE_REPORTLAB') == '1'
+
+
+def _num(v):
+    s = ('%.4f' % v).rstrip('0').rstrip('.')
+    return (s if s not in ('-0', '') else '0').encode()
+
+
+def _chaine_pdf(t):
+    """Chaîne littérale PDF encodée WinAnsi. UnicodeEncodeError -> repli reportlab."""
+    b = t.encode('cp1252')
+    b = b.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+    return b'(' + b.replace(b'\r', b'\\r').replace(b'\n', b'\\n') + b')'
+
+
+def _flux_texte(groupes):
+    """[(taille, [(x, y, texte)])] -> opérateurs PDF d'une page de calque.
+    Un seul BT/ET ; Td est relatif à la ligne précédente, calculé sur des
+    coordonnées déjà arrondies pour ne pas cumuler d'erreur."""
+    out = [b'BT']
+    px = py = 0.0
+    for taille, traits in groupes:
+        out.append(b'%s %s Tf' % (_POLICE_CALQUE.encode(), _num(taille)))
+        for x, y, t in traits:
+            x, y = round(x, 4), round(y, 4)
+            out.append(b'%s %s Td %s Tj' % (_num(x - px), _num(y - py), _chaine_pdf(t)))
+            px, py = x, y
+    out.append(b'ET')
+    return b'\n'.join(out) + b'\n'
+
+
+def _police_helvetica():
+    police = DictionaryObject()
+    police[NameObject('/Type')] = NameObject('/Font')
+    police[NameObject('/Subtype')] = NameObject('/Type1')
+    police[NameObject('/BaseFont')] = NameObject('/Helvetica')
+    police[NameObject('/Encoding')] = NameObject('/WinAnsiEncoding')
+    return police
+
+
+def _flux_objet(wr, data):
+    flux = DecodedStreamObject()
+    flux.set_data(data)
+    return wr._add_object(flux)
+
+
+def _poser_flux(tpl, flux):
+    """Pose les calques directs {index: opérateurs} sur une copie du template.
+    Même résultat que merge() : le contenu du template est encadré de q/Q (sans
+    être ré-analysé), le texte est ajouté après."""
+    wr = _copie_gabarit(tpl)
+    police = wr._add_object(_police_helvetica())
+    for i, pg in enumerate(wr.pages):
+        data = flux.get(i)
+        if not data:
+            continue
+        morceaux = ArrayObject([_flux_objet(wr, b'q\n')])
+        if NameObject('/Contents') in pg:
+            brut = pg.raw_get(NameObject('/Contents'))
+            if isinstance(brut.get_object(), ArrayObject):
+                morceaux.extend(brut.get_object())
+            else:       # un flux doit être indirect pour figurer dans un tableau
+                morceaux.append(brut if isinstance(brut, IndirectObject) else wr._add_object(brut))
+        morceaux.append(_flux_objet(wr, b'\nQ\n' + data))
+        pg[NameObject('/Contents')] = morceaux
+        # Copie superficielle : /Resources et /Font peuvent être partagés entre pages.
+        res = DictionaryObject(pg.get(NameObject('/Resources'), DictionaryObject()).get_object())
+        polices = DictionaryObject(res.get(NameObject('/Font'), DictionaryObject()).get_object())
+        polices[_POLICE_CALQUE] = police
+        res[NameObject('/Font')] = polices
+        pg[NameObject('/Resources')] = res
+    out = io.BytesIO()
+    wr.write(out)
+    out.seek(0)
+    return out
+
+
+# --- Mise à jour incrémentale (Offre) -----------------------------------------
+# L'Offre ne change que 4 pages sur 20/21, mais PdfWriter réécrivait les ~750 Ko
+# à chaque requête. Ici la sortie = octets ORIGINAUX du template (copiés tels
+# quels : les pages statiques ne sont même pas relues) + une mise à jour
+# incrémentale (PDF 32000-1, 7.5.6) : les pages remplies réécrites sous leur
+# numéro d'objet, leurs nouveaux flux/XObjects, et une section xref dont /Prev
+# pointe sur l'ancienne. Même isolation que merge_selective() : template et
+# calque chacun dans leur Form XObject.
+_STARTXREF = re.compile(rb'startxref\s+(\d+)\s+%%EOF\s*$')
+
+
+def _xobject_gabarit(page):
+    """Page du template -> Form XObject qui réutilise son flux ENCODÉ tel quel
+    (pas de décompression/recompression) quand la page n'a qu'un flux."""
+    contenu = page.get(NameObject('/Contents'))
+    contenu = contenu.get_object() if contenu is not None else None
+    if isinstance(contenu, EncodedStreamObject):
+        xo = EncodedStreamObject()
+        xo._data = contenu._data
+        for cle in ('/Filter', '/DecodeParms'):
+            if cle in contenu:
+                xo[NameObject(cle)] = contenu.raw_get(cle)
+    else:
+        xo = DecodedStreamObject()
+        xo.set_data(_octets_contenu(page))
+    res = page.raw_get(NameObject('/Resources')) if '/Resources' in page else DictionaryObject()
+    return _en_forme(xo, page.mediabox, res)
+
+
+def _fond(tpl, i):
+    """Form XObject de la page i du template, construit UNE fois par worker :
+    {'objet': StreamObject (ressources = références dans le lecteur du gabarit),
+    'corps': sa sérialisation, prête pour _maj_incrementale}. Le côté template
+    ne change jamais d'une requête à l'autre ; seul le calque est recalculé."""
+    gab = _gabarit(tpl)
+    fonds = gab.setdefault('fonds', {})
+    fond = fonds.get(i)
+    if fond is None:
+        with gab['verrou']:
+            fond = fonds.get(i)
+            if fond is None:
+                xo = _xobject_gabarit(gab['lecteur'].pages[i])
+                buf = io.BytesIO()
+                xo.write_to_stream(buf, None)
+                fond = fonds[i] = {'objet': xo, 'corps': buf.getvalue()}
+    return fond
+
+
+def _objet_pdf(num, gen, obj):
+    """`obj` : objet pypdf, ou octets déjà sérialisés (cf. _fond())."""
+    buf = io.BytesIO()
+    buf.write(b'%d %d obj\n' % (num, gen))
+    if isinstance(obj, bytes):
+        buf.write(obj)
+    else:
+        obj.write_to_stream(buf, None)
+    buf.write(b'\nendobj\n')
+    return buf.getvalue()
+
+
+def _maj_incrementale(tpl, flux):
+    """Offre remplie = template + mise à jour incrémentale des pages {index: flux}."""
+    gab = _gabarit(tpl)
+    rd, octets = gab['lecteur'], gab['octets']
+    flux = {i: f for i, f in flux.items() if f and 0 <= i < gab['nb_pages']}
+    if not flux:
+        return octets
+    m = _STARTXREF.search(octets[-1024:])
+    if not m:
+        raise ValueError(f"{tpl} : startxref introuvable, mise à jour incrémentale impossible")
+    fonds = {i: _fond(tpl, i)['corps'] for i in flux}   # hors verrou : _fond() le prend
+    objets = {}                          # numéro -> (génération, objet ou octets)
+    suivant = 0
+
+    def ajoute(obj):
+        nonlocal suivant
+        objets[suivant] = (0, obj)
+        suivant += 1
+        return IndirectObject(suivant - 1, 0, rd)
+
+    with gab['verrou']:
+        suivant = int(rd.trailer['/Size'])
+        police = ajoute(_police_helvetica())
+        for i, data in sorted(flux.items()):
+            pg = rd.pages[i]
+            ovl = DecodedStreamObject()
+            ovl.set_data(data)
+            polices = DictionaryObject({_POLICE_CALQUE: police})
+            xdict = DictionaryObject()
+            xdict[NameObject('/__tpl')] = ajoute(fonds[i])
+            xdict[NameObject('/__ovl')] = ajoute(_en_forme(
+                ovl, pg.mediabox, DictionaryObject({NameObject('/Font'): polices})))
+            res = DictionaryObject()
+            res[NameObject('/XObject')] = xdict
+            contenu = DecodedStreamObject()
+            contenu.set_data(b'q /__tpl Do Q\nq /__ovl Do Q\n')
+            page = DictionaryObject(pg)          # copie : le gabarit reste intact
+            page[NameObject('/Contents')] = ajoute(contenu)
+            page[NameObject('/Resources')] = res
+            ref = pg.indirect_reference
+            objets[ref.idnum] = (ref.generation, page)
+
+        out = io.BytesIO()
+        out.write(octets)
+        if not octets.endswith(b'\n'):
+            out.write(b'\n')
+        positions = {}
+        for num in sorted(objets):
+            gen, obj = objets[num]
+            positions[num] = (out.tell(), gen)
+            out.write(_objet_pdf(num, gen, obj))
+        trailer = DictionaryObject({k: v for k, v in rd.trailer.items()
+                                    if k not in ('/Prev', '/XRefStm')})
+    xref = out.tell()
+    out.write(b'xref\n0 1\n0000000000 65535 f\r\n')    # tête de la liste libre
+    nums = sorted(positions)
+    debut = 0
+    while debut < len(nums):             # sous-sections de numéros contigus
+        fin = debut
+        while fin + 1 < len(nums) and nums[fin + 1] == nums[fin] + 1:
+            fin += 1
+        out.write(b'%d %d\n' % (nums[debut], fin - debut + 1))
+        for num in nums[debut:fin + 1]:
+            out.write(b'%010d %05d n\r\n' % positions[num])
+        debut = fin + 1
+    trailer[NameObject('/Size')] = NumberObject(suivant)
+    trailer[NameObject('/Prev')] = NumberObject(int(m.group(1)))
+    out.write(b'trailer\n')
+    trailer.write_to_stream(out, None)
+    out.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref)
+    return out.getvalue()
+
+
+PLANS = {cle: _compiler(pages) for cle, pages in FORM_LAYOUT.items()}
+PLANS.update({f'offre_{lg}': _compiler(_offre_vers_pages(lg), isoler=True)
+              for lg in OFFRE_LAYOUT})
+
+
+def _prechauffer_fonds():
+    """Construit au démarrage les XObjects des pages remplies des plans isolés."""
+    for cle, plan in PLANS.items():
+        if not plan['isoler']:
+            continue
+        try:
+            for i, _groupes in plan['pages']:
+                _fond(TEMPLATES[cle], i)
+        except Exception as e:
+            print(f"[GABARITS] {cle} : XObjects non précalculés : {e}")
+
+
+_prechauffer_fonds()
+
+
+# --- Cache des PDF générés -------------------------------------------------------
+# Les gestionnaires retéléchargent souvent le même dossier (après une correction,
+# pour le renvoyer…). La clé est le CONTENU : template (empreinte SHA-256 de ses
+# octets), mode de calque, et ce que _rendre() a tiré des données — donc
+# uniquement les champs lus par ce template, déjà normalisés (dates, cases, choix).
+# Un champ qui ne figure pas sur le document ne change pas la clé.
+# Deux niveaux : LRU en mémoire (par worker, borné en octets) et, si
+# CACHE_PDF_DOSSIER est défini, un dossier partagé entre workers, borné en taille
+# (les fichiers les moins récemment servis partent en premier).
+# CACHE_PDF=0 désactive tout.
+# Le dossier survit aux déploiements : la clé inclut aussi l'empreinte du CODE
+# de rendu (cf. _empreinte_code), une nouvelle version ne ressert jamais un PDF
+# produit par l'ancienne.
+_CACHE_PDF_VERSION = 1          # à incrémenter si le rendu change à plan égal
+_EMPREINTE_CODE = None
+_CACHE_PDF = OrderedDict()      # clé -> octets, du moins au plus récent
+_CACHE_PDF_VERROU = threading.Lock()
+_CACHE_PDF_STATS = {'memoire': 0, 'disque': 0, 'absent': 0}
+_cache_pdf_octets = 0
+
+
+def _cache_pdf_actif():
+    return os.environ.get('CACHE_PDF', '1') != '0'
+
+
+def _cache_pdf_budget(var, defaut_mo):
+    try:
+        return int(float(os.environ.get(var, defaut_mo)) * 1024 * 1024)
+    except ValueError:
+        return defaut_mo * 1024 * 1024
+
+
+def _empreinte_code():
+    """SHA du build si la plateforme le fournit (RAILWAY_GIT_COMMIT_SHA, ou
+    BUILD_SHA), sinon SHA-256 des sources du rendu (app.py, pdf_optim.py).
+    Calculée une fois par processus."""
+    global _EMPREINTE_CODE
+    if _EMPREINTE_CODE is None:
+        sha = os.environ.get('RAILWAY_GIT_COMMIT_SHA') or os.environ.get('BUILD_SHA')
+        if not sha:
+            h = hashlib.sha256()
+            ici = os.path.dirname(os.path.abspath(__file__))
+            for nom in ('app.py', 'pdf_optim.py'):
+                try:
+                    with open(os.path.join(ici, nom), 'rb') as f:
+                        h.update(f.read())
+                except OSError:
+                    h.update(nom.encode())
+            sha = h.hexdigest()
+        _EMPREINTE_CODE = sha
+    return _EMPREINTE_CODE
+
+
+def _cle_cache_pdf(cle, reportlab, pages, finition=None):
+    empreinte = _gabarit(TEMPLATES[cle])['empreinte']
+    brut = repr((_CACHE_PDF_VERSION, _empreinte_code(), cle, bool(reportlab), finition,
+                 empreinte, sorted(pages.items())))
+    return hashlib.sha256(brut.encode('utf-8')).hexdigest()
+
+
+def _cache_pdf_memoriser(cle, octets):
+    global _cache_pdf_octets
+    budget = _cache_pdf_budget('CACHE_PDF_MEMOIRE_MO', 64)
+    if len(octets) > budget:
+        return
+    with _CACHE_PDF_VERROU:
+        if cle in _CACHE_PDF:
+            _CACHE_PDF.move_to_end(cle)
+            return
+        _CACHE_PDF[cle] = octets
+        _cache_pdf_octets += len(octets)
+        while _cache_pdf_octets > budget:
+            _, vieux = _CACHE_PDF.popitem(last=False)
+            _cache_pdf_octets -= len(vieux)
+
+
+def _cache_pdf_disque_lire(cle):
+    dossier = os.environ.get('CACHE_PDF_DOSSIER')
+    if not dossier:
+        return None
+    chemin = os.path.join(dossier, f'{cle}.pdf')
+    try:
+        with open(chemin, 'rb') as f:
+            octets = f.read()
+        os.utime(chemin)                 # « récemment servi » pour l'éviction
+        return octets
+    except OSError:
+        return None
+
+
+def _cache_pdf_disque_ecrire(cle, octets):
+    """Écriture atomique (fichier temporaire + rename), puis éviction des fichiers
+    les plus anciens au-delà de CACHE_PDF_DISQUE_MO. Jamais bloquant."""
+    dossier = os.environ.get('CACHE_PDF_DOSSIER')
+    if not dossier:
+        return
+    try:
+        os.makedirs(dossier, exist_ok=True)
+        tmp = os.path.join(dossier, f'.{cle}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(octets)
+        os.replace(tmp, os.path.join(dossier, f'{cle}.pdf'))
+        fichiers = []
+        for e in os.scandir(dossier):
+            if e.name.endswith('.pdf'):
+                st = e.stat()
+                fichiers.append((st.st_mtime, st.st_size, e.path))
+        total = sum(f[1] for f in fichiers)
+        budget = _cache_pdf_budget('CACHE_PDF_DISQUE_MO', 512)
+        for _mtime, taille, chemin in sorted(fichiers):
+            if total <= budget:
+                break
+            try:
+                os.remove(chemin)
+                total -= taille
+            except OSError:
+                pass                     # déjà évincé par un autre worker
+    except OSError as e:
+        print(f"[CACHE PDF] écriture disque ignorée : {e}")
+
+
+def _cache_pdf_compter(niveau):
+    with _CACHE_PDF_VERROU:
+        _CACHE_PDF_STATS[niveau] += 1
+
+
+def _cache_pdf(cle, reportlab, pages, produire, finition=None):
+    """Renvoie les octets en cache pour ce rendu, sinon produire() et mémorise."""
+    if not _cache_pdf_actif():
+        return produire()
+    k = _cle_cache_pdf(cle, reportlab, pages, finition)
+    octets = _cache_pdf_lire(k)
+    if octets is not None:
+        return octets
+    _cache_pdf_compter('absent')
+    octets = produire()
+    _cache_pdf_ecrire(k, octets)
+    return octets
+
+
+def _cache_pdf_lire(k):
+    """Octets en cache pour la clé `k` (mémoire, puis disque), sinon None."""
+    with _chrono('cache'):
+        with _CACHE_PDF_VERROU:
+            octets = _CACHE_PDF.get(k)
+            if octets is not None:
+                _CACHE_PDF.move_to_end(k)
+                _CACHE_PDF_STATS['memoire'] += 1
+        if octets is None:
+            octets = _cache_pdf_disque_lire(k)
+            if octets is not None:
+                _cache_pdf_compter('disque')
+                _cache_pdf_memoriser(k, octets)
+    return octets
+
+
+def _cache_pdf_ecrire(k, octets):
+    _cache_pdf_memoriser(k, octets)
+    _cache_pdf_disque_ecrire(k, octets)
+
+
+def cache_pdf_stats():
+    with _CACHE_PDF_VERROU:
+        return dict(_CACHE_PDF_STATS, entrees=len(_CACHE_PDF), octets=_cache_pdf_octets)
+
+
+def vider_cache_pdf():
+    """Vide le niveau mémoire et remet les compteurs à zéro (le dossier reste)."""
+    global _cache_pdf_octets
+    with _CACHE_PDF_VERROU:
+        _CACHE_PDF.clear()
+        _cache_pdf_octets = 0
+        for k in _CACHE_PDF_STATS:
+            _CACHE_PDF_STATS[k] = 0
+
+
+def _remplir(cle, d, reportlab=None):
+    """Moteur commun : plan du template `cle` (clé de TEMPLATES) + données -> PDF.
+    Calque direct par défaut ; reportlab=True (ou CALQUE_REPORTLAB=1) force
+    l'ancien calque reportlab, qui sert aussi de repli automatique.
+    Le résultat passe par le cache des PDF générés (cf. _cache_pdf)."""
+    pages = _rendre(PLANS[cle], d)
+    if reportlab is None:
+        reportlab = _calque_reportlab_force()
+    finition = _finition(cle)
+    return _cache_pdf(cle, reportlab, pages,
+                      lambda: _produit(_produire(cle, pages, reportlab, finition)), finition)
+
+
+def _produire(cle, pages, reportlab, finition=None):
+    """Génère réellement le PDF (hors cache) à partir du rendu `pages` ->
+    (octets, (avant, après) | None). finition : None, 'optimiser' ou 'lineariser'
+    (cf. _finition). Peut tourner dans le pool, hors requête : les tailles sont
+    rendues à l'appelant, qui les compte (cf. _produit)."""
+    octets = _generer(cle, pages, reportlab)
+    return _finir(octets, cle, finition) if finition else (octets, None)
+
+
+def _produit(resultat):
+    """(octets, tailles) de _produire -> octets ; tailles comptées pour la requête."""
+    octets, tailles = resultat
+    _compter_tailles(tailles)
+    return octets
+
+
+def _generer(cle, pages, reportlab):
+    plan = PLANS[cle]
+    if not reportlab:
+        try:
+            flux = {i: _flux_texte(groupes) for i, groupes in pages.items() if groupes}
+        except UnicodeEncodeError:
+            flux = None                          # texte hors WinAnsi -> reportlab
+        if flux is not None and plan['isoler']:
+            return _maj_incrementale(TEMPLATES[cle], flux)
+        if flux is not None:
+            return _poser_flux(TEMPLATES[cle], flux).getvalue()
+    dessinees = {i for i, groupes in pages.items() if groupes}
+    if plan['isoler']:
+        overlays = {i: make_overlay(lambda c, g=pages[i]: _dessiner(c, g))
+                    for i in dessinees}
+        return merge_selective(TEMPLATES[cle], overlays).getvalue()
+    return merge(TEMPLATES[cle], _calque_reportlab(pages, plan['nb_pages']),
+                 dessinees=dessinees).getvalue()
+
+
+# --- Optimisation de taille (optionnelle) -------------------------------------
+# PDF_OPTIMISER=1, ou ?optimiser=1 sur la requête : objets identiques fusionnés
+# (polices, ProcSets des calques), flux d'objets et xref compressée (cf.
+# pdf_optim.py). Rendu identique au pixel ; gain de 1 % (procuration, un seul
+# gros flux) à 50 % (calques reportlab), pour 5 à 70 ms de plus par document.
+# Le PDF optimisé a sa propre entrée dans le cache.
+#
+# Sortie linéarisée (« affichage web rapide ») pour les gros documents que les
+# gestionnaires prévisualisent avant envoi : ?lineariser=1 sur la requête, ou
+# PDF_LINEARISER=offre,procuration pour les linéariser d'office. La page 1 et
+# ses ressources sont en tête de fichier : un visualiseur qui lit en flux
+# l'affiche dès /E octets reçus, quelle que soit la longueur du document.
+LINEARISABLES = {'offre_fr': 'offre', 'offre_nl': 'offre', 'procuration': 'procuration'}
+
+
+def _optimisation_demandee():
+    if os.environ.get('PDF_OPTIMISER') == '1':
+        return True
+    return has_request_context() and request.args.get('optimiser') == '1'
+
+
+def _finition(cle):
+    """Passe à appliquer au PDF du template `cle` : 'lineariser', 'optimiser' ou None."""
+    doc = LINEARISABLES.get(cle)
+    if doc:
+        d_office = [x.strip() for x in os.environ.get('PDF_LINEARISER', '').split(',')]
+        if doc in d_office or (has_request_context() and request.args.get('lineariser') == '1'):
+            return 'lineariser'
+    return 'optimiser' if _optimisation_demandee() else None
+
+
+def _optimiser(octets, cle, finition='optimiser'):
+    """Passe pdf_optim sur `octets` ; en cas d'échec, le PDF d'origine est servi.
+    Tailles avant/après : journal + en-tête X-PDF-Taille (cumulé sur la requête)."""
+    octets, tailles = _finir(octets, cle, finition)
+    _compter_tailles(tailles)
+    return octets
+
+
+def _compter_tailles(tailles):
+    """Ajoute (avant, après) au cumul de la requête : en-tête X-PDF-Taille, ou
+    journal [ZIP] pour une archive en flux (cf. _ligne_tailles_pdf)."""
+    if tailles and has_request_context():
+        cumul = g.setdefault('tailles_pdf', [0, 0])
+        cumul[0] += tailles[0]
+        cumul[1] += tailles[1]
+
+
+def _ligne_tailles_pdf():
+    """Valeur de X-PDF-Taille pour la requête en cours, ou None."""
+    tailles = g.get('tailles_pdf')
+    return f'avant={tailles[0]}; apres={tailles[1]}' if tailles else None
+
+
+def _finir(octets, cle, finition):
+    """Cœur de _optimiser, sans état de requête (utilisable dans le pool) ->
+    (octets, (avant, après) | None si échec)."""
+    lineariser = finition == 'lineariser'
+    try:
+        with _chrono('optim'):
+            try:
+                octets_opt, st = (lineariser_pdf if lineariser else optimiser_pdf)(octets)
+            except LinearisationIncoherente as e:
+                print(f"[OPTIM] {cle} : linéarisation abandonnée ({e}), PDF non linéarisé servi")
+                lineariser = False
+                octets_opt, st = optimiser_pdf(octets)
+    except Exception as e:
+        print(f"[OPTIM] {cle} : échec ({e}), PDF non optimisé servi")
+        return octets, None
+    if lineariser:
+        print(f"[OPTIM] {cle} linéarisé : {st['avant'] / 1024:.0f} Ko -> "
+              f"{st['apres'] / 1024:.0f} Ko, page 1 dans les {st['premiere_page'] / 1024:.0f} "
+              f"premiers Ko")
+    else:
+        print(f"[OPTIM] {cle} : {st['avant'] / 1024:.0f} Ko -> {st['apres'] / 1024:.0f} Ko, "
+              f"{st['objets_avant']} -> {st['objets_apres']} objets")
+    return octets_opt, (st['avant'], st['apres'])
+
+
+def _resoudre(doc_type, data, lang_prefs=None):
+    """doc_type (+ préférences de langue) -> (clé de TEMPLATES, données prêtes à
+    rendre), ou None si le type est inconnu. Seul endroit où se choisissent le
+    template par langue et les replis de signataire."""
+    if lang_prefs is None: lang_prefs = {}
+    if doc_type in ['accident','att_accident']:
+        cle = 'att_accident_nl' if lang_prefs.get('accident','fr') == 'nl' else 'att_accident_fr'
+        return cle, with_signatory_fallbacks(data)
+    if doc_type in ['seppt','att_seppt']:
+        cle = 'att_seppt_nl' if lang_prefs.get('seppt','fr') == 'nl' else 'att_seppt_fr'
+        return cle, with_signatory_fallbacks(data)
+    if doc_type == 'offre':
+        lang = 'nl' if str(lang_prefs.get('offre','fr')).lower().startswith('nl') else 'fr'
+        return f'offre_{lang}', data
+    if doc_type == 'dispense':
+        return 'dispense', with_signatory_fallbacks(data)
+    if doc_type in ['employer','travailleur','independant','procuration','mensura']:
+        return doc_type, data
+    return None
+
+
+def fill_employer_pdf(d):
+    return _remplir(*_resoudre('employer', d))
+
+def fill_travailleur_pdf(d):
+    return _remplir(*_resoudre('travailleur', d))
+
+def fill_independant_pdf(d):
+    return _remplir(*_resoudre('independant', d))
+
+def fill_att_accident_pdf(d, lang='fr'):
+    return _remplir(*_resoudre('accident', d, {'accident': lang}))
+
+def fill_att_seppt_pdf(d, lang='fr'):
+    return _remplir(*_resoudre('seppt', d, {'seppt': lang}))
+
 def fill_offre_pdf(d, lang='fr'):
     """Offre de collaboration 2026-2027 (FR 20 pages / NL 21 pages).
     Remplit la couverture, les conditions particulières, la procuration et le contrat
     de mandat ; toutes les autres pages sont statiques et préservées telles quelles."""
-    lang = 'nl' if str(lang).lower().startswith('nl') else 'fr'
-    tpl = TEMPLATES['offre_nl'] if lang == 'nl' else TEMPLATES['offre_fr']
-    L = OFFRE_LAYOUT[lang]
-
-    def val(primary, fallback):
-        return d.get(primary) or d.get(fallback)
-
-    def tva():
-        return d.get('num_tva') or d.get('num_entreprise')
-
-    # Les coordonnées ci-dessus sont celles du bas des « ……… ». On remonte la ligne
-    # de base de 7 pour que le texte se pose SUR la ligne pointillée au lieu d'être
-    # barré par les points.
-    BASELINE_ADJ = 7
-
-    def pose(c, coords, champ, valeur):
-        if valeur and champ in coords:
-            x, y = coords[champ]
-            txt(c, valeur, x, y - BASELINE_ADJ)
-
-    def bloc_societe(c, p):
-        pose(c, p, 'societe', d.get('nom_societe'))
-        pose(c, p, 'adr1', val('adresse_1', 'adresse_siege_social_1'))
-        pose(c, p, 'adr2', val('adresse_2', 'adresse_siege_social_2'))
-        pose(c, p, 'tva', tva())
-        pose(c, p, 'repr', val('represente_par', 'nom_prenom_gerant'))
-
-    def bloc_mandataire(c, p):
-        pose(c, p, 'soussigne', val('nom_soussigne', 'nom_prenom_gerant'))
-        pose(c, p, 'niss', val('niss', 'niss_gerant'))
-        pose(c, p, 'dom1', val('domicile_1', 'adresse_siege_social_1'))
-        pose(c, p, 'dom2', val('domicile_2', 'adresse_siege_social_2'))
-        pose(c, p, 'qualite', d.get('qualite'))
-        pose(c, p, 'societe', val('societe', 'nom_societe'))
-        pose(c, p, 'adr1', val('adresse_1', 'adresse_siege_social_1'))
-        pose(c, p, 'adr2', val('adresse_2', 'adresse_siege_social_2'))
-        pose(c, p, 'tva', tva())
-        pose(c, p, 'date', val('date_signature', 'date_fait'))
-
-    def draw_cond(c):
-        p = L['cond']
-        bloc_societe(c, p)
-        pose(c, p, 'jour', d.get('date_entree_jour'))
-        pose(c, p, 'mois', d.get('date_entree_mois'))
-        pose(c, p, 'annee', d.get('date_entree_annee'))
-        pose(c, p, 'fait', val('date_fait', 'date_signature'))
-
-    overlays = {
-        L['pages']['cover']: make_overlay(lambda c: bloc_societe(c, L['cover'])),
-        L['pages']['cond']: make_overlay(draw_cond),
-        L['pages']['proc']: make_overlay(lambda c: bloc_mandataire(c, L['proc'])),
-        L['pages']['mandat']: make_overlay(lambda c: bloc_mandataire(c, L['mandat'])),
-    }
-    return merge_selective(tpl, overlays).getvalue()
+    return _remplir(*_resoudre('offre', d, {'offre': lang}))
 
 def fill_procuration_pdf(d):
-    p, c = newcan()
-    if d.get('num_entreprise'): txt(c, d['num_entreprise'], 215, 115)
-    if d.get('denomination'): txt(c, d['denomination'], 184, 135)
-    if d.get('rue'): txt(c, d['rue'], 119, 152)
-    if d.get('numero'): txt(c, d['numero'], 440, 153)
-    if d.get('boite'): txt(c, d['boite'], 571, 153)
-    if d.get('code_postal'): txt(c, d['code_postal'], 145, 174)
-    if d.get('commune'): txt(c, d['commune'], 286, 173)
-    if d.get('pays'): txt(c, d['pays'], 482, 174)
-    if d.get('num_onss'): txt(c, d['num_onss'], 476, 118)
-    if d.get('num_affiliation_employeur'): txt(c, d['num_affiliation_employeur'], 274, 268)
-    if d.get('trimestre_debut'): txt(c, d['trimestre_debut'], 202, 518)
-    if d.get('trimestre_fin'): txt(c, d['trimestre_fin'], 462, 520)
-    if d.get('date_signature'): txt(c, d['date_signature'], 186, 690)
-    if d.get('niss_mandant'): txt(c, d['niss_mandant'], 241, 706)
-    if d.get('nom_mandant'): txt(c, d['nom_mandant'], 171, 726)
-    c.save()
-    return merge(TEMPLATES['procuration'], p, 1).getvalue()
+    return _remplir(*_resoudre('procuration', d))
 
 def fill_dispense_pdf(d):
-    d = with_signatory_fallbacks(d)
-    p, c = newcan()
-    if d.get('nom_soussigne'): txt(c, d['nom_soussigne'], 334, 188)
-    if d.get('qualite'): txt(c, d['qualite'], 255, 206)
-    if d.get('societe'): txt(c, d['societe'], 463, 208)
-    if d.get('num_entreprise'): txt(c, d['num_entreprise'], 514, 222)
-    if d.get('depuis_date'): txt(c, d['depuis_date'], 187, 238)
-    if d.get('checkbox_10pct'): txt(c, 'X', 91, 307, 12)
-    c.showPage()
-    if d.get('checkbox_20pct'): txt(c, 'X', 90, 312, 12)
-    if d.get('etabli_lieu'): txt(c, d['etabli_lieu'], 176, 761)
-    if d.get('etabli_date'): txt(c, d['etabli_date'], 329, 761)
-    c.save()
-    return merge(TEMPLATES['dispense'], p, 2).getvalue()
+    return _remplir(*_resoudre('dispense', d))
 
 def fill_mensura_pdf(d):
-    p, c = newcan()
-    if d.get('nom_entreprise'): txt(c, d['nom_entreprise'], 144, 236)
-    if d.get('siege_social_1'): txt(c, d['siege_social_1'], 148, 289)
-    if d.get('siege_social_2'): txt(c, d['siege_social_2'], 147, 302)
-    if d.get('siege_exploitation'): txt(c, d['siege_exploitation'], 167, 344)
-    if d.get('telephone'): txt(c, d['telephone'], 189, 371)
-    if d.get('gsm'): txt(c, d['gsm'], 439, 368)
-    if d.get('email'): txt(c, d['email'], 184, 410)
-    if d.get('tva_bce'): txt(c, d['tva_bce'], 210, 438)
-    if d.get('num_onss'): txt(c, d['num_onss'], 476, 437)
-    if d.get('compte_bancaire'): txt(c, d['compte_bancaire'], 233, 467)
-    if d.get('code_nace'): txt(c, d['code_nace'], 342, 519)
-    if d.get('nb_travailleurs'): txt(c, d['nb_travailleurs'], 617, 517)
-    c.showPage(); c.showPage(); c.showPage()
-    if d.get('date_cours'): txt(c, d['date_cours'], 322, 125)
-    if d.get('fait_lieu'): txt(c, d['fait_lieu'], 181, 194)
-    if d.get('fait_date'): txt(c, d['fait_date'], 326, 197)
-    if d.get('nom_delegue'): txt(c, d['nom_delegue'], 143, 442)
-    c.save()
-    return merge(TEMPLATES['mensura'], p, 4).getvalue()
+    return _remplir(*_resoudre('mensura', d))
 
 # ============== DISPATCHER ==============
 def generate_pdf_bytes(doc_type, data, lang_prefs=None):
-    if lang_prefs is None: lang_prefs = {}
-    if doc_type in ['accident','att_accident']: return fill_att_accident_pdf(data, lang_prefs.get('accident','fr'))
-    if doc_type in ['seppt','att_seppt']: return fill_att_seppt_pdf(data, lang_prefs.get('seppt','fr'))
-    if doc_type == 'offre': return fill_offre_pdf(data, lang_prefs.get('offre','fr'))
-    generators = {
-        'employer': fill_employer_pdf, 'travailleur': fill_travailleur_pdf,
-        'independant': fill_independant_pdf, 'dispense': fill_dispense_pdf,
-        'procuration': fill_procuration_pdf, 'mensura': fill_mensura_pdf,
-    }
-    if doc_type in generators: return generators[doc_type](data)
+    with _chrono('pdf'):
+        return _generate_pdf_bytes(doc_type, data, lang_prefs)
+
+def _generate_pdf_bytes(doc_type, data, lang_prefs=None):
+    r = _resoudre(doc_type, data, lang_prefs)
+    return _remplir(*r) if r else None
+
+
+# --- Dossier complet en parallèle ---------------------------------------------
+# pypdf/reportlab sont du pur CPU : des threads se battraient pour le GIL. Les
+# documents d'un dossier sont indépendants -> pool de PROCESSUS borné, partagé
+# par le worker (ZIP_PROCESSUS, défaut min(4, nb de CPU) ; 0 ou 1 = séquentiel).
+# Le cache (mémoire du worker + disque) est consulté AVANT d'envoyer au pool :
+# seuls les rendus absents partent en calcul, et leur résultat y est rangé.
+# « forkserver » plutôt que fork : le worker web a des threads et des verrous
+# (gabarits, cache), un fork en plein milieu pourrait en hériter verrouillés.
+# Pool cassé (à la soumission comme au résultat) -> calcul sur place dans le
+# worker ; un processus bloqué plus de ZIP_DELAI_PROCESSUS secondes (défaut 120)
+# fait échouer son seul document au lieu de suspendre la requête.
+_POOL = None
+_POOL_VERROU = threading.Lock()
+
+
+def _taille_pool():
+    try:
+        return max(int(os.environ.get('ZIP_PROCESSUS', min(4, os.cpu_count() or 1))), 0)
+    except ValueError:
+        return 1
+
+
+def _pool():
+    global _POOL
+    with _POOL_VERROU:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=_taille_pool(),
+                                        mp_context=multiprocessing.get_context('forkserver'))
+        return _POOL
+
+
+def _abandonner_pool():
+    """Pool cassé (processus tué, mémoire…) : on l'oublie, le prochain appel en recrée un."""
+    global _POOL
+    with _POOL_VERROU:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _delai_pool():
+    try:
+        return max(float(os.environ.get('ZIP_DELAI_PROCESSUS', 120)), 1.0)
+    except ValueError:
+        return 120.0
+
+
+def _soumettre(fn, *args):
+    """Soumet au pool -> futur, ou None si le pool est cassé (l'appelant calcule
+    alors sur place, cf. _attendre)."""
+    try:
+        return _pool().submit(fn, *args)
+    except BrokenProcessPool:
+        _abandonner_pool()
+    except RuntimeError:             # arrêté par un autre thread entre _pool() et submit
+        pass
+    return None
+
+
+def _attendre(futur, repli):
+    """Résultat d'un futur de _soumettre ; pas de futur ou pool cassé -> repli()
+    sur place. Au-delà de _delai_pool() : TimeoutError pour ce seul calcul."""
+    if futur is None:
+        return repli()
+    try:
+        return futur.result(timeout=_delai_pool())
+    except BrokenProcessPool:
+        _abandonner_pool()
+        return repli()
+    except CancelledError:           # annulé par l'abandon du pool (autre appel)
+        return repli()
+    except DelaiFuturDepasse:
+        futur.cancel()
+        raise TimeoutError(f"plus de {_delai_pool():g} s dans le pool de processus") from None
+
+
+def generer_documents(documents, form_data, lang_prefs=None):
+    """Génère les documents d'un dossier -> itère (doc_type, octets, erreur) DANS
+    L'ORDRE de `documents`, en calculant en parallèle. octets = None si le type
+    est inconnu ; une erreur ne concerne que son document."""
+    if _taille_pool() <= 1 or len(documents) <= 1:
+        for doc_type in documents:
+            try:
+                yield doc_type, generate_pdf_bytes(doc_type, form_data, lang_prefs), None
+            except Exception as e:
+                yield doc_type, None, e
+        return
+    reportlab = _calque_reportlab_force()
+    taches = []              # (doc_type, octets | (cle, pages, finition, k, futur) | erreur)
+    for doc_type in documents:
+        try:
+            r = _resoudre(doc_type, form_data, lang_prefs)
+            if r is None:
+                taches.append((doc_type, None))
+                continue
+            cle, d = r
+            pages = _rendre(PLANS[cle], d)
+            finition = _finition(cle)
+            k = _cle_cache_pdf(cle, reportlab, pages, finition) if _cache_pdf_actif() else None
+            octets = _cache_pdf_lire(k) if k else None
+            if octets is not None:
+                taches.append((doc_type, octets))
+                continue
+            if k:
+                _cache_pdf_compter('absent')
+            futur = _soumettre(_produire, cle, pages, reportlab, finition)
+            taches.append((doc_type, (cle, pages, finition, k, futur)))
+        except Exception as e:
+            taches.append((doc_type, e))
+    for doc_type, t in taches:
+        if isinstance(t, Exception):
+            yield doc_type, None, t
+            continue
+        if not isinstance(t, tuple):
+            yield doc_type, t, None
+            continue
+        cle, pages, finition, k, futur = t
+        try:
+            with _chrono('pdf'):
+                octets = _produit(_attendre(futur, lambda: _produire(cle, pages, reportlab, finition)))
+        except Exception as e:
+            yield doc_type, None, e
+            continue
+        if k:
+            _cache_pdf_ecrire(k, octets)
+        yield doc_type, octets, None
+
+# --- Publipostage : N exemplaires dans UN PDF ------------------------------------
+# Même attestation pour des dizaines de clients : au lieu de N copies complètes du
+# template (~250-800 Ko chacune), chaque page du template devient UN Form XObject
+# partagé (cf. _fond), et chaque exemplaire n'ajoute qu'une page qui le dessine
+# (« q /__tpl Do Q ») suivie de son texte : quelques Ko par exemplaire.
+LOT_DOCUMENTS = ('seppt', 'att_seppt', 'accident', 'att_accident', 'procuration')
+LOT_MAX = 500
+
+
+def remplir_lot(doc_type, lot, lang_prefs=None):
+    """Liste de données -> un PDF avec un exemplaire rempli par élément, dans
+    l'ordre (toutes les pages du template pour chacun)."""
+    if doc_type not in LOT_DOCUMENTS:
+        raise ValueError(f"publipostage non disponible pour « {doc_type} »")
+    if not lot:
+        raise ValueError("lot vide")
+    cle = _resoudre(doc_type, {}, lang_prefs)[0]
+    plan = PLANS[cle]
+    gab = _gabarit(TEMPLATES[cle])
+    with gab['verrou']:
+        boites = [ArrayObject(FloatObject(v) for v in pg.mediabox) for pg in gab['lecteur'].pages]
+    wr = PdfWriter()
+    police = wr._add_object(_police_helvetica())
+    fonds = {}                           # index de page -> XObject partagé
+    for d in lot:
+        pages = _rendre(plan, _resoudre(doc_type, d, lang_prefs)[1])
+        for i, boite in enumerate(boites):
+            if i not in fonds:
+                fonds[i] = wr._add_object(_fond(TEMPLATES[cle], i)['objet'].clone(wr))
+            xobjets = DictionaryObject({NameObject('/__tpl'): fonds[i]})
+            res = DictionaryObject({NameObject('/XObject'): xobjets})
+            contenu = b'q /__tpl Do Q\n'
+            groupes = pages.get(i)
+            if groupes:
+                try:
+                    contenu += _flux_texte(groupes)
+                    res[NameObject('/Font')] = DictionaryObject({_POLICE_CALQUE: police})
+                except UnicodeEncodeError:       # texte hors WinAnsi -> calque reportlab
+                    ov = PdfReader(io.BytesIO(make_overlay(
+                        lambda c, g=groupes: _dessiner(c, g)))).pages[0]
+                    xobjets[NameObject('/__ovl')] = _en_xobject(wr, ov, etranger=True)
+                    contenu += b'q /__ovl Do Q\n'
+            page = wr.add_blank_page(1, 1)
+            page[NameObject('/MediaBox')] = boite
+            page[NameObject('/Resources')] = res
+            page[NameObject('/Contents')] = _flux_objet(wr, contenu)
+    out = io.BytesIO()
+    wr.write(out)
+    if _optimisation_demandee():
+        return _optimiser(out.getvalue(), f'lot {cle}')
+    return out.getvalue()
+
+NOMS_DOCUMENTS = {
+    'employer': 'Fiche_employeur.pdf', 'travailleur': 'Fiche_travailleur.pdf',
+    'independant': 'Fiche_independant.pdf', 'dispense': 'Dispense_precompte.pdf',
+    'procuration': 'Procuration_ONSS.pdf', 'mensura': 'Contrat_Mensura.pdf',
+}
+
+
+def nom_document(doc_type, lang_prefs=None):
+    """Nom de fichier d'un document généré (archive ZIP, régénération)."""
+    lang_prefs = lang_prefs or {}
+    if doc_type == 'offre':
+        return f"Offre_de_collaboration_{lang_prefs.get('offre','fr').upper()}.pdf"
+    if doc_type in ['accident','att_accident']:
+        return f"Attestation_accident_travail_{lang_prefs.get('accident','fr').upper()}.pdf"
+    if doc_type in ['seppt','att_seppt']:
+        return f"Attestation_SEPPT_{lang_prefs.get('seppt','fr').upper()}.pdf"
+    return NOMS_DOCUMENTS.get(doc_type, f"{doc_type}.pdf")
+
+
+# --- Régénération en masse ------------------------------------------------------
+# Nouveau template (ex. prochaine édition de l'Offre) -> régénérer les documents de
+# TOUS les dossiers de la table `employeurs`, au lieu d'un clic portail par dossier.
+# Job en arrière-plan (thread du worker) : lit les employeurs par pages (keyset sur
+# id), rend les documents demandés avec generate_pdf_bytes sur le pool de processus
+# (cf. _pool, séquentiel si ZIP_PROCESSUS <= 1) et les écrit dans
+#   <REGEN_DOSSIER>/<job>/<num_entreprise>/<nom du document>.pdf
+# L'état du job est en mémoire ET recopié dans <job>/statut.json : avec plusieurs
+# workers gunicorn, la route de suivi répond quel que soit le worker atteint.
+_REGEN_JOBS = {}
+_REGEN_VERROU = threading.Lock()
+_REGEN_PAGE = 100
+_REGEN_ECHECS_MAX = 200          # détail conservé ; le compteur, lui, est exact
+
+
+def _regen_racine():
+    return os.environ.get('REGEN_DOSSIER') or os.path.join(tempfile.gettempdir(),
+                                                            'persoproject_regen')
+
+
+def _regen_publier(job):
+    """Met à jour les compteurs dérivés et recopie l'état dans statut.json."""
+    with _REGEN_VERROU:
+        fin = job['termine_at'] or time.time()
+        duree = max(fin - job['demarre_at'], 1e-6)
+        job['duree_s'] = round(duree, 1)
+        job['documents_par_s'] = round(job['documents_generes'] / duree, 2)
+        etat = dict(job, echecs=list(job['echecs']))
+    try:
+        os.makedirs(job['dossier'], exist_ok=True)
+        tmp = os.path.join(job['dossier'], '.statut.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(etat, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(job['dossier'], 'statut.json'))
+    except OSError as e:
+        print(f"[REGEN] statut.json non écrit : {e}")
+
+
+def _regen_employeurs(taille_page):
+    """Itère les employeurs stockés (id, num_entreprise, data), page par page."""
+    dernier = None
+    while True:
+        q = f"select=id,num_entreprise,data&order=id.asc&limit={taille_page}"
+        if dernier is not None:
+            q += f"&id=gt.{dernier}"
+        r = supabase_http.get(f"{SUPABASE_URL}/rest/v1/employeurs?{q}",
+                         headers=_supabase_headers(), timeout=30)
+        if r.status_code >= 300:
+            raise RuntimeError(f"Supabase {r.status_code}: {r.text[:200]}")
+        rows = r.json() or []
+        yield rows
+        if len(rows) < taille_page:
+            return
+        dernier = rows[-1]['id']
+
+
+def _regen_echec(job, num, doc_type, erreur):
+    with _REGEN_VERROU:
+        job['nb_echecs'] += 1
+        if len(job['echecs']) < _REGEN_ECHECS_MAX:
+            job['echecs'].append({'num_entreprise': num, 'document': doc_type,
+                                  'erreur': str(erreur)[:300]})
+
+
+def _regen_sous_dossier(row):
+    """Dossier d'un employeur dans le job : « <id>_<numéro assaini> ». L'id (unique)
+    sépare deux numéros qui ne diffèrent que par des caractères remplacés ; un
+    numéro fait seulement de points (« . », « .. ») n'est pas gardé."""
+    num = re.sub(r'[^0-9A-Za-z._-]', '_', str(row.get('num_entreprise') or ''))
+    if not num.strip('.'):
+        num = 'sans_numero'
+    return f"{row.get('id')}_{num}"
+
+
+def _regen_ecrire(job, sous, doc_type, octets):
+    dossier = os.path.join(job['dossier'], sous)
+    os.makedirs(dossier, exist_ok=True)
+    with open(os.path.join(dossier, nom_document(doc_type, job['language_prefs'])), 'wb') as f:
+        f.write(octets)
+    with _REGEN_VERROU:
+        job['documents_generes'] += 1
+
+
+def _regen_recolter(job, tache):
+    """Attend une tâche (num, sous-dossier, doc_type, arguments de _produire,
+    futur | None) et range son document. Pas de futur, ou pool cassé en cours de
+    route : rendu sur place (cf. _attendre)."""
+    num, sous, doc_type, args, futur = tache
+    try:
+        octets, _tailles = _attendre(futur, lambda: _produire(*args))
+        _regen_ecrire(job, sous, doc_type, octets)
+    except Exception as e:
+        _regen_echec(job, num, doc_type, e)
+
+
+def _regenerer(job):
+    """Corps du job (thread d'arrière-plan). Ne lève jamais : tout finit dans l'état.
+    Au plus 2 tâches par processus du pool en vol : une page de 1000 employeurs ne
+    remplit pas la file du pool (ni la mémoire du worker) de milliers de futurs.
+    Rendu par _produire, comme generer_documents, mais SANS le cache des PDF :
+    des milliers de documents servis une fois en chasseraient les entrées utiles
+    du portail (et rempliraient CACHE_PDF_DOSSIER)."""
+    documents, prefs = job['documents'], job['language_prefs']
+    reportlab = _calque_reportlab_force()
+    parallele = _taille_pool() > 1
+    en_vol_max = 2 * _taille_pool() if parallele else 0
+    en_vol = deque()
+    try:
+        for rows in _regen_employeurs(job['taille_page']):
+            for row in rows:
+                num = str(row.get('num_entreprise') or row.get('id') or '')
+                sous = _regen_sous_dossier(row)
+                data = row.get('data') if isinstance(row.get('data'), dict) else {}
+                for doc_type in documents:
+                    try:
+                        r = _resoudre(doc_type, data, prefs)
+                        if r is None:
+                            continue
+                        cle, d = r
+                        args = (cle, _rendre(PLANS[cle], d), reportlab, _finition(cle))
+                    except Exception as e:
+                        _regen_echec(job, num, doc_type, e)
+                        continue
+                    futur = _soumettre(_produire, *args) if parallele else None
+                    en_vol.append((num, sous, doc_type, args, futur))
+                    while len(en_vol) > en_vol_max:
+                        _regen_recolter(job, en_vol.popleft())
+            while en_vol:
+                _regen_recolter(job, en_vol.popleft())
+            with _REGEN_VERROU:
+                job['employeurs_traites'] += len(rows)
+            _regen_publier(job)
+        statut, message = 'termine', None
+    except Exception as e:
+        statut, message = 'echec', str(e)[:300]
+    with _REGEN_VERROU:
+        job.update(statut=statut, message=message, termine_at=time.time())
+    _regen_publier(job)
+    print(f"[REGEN] job {job['id']} {job['statut']} : {job['employeurs_traites']} employeurs, "
+          f"{job['documents_generes']} documents, {job['nb_echecs']} échecs, "
+          f"{job['documents_par_s']} doc/s")
+
+
+# Une seule régénération à la fois, TOUS workers gunicorn confondus : la
+# vérification « rien en cours » et la création du job se font sous un verrou
+# fichier (<REGEN_DOSSIER>/.verrou, créé en O_EXCL, tenu quelques ms). Chaque job
+# note son propriétaire (machine, PID) : un job « en_cours » dont le processus a
+# disparu (worker redémarré, déploiement) passe en 'interrompu' au lieu de bloquer
+# les suivants. REGEN_DOSSIER est local à la machine, ou un volume monté par une
+# seule instance à la fois.
+_REGEN_VERROU_DELAI = 5          # s d'attente du verrou fichier
+_REGEN_VERROU_ORPHELIN = 30      # s : au-delà, un verrou resté là est celui d'un mort
+
+
+class _verrou_regen:
+    """Verrou fichier inter-processus autour du lancement d'un job."""
+    def __enter__(self):
+        racine = _regen_racine()
+        os.makedirs(racine, exist_ok=True)
+        self.chemin = os.path.join(racine, '.verrou')
+        fin = time.time() + _REGEN_VERROU_DELAI
+        while True:
+            try:
+                fd = os.open(self.chemin, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                break
+            except FileExistsError:
+                try:
+                    orphelin = time.time() - os.path.getmtime(self.chemin) > _REGEN_VERROU_ORPHELIN
+                except OSError:
+                    orphelin = False             # libéré entre-temps : on retente
+                if orphelin:
+                    print(f"[REGEN] verrou orphelin retiré : {self.chemin}")
+                    _supprimer_sans_erreur(self.chemin)
+                elif time.time() > fin:
+                    raise TimeoutError("verrou de régénération occupé")
+                else:
+                    time.sleep(0.05)
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        return self
+
+    def __exit__(self, *exc):
+        _supprimer_sans_erreur(self.chemin)
+        return False
+
+
+def _supprimer_sans_erreur(chemin):
+    try:
+        os.remove(chemin)
+    except OSError:
+        pass
+
+
+def _regen_proprietaire():
+    return {'hote': socket.gethostname(), 'pid': os.getpid()}
+
+
+def _regen_proprietaire_vivant(etat):
+    """Le processus qui fait tourner ce job existe-t-il encore ?"""
+    if etat.get('hote') != socket.gethostname() or not etat.get('pid'):
+        return False
+    try:
+        os.kill(int(etat['pid']), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def _regen_lire(job_id):
+    """statut.json d'un job ; « en_cours » sans propriétaire vivant -> 'interrompu'
+    (recopié dans statut.json)."""
+    chemin = os.path.join(_regen_racine(), job_id, 'statut.json')
+    try:
+        with open(chemin, encoding='utf-8') as f:
+            etat = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if etat.get('statut') == 'en_cours' and not _regen_proprietaire_vivant(etat):
+        etat.update(statut='interrompu', termine_at=time.time(),
+                    message=f"processus {etat.get('pid')} ({etat.get('hote')}) disparu")
+        print(f"[REGEN] job {job_id} interrompu : {etat['message']}")
+        try:
+            tmp = chemin + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(etat, f, ensure_ascii=False)
+            os.replace(tmp, chemin)
+        except OSError as e:
+            print(f"[REGEN] statut.json non écrit : {e}")
+    return etat
+
+
+def _regen_en_cours():
+    """Id d'un job en cours (ce worker ou un autre), sinon None. À appeler sous
+    _verrou_regen."""
+    with _REGEN_VERROU:
+        for j in _REGEN_JOBS.values():
+            if j['statut'] == 'en_cours':
+                return j['id']
+    try:
+        noms = os.listdir(_regen_racine())
+    except OSError:
+        return None
+    for nom in noms:
+        if re.fullmatch(r'[0-9a-f]{32}', nom):
+            etat = _regen_lire(nom)
+            if etat and etat.get('statut') == 'en_cours':
+                return nom
     return None
 
+
+def lancer_regeneration(documents, language_prefs=None, taille_page=_REGEN_PAGE):
+    """Crée le job et démarre son thread ; renvoie l'état initial. Les jobs terminés
+    de ce worker quittent la mémoire (leur statut.json reste lisible)."""
+    job_id = uuid.uuid4().hex
+    job = {
+        'id': job_id, 'statut': 'en_cours', 'message': None,
+        'documents': list(documents), 'language_prefs': dict(language_prefs or {}),
+        'taille_page': taille_page, 'dossier': os.path.join(_regen_racine(), job_id),
+        'demarre_at': time.time(), 'termine_at': None, **_regen_proprietaire(),
+        'employeurs_traites': 0, 'documents_generes': 0, 'nb_echecs': 0, 'echecs': [],
+    }
+    with _REGEN_VERROU:
+        for ancien in [i for i, j in _REGEN_JOBS.items() if j['statut'] != 'en_cours']:
+            del _REGEN_JOBS[ancien]
+        _REGEN_JOBS[job_id] = job
+    _regen_publier(job)
+    threading.Thread(target=_regenerer, args=(job,), name=f'regen-{job_id[:8]}',
+                     daemon=True).start()
+    return etat_regeneration(job_id)
+
+
+def etat_regeneration(job_id):
+    """État d'un job (mémoire de ce worker, sinon statut.json), ou None."""
+    with _REGEN_VERROU:
+        job = _REGEN_JOBS.get(job_id)
+        if job is not None:
+            return dict(job, echecs=list(job['echecs']))
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+        return None
+    return _regen_lire(job_id)
+
+
+@app.route('/regeneration', methods=['POST'])
+def regeneration_lancer():
+    """Lance la régénération de documents pour tous les employeurs stockés.
+    Body: {documents: [...], language_prefs?: {...}, taille_page?: 1-1000}."""
+    if not (verify_user_token(request) or _jeton_machine_ok(request)):
+        return jsonify({"error": "Non authentifié"}), 401
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        return jsonify({"error": "Supabase non configuré"}), 503
+    d = request.get_json(silent=True) or {}
+    documents = normalize_documents(list(d.get('documents') or []))
+    inconnus = [x for x in documents if _resoudre(x, {}) is None]
+    if not documents or inconnus:
+        return jsonify({"error": f"documents invalides : {inconnus or 'liste vide'}"}), 400
+    try:
+        taille_page = min(max(int(d.get('taille_page') or _REGEN_PAGE), 1), 1000)
+    except (TypeError, ValueError):
+        return jsonify({"error": "taille_page : entier attendu"}), 400
+    try:
+        with _verrou_regen():
+            en_cours = _regen_en_cours()
+            if en_cours is None:
+                etat = lancer_regeneration(documents, d.get('language_prefs'), taille_page)
+    except (TimeoutError, OSError) as e:
+        return jsonify({"error": f"régénération non lancée : {e}"}), 503
+    if en_cours:
+        return jsonify({"error": "une régénération est déjà en cours", "id": en_cours}), 409
+    return jsonify(etat), 202
+
+
+@app.route('/regeneration/<job_id>', methods=['GET'])
+def regeneration_etat(job_id):
+    """Suivi : statut, employeurs traités, documents générés, débit, échecs."""
+    if not (verify_user_token(request) or _jeton_machine_ok(request)):
+        return jsonify({"error": "Non authentifié"}), 401
+    etat = etat_regeneration(job_id)
+    if etat is None:
+        return jsonify({"error": "job introuvable"}), 404
+    return jsonify(etat), 200
+
 # ============== ZIP ENDPOINT ==============
 @app.route('/debug-request', methods=['POST'])
 def debug_request():
@@ -2660,45 +4710,39 @@ def download_all_zip():
         if not documents: return jsonify({"error": "No documents selected"}), 400
         # Étape 2A : on mémorise l'employeur (sans bloquer la génération si ça échoue)
         save_employeur(form_data)
-        zip_buffer = io.BytesIO()
-        static_docs_added = set()
-        FILENAMES = {
-            'employer': 'Fiche_employeur.pdf', 'travailleur': 'Fiche_travailleur.pdf',
-            'independant': 'Fiche_independant.pdf', 'dispense': 'Dispense_precompte.pdf',
-            'procuration': 'Procuration_ONSS.pdf', 'mensura': 'Contrat_Mensura.pdf',
-        }
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for doc_type in documents:
+        def entrees():
+            # Documents calculés en parallèle (cf. generer_documents), écrits
+            # dans l'ordre demandé : chacun part dès qu'il est prêt et que ceux
+            # qui le précèdent sont partis.
+            static_docs_added = set()
+            for doc_type, pdf_bytes, erreur in generer_documents(documents, form_data, language_prefs):
                 try:
-                    pdf_bytes = generate_pdf_bytes(doc_type, form_data, language_prefs)
-                    if pdf_bytes:
-                        if doc_type == 'offre':
-                            lang = language_prefs.get('offre','fr').upper()
-                            filename = f"Offre_de_collaboration_{lang}.pdf"
-                        elif doc_type in ['accident','att_accident']:
-                            lang = language_prefs.get('accident','fr').upper()
-                            filename = f"Attestation_accident_travail_{lang}.pdf"
-                        elif doc_type in ['seppt','att_seppt']:
-                            lang = language_prefs.get('seppt','fr').upper()
-                            filename = f"Attestation_SEPPT_{lang}.pdf"
-                        else:
-                            filename = FILENAMES.get(doc_type, f"{doc_type}.pdf")
-                        zf.writestr(filename, pdf_bytes)
-                        print(f"[ZIP] Added: {filename}")
-                        bundle = get_bundle_for_document(doc_type)
-                        for static_key in bundle:
-                            if static_key not in static_docs_added:
-                                static_bytes, display_name = get_static_document_bytes(static_key)
-                                if static_bytes:
-                                    zf.writestr(display_name, static_bytes)
-                                    static_docs_added.add(static_key)
-                                    print(f"[ZIP] Added static: {display_name}")
+                    if erreur is not None:
+                        raise erreur
+                    if not pdf_bytes:
+                        continue
+                    filename = nom_document(doc_type, language_prefs)
                 except Exception as e:
                     print(f"Error processing {doc_type}: {str(e)}")
                     continue
-        zip_buffer.seek(0)
-        return send_file(zip_buffer, mimetype='application/zip', as_attachment=True,
-                        download_name=f'documents_persoproject_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip')
+                yield filename, pdf_bytes           # journal [ZIP] : cf. zip_en_flux
+                for static_key in get_bundle_for_document(doc_type):
+                    if static_key not in static_docs_added:
+                        entree = entree_zip_statique(static_key)
+                        if entree:
+                            yield entree['nom'], entree
+                            static_docs_added.add(static_key)
+            tailles = _ligne_tailles_pdf()
+            if tailles:
+                print(f"[ZIP] X-PDF-Taille : {tailles}")
+
+        nom = f'documents_persoproject_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
+        # En flux, les en-têtes partent avant que les entrées ne soient choisies :
+        # on annonce la politique ; le choix par entrée et les tailles avant/après
+        # optimisation (X-PDF-Taille) vont au journal [ZIP] (cf. zip_en_flux).
+        return Response(stream_with_context(zip_en_flux(entrees())), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={nom}',
+                                 'X-Zip-Compression': _politique_zip()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -2710,8 +4754,7 @@ def debug_offre_raw():
     """Retourne le template brut sans modification pour diagnostiquer les pages."""
     lang = request.args.get('lang', 'fr')
     tpl = TEMPLATES['offre_nl'] if lang == 'nl' else TEMPLATES['offre_fr']
-    rd = PdfReader(tpl)
-    nb = len(rd.pages)
+    nb = _gabarit(tpl)['nb_pages']
     # Retourne aussi le PDF brut
     return send_file(tpl, mimetype='application/pdf',
                     as_attachment=True,
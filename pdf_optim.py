@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+pdf_optim.py — Passe d'optimisation de taille des PDF générés (optionnelle).
+
+pypdf 3.17 (version épinglée) n'écrit ni flux d'objets ni xref compressée, et
+chaque calque apporte sa propre police Helvetica / ses ProcSets. Ce module
+réécrit un PDF déjà produit :
+- objets identiques fusionnés (polices, ProcSets, ressources clonées…), jusqu'à
+  point fixe : deux dictionnaires qui ne diffèrent que par des références vers
+  des doublons deviennent eux-mêmes des doublons ;
+- flux non compressés (calques pypdf) passés en FlateDecode quand ça gagne ;
+- objets hors flux rangés dans des flux d'objets (/ObjStm, PDF 1.5) et table
+  xref écrite comme flux compressé (/XRef).
+lineariser_pdf produit à la place un PDF linéarisé (« affichage web rapide »,
+ISO 32000-1 annexe F) : la 1re page et tout ce qu'elle utilise sont en tête de
+fichier, un visualiseur qui lit en flux l'affiche sans attendre la fin.
+Les octets des flux déjà compressés (contenu des templates, images, polices
+embarquées) sont recopiés tels quels : rendu identique, seule la structure change.
+"""
+import io
+import zlib
+
+from pypdf import PdfReader
+from pypdf.generic import (ArrayObject, DictionaryObject, IndirectObject, NameObject,
+                           NumberObject, StreamObject)
+
+OBJETS_PAR_FLUX = 100
+_JAMAIS_FUSIONNES = ('/Page', '/Pages', '/Catalog')
+
+
+class LinearisationIncoherente(ValueError):
+    """Le fichier linéarisé ne correspond pas aux décalages annoncés dans son
+    dictionnaire /Linearized : l'appelant sert une sortie non linéarisée."""
+
+
+def _type(obj):
+    if isinstance(obj, DictionaryObject):
+        return obj.get('/Type')
+    return None
+
+
+def _renumeroter(obj, table):
+    """Copie de `obj` dont les références pointent vers les nouveaux numéros."""
+    if isinstance(obj, IndirectObject):
+        return IndirectObject(table[obj.idnum], 0, None)
+    if isinstance(obj, StreamObject):
+        copie = StreamObject()
+        copie._data = obj._data
+        for k, v in obj.items():
+            if k != '/Length':
+                copie[NameObject(k)] = _renumeroter(v, table)
+        return copie
+    if isinstance(obj, DictionaryObject):
+        copie = DictionaryObject()
+        for k, v in obj.items():
+            copie[NameObject(k)] = _renumeroter(v, table)
+        return copie
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(_renumeroter(v, table) for v in obj)
+    return obj
+
+
+def _octets(obj):
+    buf = io.BytesIO()
+    obj.write_to_stream(buf, None)
+    return buf.getvalue()
+
+
+def _atteignables(rd):
+    """{idnum: objet} de tout ce qui est atteignable depuis le trailer."""
+    objets = {}
+    pile = [rd.trailer.raw_get(k) for k in ('/Root', '/Info') if k in rd.trailer]
+    while pile:
+        o = pile.pop()
+        if isinstance(o, IndirectObject):
+            if o.idnum in objets:
+                continue
+            objets[o.idnum] = r = o.get_object()
+            pile.append(r)
+        elif isinstance(o, DictionaryObject):
+            pile.extend(o.values())
+        elif isinstance(o, ArrayObject):
+            pile.extend(o)
+    return objets
+
+
+def _compresser_flux(objets):
+    """Flux sans filtre -> FlateDecode, si c'est plus court."""
+    for num, o in objets.items():
+        if isinstance(o, StreamObject) and '/Filter' not in o and len(o._data) > 64:
+            z = zlib.compress(o._data, 9)
+            if len(z) < len(o._data):
+                copie = StreamObject()
+                copie.update(o)
+                copie._data = z
+                copie[NameObject('/Filter')] = NameObject('/FlateDecode')
+                objets[num] = copie
+
+
+def _fusionner(objets):
+    """Renvoie {idnum: représentant} après fusion des objets identiques."""
+    rep = {n: n for n in objets}
+    while True:
+        vus, change = {}, False
+        for n in sorted(objets):
+            if rep[n] != n or _type(objets[n]) in _JAMAIS_FUSIONNES:
+                continue
+            cle = _octets(_renumeroter(objets[n], rep))
+            if cle in vus:
+                rep[n] = vus[cle]
+                change = True
+            else:
+                vus[cle] = n
+        if not change:
+            break
+        for n in rep:                    # aplatit les chaînes a -> b -> c
+            while rep[rep[n]] != rep[n]:
+                rep[n] = rep[rep[n]]
+    return rep
+
+
+def _preparer(octets):
+    """Lecture + flux compressés + fusion : (lecteur, objets, représentants)."""
+    rd = PdfReader(io.BytesIO(octets))
+    rd.pages                             # aplatit l'héritage (/Resources, /MediaBox…) sur les pages
+    objets = _atteignables(rd)
+    _compresser_flux(objets)
+    return rd, objets, _fusionner(objets)
+
+
+def optimiser_pdf(octets):
+    """PDF -> (PDF optimisé, {'avant', 'apres', 'objets_avant', 'objets_apres'}).
+    Renvoie l'original si la réécriture n'est pas plus petite."""
+    rd, objets, rep = _preparer(octets)
+    gardes = sorted(n for n in objets if rep[n] == n)
+    nouveau = {ancien: i + 1 for i, ancien in enumerate(gardes)}
+    table = {n: nouveau[rep[n]] for n in objets}
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+    xref = {}                            # numéro -> (type, champ 2, champ 3)
+    simples = []
+    for ancien in gardes:
+        num, o = nouveau[ancien], _renumeroter(objets[ancien], table)
+        if isinstance(o, StreamObject):  # un flux ne peut pas aller dans un ObjStm
+            xref[num] = (1, out.tell(), 0)
+            out.write(b'%d 0 obj\n' % num + _octets(o) + b'\nendobj\n')
+        else:
+            simples.append((num, _octets(o)))
+    suivant = len(gardes) + 1
+    for debut in range(0, len(simples), OBJETS_PAR_FLUX):
+        lot = simples[debut:debut + OBJETS_PAR_FLUX]
+        entete, corps = [], io.BytesIO()
+        for i, (num, data) in enumerate(lot):
+            entete.append(b'%d %d' % (num, corps.tell()))
+            corps.write(data + b'\n')
+            xref[num] = (2, suivant, i)
+        entete = b' '.join(entete) + b'\n'
+        flux = StreamObject()
+        flux._data = zlib.compress(entete + corps.getvalue(), 9)
+        flux[NameObject('/Type')] = NameObject('/ObjStm')
+        flux[NameObject('/N')] = NumberObject(len(lot))
+        flux[NameObject('/First')] = NumberObject(len(entete))
+        flux[NameObject('/Filter')] = NameObject('/FlateDecode')
+        xref[suivant] = (1, out.tell(), 0)
+        out.write(b'%d 0 obj\n' % suivant + _octets(flux) + b'\nendobj\n')
+        suivant += 1
+
+    num_xref = suivant
+    xref[num_xref] = (1, out.tell(), 0)
+    lignes = [b'\x00\x00\x00\x00\x00\xff\xff']          # objet 0 : libre
+    for n in range(1, num_xref + 1):
+        t, a, b = xref[n]
+        lignes.append(bytes([t]) + a.to_bytes(4, 'big') + b.to_bytes(2, 'big'))
+    flux = StreamObject()
+    flux._data = zlib.compress(b''.join(lignes), 9)
+    flux[NameObject('/Type')] = NameObject('/XRef')
+    flux[NameObject('/Size')] = NumberObject(num_xref + 1)
+    flux[NameObject('/W')] = ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)])
+    flux[NameObject('/Filter')] = NameObject('/FlateDecode')
+    for k in ('/Root', '/Info'):
+        if k in rd.trailer:
+            flux[NameObject(k)] = IndirectObject(table[rd.trailer.raw_get(k).idnum], 0, None)
+    if '/ID' in rd.trailer:
+        flux[NameObject('/ID')] = rd.trailer['/ID']
+    out.write(b'%d 0 obj\n' % num_xref + _octets(flux) + b'\nendobj\n')
+    out.write(b'startxref\n%d\n%%%%EOF\n' % xref[num_xref][1])
+
+    resultat = out.getvalue()
+    stats = {'avant': len(octets), 'apres': len(resultat),
+             'objets_avant': len(objets), 'objets_apres': len(gardes)}
+    if len(resultat) >= len(octets):
+        stats['apres'] = len(octets)
+        return octets, stats
+    return resultat, stats
+
+
+# ---------- Linéarisation (ISO 32000-1, annexe F) ----------
+# Ordre du fichier : en-tête, dictionnaire /Linearized, xref de la 1re page,
+# catalogue (partie 4), flux d'indices (partie 5), 1re page et tout ce qu'elle
+# utilise (partie 6), pages suivantes avec leurs objets propres (partie 7),
+# objets partagés (partie 8), le reste (arbre des pages, /Info… : partie 9),
+# xref principale. Numérotation : la section principale (parties 7 à 9) prend
+# 1..m dans l'ordre du fichier, la section 1re page m+1..n ; pdfium déduit les
+# numéros des objets de chaque page de cet ordre.
+# Pas de flux d'objets ici : chaque objet doit avoir son propre décalage.
+_CLES_DOCUMENT = ('/ViewerPreferences', '/PageMode', '/Threads', '/OpenAction', '/AcroForm')
+
+
+def _references(depart, objets, rep):
+    """Représentants atteints depuis `depart` sans passer par l'arbre des pages."""
+    vus, pile = set(), [depart]
+    while pile:
+        o = pile.pop()
+        if isinstance(o, IndirectObject):
+            n = rep[o.idnum]
+            if n not in vus and _type(objets[n]) not in ('/Page', '/Pages'):
+                vus.add(n)
+                pile.append(objets[n])
+        elif isinstance(o, DictionaryObject):
+            pile.extend(v for k, v in o.items() if k != '/Parent')
+        elif isinstance(o, ArrayObject):
+            pile.extend(o)
+    return vus
+
+
+def _bits(champs):
+    """[(valeur, nb_bits) | None] -> octets, bits de poids fort d'abord ;
+    None complète l'octet en cours (fin de chaque rubrique des tables)."""
+    out, acc, n = bytearray(), 0, 0
+    for c in list(champs) + [None]:
+        if c is None:
+            if n % 8:
+                acc <<= 8 - n % 8
+                n += 8 - n % 8
+            out += acc.to_bytes(n // 8, 'big')
+            acc = n = 0
+        else:
+            v, nb = c
+            acc = (acc << nb) | v
+            n += nb
+    return bytes(out)
+
+
+def _indices(longueurs_pages, nb_objets, premiere_page, partages, refs, long_partages,
+             premier_partage):
+    """Flux d'indices : table des pages (F.3/F.4) puis des objets partagés (F.5).
+    Renvoie (octets, décalage /S de la table des partagés).
+    Comme qpdf : contenu de page = page entière (décalage 0, longueur = page)."""
+    min_obj, min_long = min(nb_objets), min(longueurs_pages)
+    nb_dobj = (max(nb_objets) - min_obj).bit_length()
+    nb_dlong = (max(longueurs_pages) - min_long).bit_length()
+    nb_nref = max(len(r) for r in refs).bit_length()
+    nb_id = partages.bit_length()
+    pages = _bits(
+        [(min_obj, 32), (premiere_page, 32), (nb_dobj, 16), (min_long, 32), (nb_dlong, 16),
+         (0, 32), (0, 16), (min_long, 32), (nb_dlong, 16), (nb_nref, 16), (nb_id, 16),
+         (0, 16), (1, 16), None]
+        + [(k - min_obj, nb_dobj) for k in nb_objets] + [None]
+        + [(lg - min_long, nb_dlong) for lg in longueurs_pages] + [None]
+        + [(len(r), nb_nref) for r in refs] + [None]
+        + [(i, nb_id) for r in refs for i in r] + [None]
+        + [(lg - min_long, nb_dlong) for lg in longueurs_pages])
+    min_g = min(long_partages)
+    nb_dg = (max(long_partages) - min_g).bit_length()
+    premier_num, premier_dec, nb_premiere = premier_partage
+    partagee = _bits(
+        [(premier_num, 32), (premier_dec, 32), (nb_premiere, 32), (partages, 32),
+         (0, 16), (min_g, 32), (nb_dg, 16), None]
+        + [(lg - min_g, nb_dg) for lg in long_partages] + [None]
+        + [(0, 1) for _ in long_partages])
+    return pages + partagee, len(pages)
+
+
+def lineariser_pdf(octets):
+    """PDF -> (PDF linéarisé, {'avant', 'apres', 'premiere_page'}) ; premiere_page =
+    octets à lire avant de pouvoir afficher la page 1 (/E)."""
+    rd, objets, rep = _preparer(octets)
+    racine = rd.trailer.raw_get('/Root').idnum
+    pages = [rep[pg.indirect_reference.idnum] for pg in rd.pages]
+    par_page = [_references(objets[p], objets, rep) | {p} for p in pages]
+
+    partie6 = [pages[0]] + sorted(par_page[0] - {pages[0]})
+    places = set(partie6)
+    lecteurs = {}                        # objet -> pages (> 0) qui l'utilisent
+    for i in range(1, len(pages)):
+        for n in par_page[i] - places:
+            lecteurs.setdefault(n, []).append(i)
+    partie7 = [[pages[i]] + sorted(n for n, l in lecteurs.items() if l == [i] and n != pages[i])
+               for i in range(1, len(pages))]
+    partie8 = sorted(n for n, l in lecteurs.items() if len(l) > 1)
+    places.update(lecteurs)
+    partie4 = [racine] + sorted(set().union(*(
+        _references(objets[racine].raw_get(k), objets, rep)
+        for k in _CLES_DOCUMENT if k in objets[racine])) - places)
+    places.update(partie4)
+    partie9 = sorted(n for n in objets if rep[n] == n and n not in places)
+
+    principale = [n for page in partie7 for n in page] + partie8 + partie9
+    m = len(principale)
+    num_lin, num_indices = m + 1, m + 2 + len(partie4)
+    nouveau = {ancien: i + 1 for i, ancien in enumerate(principale)}
+    nouveau.update({ancien: m + 2 + i for i, ancien in enumerate(partie4)})
+    nouveau.update({ancien: num_indices + 1 + i for i, ancien in enumerate(partie6)})
+    n_total = num_indices + len(partie6)
+    table = {n: nouveau[rep[n]] for n in objets}
+    corps = {ancien: b'%d 0 obj\n' % nouveau[ancien]
+             + _octets(_renumeroter(objets[ancien], table)) + b'\nendobj\n'
+             for ancien in nouveau}
+
+    version = octets[:8] if octets[:5] == b'%PDF-' else b'%PDF-1.4'
+    entete = version + b'\n%\xe2\xe3\xcf\xd3\n'
+
+    def dict_lin(L, H0, HL, E, T):
+        return (b'%d 0 obj\n<< /Linearized 1 /L %010d /H [ %010d %010d ] /O %d /E %010d '
+                b'/N %d /T %010d >>\nendobj\n' % (num_lin, L, H0, HL, nouveau[pages[0]], E,
+                                                  len(pages), T))
+    suite = b''
+    if '/Info' in rd.trailer:
+        suite += b' /Info %d 0 R' % table[rd.trailer.raw_get('/Info').idnum]
+    if '/ID' in rd.trailer:
+        suite += b' /ID ' + _octets(rd.trailer['/ID'])
+
+    def xref_premiere(decalages, prev):
+        return (b'xref\n%d %d\n' % (num_lin, n_total - m)
+                + b''.join(b'%010d 00000 n\r\n' % decalages[k] for k in range(num_lin, n_total + 1))
+                + b'trailer\n<< /Size %d /Root %d 0 R%s /Prev %010d >>\nstartxref\n0\n%%%%EOF\n'
+                % (n_total + 1, nouveau[racine], suite, prev))
+    debut_p4 = len(entete) + len(dict_lin(0, 0, 0, 0, 0)) + len(xref_premiere({k: 0 for k in range(
+        num_lin, n_total + 1)}, 0))
+    debut_indices = debut_p4 + sum(len(corps[n]) for n in partie4)
+
+    # décalages « sans le flux d'indices » : c'est ce qu'attendent les tables
+    dec, pos = {}, debut_indices
+    for n in partie6 + principale:
+        dec[n] = pos
+        pos += len(corps[n])
+    longueurs = [sum(len(corps[n]) for n in partie6)] + [
+        sum(len(corps[n]) for n in page) for page in partie7]
+    nb_objets = [len(partie6)] + [len(page) for page in partie7]
+    id_partage = {n: i for i, n in enumerate(partie6 + partie8)}
+    refs = [[]] + [sorted(id_partage[n] for n in par_page[i] if n in id_partage)
+                   for i in range(1, len(pages))]
+    premier_partage = ((nouveau[partie8[0]], dec[partie8[0]]) if partie8 else (0, 0)) \
+        + (len(partie6),)
+    donnees, s_partages = _indices(longueurs, nb_objets, dec[pages[0]], len(id_partage), refs,
+                                   [len(corps[n]) for n in partie6 + partie8], premier_partage)
+    flux = StreamObject()
+    flux._data = donnees
+    flux[NameObject('/S')] = NumberObject(s_partages)
+    bloc_indices = b'%d 0 obj\n' % num_indices + _octets(flux) + b'\nendobj\n'
+
+    decalages, pos = {}, debut_p4
+    for n in partie4:
+        decalages[nouveau[n]] = pos
+        pos += len(corps[n])
+    decalages[num_indices] = pos
+    for n in partie6 + principale:
+        decalages[nouveau[n]] = dec[n] + len(bloc_indices)
+    fin_premiere = decalages[nouveau[partie6[-1]]] + len(corps[partie6[-1]])
+    pos_xref = pos + len(bloc_indices) + sum(len(corps[n]) for n in partie6 + principale)
+    xref_principale = (b'xref\n0 %d\n' % (m + 1) + b'0000000000 65535 f\r\n'
+                       + b''.join(b'%010d 00000 n\r\n' % decalages[k] for k in range(1, m + 1))
+                       + b'trailer\n<< /Size %d >>\nstartxref\n%d\n%%%%EOF\n'
+                       % (m + 1, len(entete) + len(dict_lin(0, 0, 0, 0, 0))))
+    # /T : blanc qui PRÉCÈDE la 1re entrée de la xref principale (annexe F.3.3)
+    blanc_avant_xref = pos_xref + len(b'xref\n0 %d\n' % (m + 1)) - 1
+    total = pos_xref + len(xref_principale)
+    decalages[num_lin] = len(entete)
+
+    out = io.BytesIO()
+    out.write(entete)
+    out.write(dict_lin(total, decalages[num_indices], len(bloc_indices), fin_premiere,
+                       blanc_avant_xref))
+    out.write(xref_premiere(decalages, pos_xref))
+    for n in partie4:
+        out.write(corps[n])
+    out.write(bloc_indices)
+    for n in partie6 + principale:
+        out.write(corps[n])
+    out.write(xref_principale)
+    resultat = out.getvalue()
+    if len(resultat) != total:
+        raise LinearisationIncoherente(f"{len(resultat)} octets écrits, /L annonce {total}")
+    return resultat, {'avant': len(octets), 'apres': total, 'premiere_page': fin_premiere}
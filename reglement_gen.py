@@ -291,11 +291,27 @@ def _valeurs_officielles(payload, identity, lang, cps):
     return out
 
 
-def _valeurs_institutions(payload, identity, repertoire, lang='FR'):
+def index_institutions(repertoire):
+    """Index du répertoire des institutions, à construire UNE fois par répertoire
+    (l'app le garde en cache avec lui) : par type, et par (type, nom normalisé).
+    Nom normalisé = minuscules sans espaces de bord, comme la recherche par nom."""
+    par_type, par_nom = {}, {}
+    for i in (repertoire or []):
+        typ = i.get('type') or ''
+        cn = (i.get('nom') or '').lower().strip()
+        par_type.setdefault(typ, []).append((cn, i))
+        par_nom.setdefault((typ, cn), i)     # 1re occurrence, comme le parcours linéaire
+    return {'liste': list(repertoire or []), 'par_type': par_type, 'par_nom': par_nom}
+
+
+def _valeurs_institutions(payload, identity, repertoire, lang='FR', index=None):
     """Remplit les jetons d'adresses d'institutions depuis le répertoire.
-    Assurance/caisse/SEPPT : par nom ; bureaux de contrôle : par province du client."""
+    Assurance/caisse/SEPPT : par nom ; bureaux de contrôle : par province du client.
+    `index` : index_institutions(repertoire) déjà construit (sinon construit ici)."""
     out = {}
-    if not repertoire:
+    if index is None:
+        index = index_institutions(repertoire)
+    if not index['liste']:
         return out
     idd = identity or {}
     _, _, cp_cli, _ = _decoupe_adresse(idd)
@@ -315,33 +331,35 @@ def _valeurs_institutions(payload, identity, repertoire, lang='FR'):
         if toks.get('loc'):
             out[toks['loc']] = inst.get('localite') or ''
 
+    def du_type(typ):
+        return [i for _cn, i in index['par_type'].get(typ, ())]
+
     def trouve_par_nom(typ, nom):
         nom = (nom or '').lower().strip()
-        cands = [i for i in repertoire if (i.get('type') or '') == typ]
+        cands = index['par_type'].get(typ, ())
         if nom:
             # 1) correspondance EXACTE prioritaire (évite qu'un nom court comme « AG »
             #    matche par erreur « AGACHE » via sous-chaîne)
-            for i in cands:
-                if (i.get('nom') or '').lower().strip() == nom:
-                    return i
+            exact = index['par_nom'].get((typ, nom))
+            if exact:
+                return exact
             # 2) repli : sous-chaîne dans un sens ou l'autre
-            for i in cands:
-                cn = (i.get('nom') or '').lower().strip()
+            for cn, i in cands:
                 if cn and (cn in nom or nom in cn):
                     return i
-        return cands[0] if len(cands) == 1 else None
+        return cands[0][1] if len(cands) == 1 else None
 
     for typ, champ in (('assurance', 'assurance_loi'), ('caisse', 'caisse_vacances'), ('seppt', 'seppt')):
         inst = trouve_par_nom(typ, payload.get(champ))
         if inst:
             pose(inst, typ)
     # fonds : s'il n'y en a qu'un, ou celui de la province
-    fonds = [i for i in repertoire if (i.get('type') or '') == 'fonds']
+    fonds = du_type('fonds')
     if len(fonds) == 1:
         pose(fonds[0], 'fonds')
     # bureaux de contrôle : par province du client (ou l'unique)
     for typ in ('controle_lois', 'controle_bienetre'):
-        cands = [i for i in repertoire if (i.get('type') or '') == typ]
+        cands = du_type(typ)
         pick = next((i for i in cands if (i.get('province') or '') == prov and prov), None) \
             or (cands[0] if len(cands) == 1 else None)
         if pick:
@@ -364,7 +382,7 @@ def _decoupe_adresse(idd):
     return rue, nomaison, cp, loc
 
 
-def _valeurs(payload, identity, repertoire=None):
+def _valeurs(payload, identity, repertoire=None, index=None):
     """Correspondance jeton -> valeur. Ce qu'on n'a pas -> BLANK (à compléter)."""
     idd = identity or {}
     lang = 'NL' if str(payload.get('reglement_langue') or 'FR').upper() == 'NL' else 'FR'
@@ -452,7 +470,7 @@ def _valeurs(payload, identity, repertoire=None):
     #    sans adresse donnait un hybride : le nom saisi + l'adresse officielle d'un AUTRE
     #    organisme, ce qui est pire que l'un ou l'autre dans un document légal.
     v.update({k: (val or BLANK) for k, val in
-              _valeurs_institutions(payload, identity, repertoire, lang).items()})
+              _valeurs_institutions(payload, identity, repertoire, lang, index).items()})
     # 4) enfin les institutions du DOSSIER PRISMA du client (lues par le robot PC 06,
     #    colonne employeurs.institutions) : c'est la vérité du dossier encodé — elle
     #    l'emporte sur le référentiel général ET sur la saisie du formulaire.
@@ -667,6 +685,12 @@ def _cp_lookup(cp_repertoire):
     return out
 
 
+def index_cp(cp_repertoire):
+    """Index des CP (cf. _cp_lookup), à construire une fois et à repasser à
+    build_reglement / generer_doc_horaires (paramètre cp_index)."""
+    return _cp_lookup(cp_repertoire)
+
+
 def _cp_info(lut, cp):
     """Retrouve {'hebdo','denom'} d'une CP dans le lookup (tolère « 112 »/« 112.00 »/« 11200 »)."""
     if not lut:
@@ -1058,18 +1082,20 @@ def _ajouter_apres_label(doc, ancre, valeur):
 
 
 def build_reglement(payload, identity=None, template_bytes=None, model_bytes=None,
-                    repertoire=None, cp_repertoire=None):
+                    repertoire=None, cp_repertoire=None, inst_index=None, cp_index=None):
     """Remplit le modèle officiel et renvoie les bytes du .docx.
     template_bytes : le modèle FR/NL (jetons {{...}}) depuis Supabase Storage.
     model_bytes    : (optionnel) horaire sectoriel à ajouter en fin de document.
     repertoire     : liste d'institutions (adresses) pour remplir Art. 2 & 66.
     cp_repertoire  : liste des commissions paritaires (n° + dénomination + temps plein)
                      pour compléter la dénomination de la CP en Article 2.
+    inst_index / cp_index : index_institutions(repertoire) / index_cp(cp_repertoire)
+                     déjà construits (répertoires en cache) — sinon construits ici.
     """
     if not template_bytes:
         raise ValueError("Modèle de règlement introuvable (pas encore hébergé).")
     lang = 'NL' if str(payload.get('reglement_langue') or 'FR').upper() == 'NL' else 'FR'
-    lut = _cp_lookup(cp_repertoire)
+    lut = cp_index if cp_index is not None else _cp_lookup(cp_repertoire)
     doc = Document(io.BytesIO(template_bytes))
     if lang == 'NL':
         _harmoniser_mise_en_page_nl(doc)
@@ -1132,7 +1158,7 @@ def build_reglement(payload, identity=None, template_bytes=None, model_bytes=Non
         cp_emp = _cp_norm(cp_e_in) or BLANK
         den_ouv = _den_simple(cp_o_in, payload.get('cp_ouvrier_denomination'))
         den_emp = _den_simple(cp_e_in, payload.get('cp_employe_denomination'))
-    valeurs = _valeurs(payload, identity, repertoire)
+    valeurs = _valeurs(payload, identity, repertoire, inst_index)
     # Assurance-loi inconnue : on GARDE le bloc (point 3) avec les champs vides —
     # c'est ce que fait le règlement de RÉFÉRENCE (dossier AUTO VIRAGE, 27/07/2026).
     # (Ancienne tentative de SUPPRESSION du bloc annulée : elle laissait une ligne
@@ -1233,7 +1259,7 @@ def _enlever_surlignage_rempli(doc):
             rpr.remove(hl)
 
 
-def _regimes_du_payload(payload, cp_repertoire=None):
+def _regimes_du_payload(payload, cp_repertoire=None, lut=None):
     """Normalise les régimes de travail à générer. Chaque régime = une CP avec SON
     temps plein et SES propres heures d'ouverture -> une section d'horaires dédiée.
 
@@ -1241,8 +1267,10 @@ def _regimes_du_payload(payload, cp_repertoire=None):
       libellé manquants sont complétés depuis le répertoire des CP (sinon 38h/sem).
     - Sinon rétro-compat : ouvriers (CP principale + ouverture globale) et,
       si une 2e CP/temps plein employés existe, une section employés (même ouverture).
+    `lut` : index des CP déjà construit (sinon construit depuis cp_repertoire).
     """
-    lut = _cp_lookup(cp_repertoire)
+    if lut is None:
+        lut = _cp_lookup(cp_repertoire)
 
     def _mxj(v):
         return (_min(f"{v}:00") if str(v or '').isdigit() else 480) or 480
@@ -1340,13 +1368,13 @@ def _ajouter_avertissement_ouverture(doc, it, cible, max_total, langue, titre):
     rp = p.add_run(msg); rp.font.size = Pt(11); rp.font.color.rgb = AMBRE
 
 
-def generer_doc_horaires(payload, identity=None, cp_repertoire=None):
+def generer_doc_horaires(payload, identity=None, cp_repertoire=None, cp_index=None):
     """Document Word SÉPARÉ contenant tous les horaires-types (5j + 6j, toutes les
     combinaisons de jours de repos, tous les débuts par 30 min), UNE SECTION PAR
     RÉGIME (chaque CP avec son temps plein et sa propre ouverture).
     Renvoie les bytes, ou None si aucun horaire."""
     lang = 'NL' if str(payload.get('reglement_langue') or 'FR').upper() == 'NL' else 'FR'
-    items = _regimes_du_payload(payload, cp_repertoire)
+    items = _regimes_du_payload(payload, cp_repertoire, cp_index)
     if not items:
         return None
 
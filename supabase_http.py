@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+supabase_http.py — Client HTTP partagé pour tous les appels Supabase (REST + Auth).
+
+Avant, chaque appel passait par requests.get/post/... au niveau module : nouvelle
+connexion TCP + poignée de main TLS à CHAQUE requête du portail ou du veilleur.
+Ici une requests.Session par processus (gunicorn forke ses workers, le pool de
+génération en démarre d'autres) garde les connexions ouvertes (keep-alive) :
+- pool de connexions dimensionné (SUPABASE_POOL, défaut 10 — un worker à threads
+  peut avoir plusieurs appels en vol) ;
+- délais homogènes : connexion SUPABASE_TIMEOUT_CONNEXION (défaut 5 s) + lecture
+  (le timeout passé par l'appelant, sinon 10 s) ;
+- nouvel essai automatique, avec petit recul, sur les méthodes idempotentes
+  (GET, HEAD, PUT, DELETE, OPTIONS) en cas d'erreur de connexion ou de 502/503/504.
+  POST et PATCH ne sont rejoués que si la connexion a échoué AVANT l'envoi
+  (rien n'a atteint Supabase, aucun risque de doublon).
+Les fonctions get/post/patch/delete ont la signature de requests.* : remplacement
+direct aux points d'appel, et monkeypatch tout aussi direct dans les tests.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LECTURE_DEFAUT = 10
+_METHODES_IDEMPOTENTES = frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'})
+
+_SESSION = None
+_SESSION_PID = None
+_VERROU = threading.Lock()
+
+
+def _entier_env(nom, defaut, minimum=1):
+    try:
+        return max(int(os.environ.get(nom, defaut)), minimum)
+    except ValueError:
+        return defaut
+
+
+def _delai_connexion():
+    try:
+        return max(float(os.environ.get('SUPABASE_TIMEOUT_CONNEXION', 5)), 0.1)
+    except ValueError:
+        return 5.0
+
+
+def _politique_essais():
+    return Retry(
+        total=_entier_env('SUPABASE_ESSAIS', 2, minimum=0),
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=_METHODES_IDEMPOTENTES,
+        raise_on_status=False,      # après le dernier essai, l'appelant voit la réponse 5xx
+        respect_retry_after_header=True,
+    )
+
+
+def _nouvelle_session():
+    taille = _entier_env('SUPABASE_POOL', 10)
+    adaptateur = HTTPAdapter(pool_connections=4, pool_maxsize=taille,
+                             max_retries=_politique_essais())
+    s = requests.Session()
+    s.mount('https://', adaptateur)
+    s.mount('http://', adaptateur)
+    return s
+
+
+def session():
+    """Session du processus courant, créée au premier appel. Après un fork (worker
+    gunicorn, processus du pool) on repart d'une session neuve : les sockets du
+    parent ne doivent pas être partagées entre processus."""
+    global _SESSION, _SESSION_PID
+    pid = os.getpid()
+    if _SESSION is not None and _SESSION_PID == pid:
+        return _SESSION
+    with _VERROU:
+        if _SESSION is None or _SESSION_PID != pid:
+            _SESSION, _SESSION_PID = _nouvelle_session(), pid
+        return _SESSION
+
+
+def fermer():
+    """Ferme la session (connexions rendues) ; la suivante sera recréée à la demande."""
+    global _SESSION, _SESSION_PID
+    with _VERROU:
+        if _SESSION is not None and _SESSION_PID == os.getpid():
+            _SESSION.close()
+        _SESSION, _SESSION_PID = None, None
+
+
+def _timeout(timeout):
+    """(connexion, lecture) : la connexion a toujours le même délai ; un timeout
+    numérique de l'appelant ne règle que la lecture."""
+    if isinstance(timeout, tuple):
+        return timeout
+    return (_delai_connexion(), timeout or LECTURE_DEFAUT)
+
+
+def request(methode, url, timeout=None, **kw):
+    return session().request(methode, url, timeout=_timeout(timeout), **kw)
+
+
+def get(url, **kw):
+    return request('GET', url, **kw)
+
+
+def post(url, **kw):
+    return request('POST', url, **kw)
+
+
+def patch(url, **kw):
+    return request('PATCH', url, **kw)
+
+
+def delete(url, **kw):
+    return request('DELETE', url, **kw)
+
+
+def stats():
+    """État du pool pour /debug-config (pas d'appel réseau)."""
+    s = _SESSION if _SESSION_PID == os.getpid() else None
+    adaptateur = s.get_adapter('https://') if s is not None else None
+    return {
+        'session': s is not None,
+        'pool_maxsize': getattr(adaptateur, '_pool_maxsize', _entier_env('SUPABASE_POOL', 10)),
+        'hotes': len(adaptateur.poolmanager.pools) if adaptateur is not None else 0,
+        'timeout_connexion': _delai_connexion(),
+        'essais': _entier_env('SUPABASE_ESSAIS', 2, minimum=0),
+    }
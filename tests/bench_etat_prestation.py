@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""MESURE MANUELLE (non collectée par pytest — lancer : python3 tests/bench_etat_prestation.py)
+
+Passage à l'échelle du parser d'états Prisma sur des états synthétiques :
+1. l'automate seul (_scanner_etat) sur 1 000 à 40 000 travailleurs — le temps par
+   travailleur doit rester à peu près constant (croissance linéaire) ;
+2. la chaîne complète (extraction pypdf page par page + automate) sur un PDF
+   généré, pour situer la part du parser face à l'extraction de texte.
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('PERSOPROJECT_SANS_BUNDLE', '1')
+import app  # noqa: E402
+
+ENTETE = ["0012/002586        ETAT DE PRESTATIONS", "CLIENT TEST SRL",
+          "No ONSS: 123-4567-89", "Période du 01/06/2026 jusqu'au 30/06/2026"]
+
+
+def lignes(n):
+    """État synthétique de n travailleurs, blocs de 9 lignes comme un état réel."""
+    out = list(ENTETE)
+    for k in range(1, n + 1):
+        out += [f"{10000 + k % 90000}DUPONT JEAN {k}",
+                f"No.rég.nat.: 85.01.{k % 28 + 1:02d} 123-{k % 100:02d}07,60",
+                f"Régime Mois {30 + k % 9}", "Entrée 01/02/2024",
+                "Code 0001  38,00  Code 0100  7,60", "Total heures 168,00",
+                "Observations", "", "----------------------------------------"]
+    return out
+
+
+def mesurer(fn, repetitions=3):
+    meilleur = None
+    for _ in range(repetitions):
+        t0 = time.perf_counter()
+        r = fn()
+        dt = time.perf_counter() - t0
+        meilleur = dt if meilleur is None else min(meilleur, dt)
+    return meilleur, r
+
+
+def main():
+    print("1) automate seul")
+    base = None
+    for n in (1_000, 5_000, 10_000, 20_000, 40_000):
+        ls = lignes(n)
+        dt, r = mesurer(lambda: app._scanner_etat(iter(ls)))
+        assert len(r['travailleurs']) == n
+        par = dt / n * 1e6
+        base = base or par
+        print(f"   {n:>6} travailleurs  {dt * 1000:8.1f} ms  {par:6.2f} µs/travailleur "
+              f"(x{par / base:.2f})")
+
+    print("2) chaîne complète (PDF -> pypdf -> automate)")
+    from pypdf import PdfReader
+    from reportlab.pdfgen import canvas
+    n, par_page = 5_000, 9
+    ls = lignes(n)
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf)
+    for debut in range(0, len(ls), par_page * 9):
+        for j, t in enumerate(ls[debut:debut + par_page * 9]):
+            c.drawString(40, 810 - 9 * j, t)
+        c.showPage()
+    c.save()
+    pdf = buf.getvalue()
+    dt, r = mesurer(lambda: app.parse_etat_prestation(PdfReader(io.BytesIO(pdf))), 1)
+    assert len(r['travailleurs']) == n
+    print(f"   {n} travailleurs, {len(PdfReader(io.BytesIO(pdf)).pages)} pages : "
+          f"{dt:.2f} s ({dt / n * 1e6:.0f} µs/travailleur, extraction comprise)")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,16 @@ Ce qu'on verrouille ici :
 - AUCUN accès sans le bon jeton -> 401 (et un jeton vide ne passe jamais) ;
 - avec le bon jeton, /a-traiter renvoie la liste, /maj patche par id,
   /recuperer-orphelines repasse 'processing' -> 'pending' ;
-- une colonne optionnelle absente (manquants/institutions) -> on retente sans
-  elle au lieu d'échouer.
+- colonnes optionnelles (manquants/institutions…) : le schéma est sondé une
+  fois (select=<cols>&limit=0, mis en cache) et une colonne absente n'est pas
+  envoyée ; une erreur « colonne inconnue » (code 42703 / PGRST204, et elle
+  seule) fait resonder puis renvoyer une fois sans la colonne ; une sonde
+  refusée pour une autre raison (401, 429…) ne retire rien et n'est pas gardée.
 
-Supabase est simulé (monkeypatch de requests.*) : on teste NOTRE logique d'auth
+Supabase est simulé (monkeypatch de supabase_http.*) : on teste NOTRE logique d'auth
 et de relais, pas PostgREST.
 """
+import json
 import os
 import sys
 
@@ -28,17 +32,24 @@ class FauxSupabase:
     def __init__(self):
         self.appels = []
         self.patch_status = [200]   # statuts successifs renvoyés par patch()
+        self.absentes = set()       # colonnes « pas encore créées » (sonde du schéma)
+        self.erreur = {'code': '42703', 'message': 'column employeurs.manquants does not exist'}
 
     def _rep(self, corps, status=200):
+        erreur = self.erreur
+
         class R:
             status_code = status
-            text = '' if status < 300 else 'column "manquants" does not exist'
+            text = '' if status < 300 else json.dumps(erreur)
             def json(self):
                 return corps
         return R()
 
     def get(self, url, **kw):
         self.appels.append(('GET', url, kw))
+        if 'limit=0' in url:        # sonde : select=<cols>&limit=0
+            cols = url.split('select=')[1].split('&')[0].split(',')
+            return self._rep([], 400 if self.absentes & set(cols) else 200)
         return self._rep([{'id': 1, 'nom_societe': 'ACME', 'statut': 'pending'}])
 
     def patch(self, url, **kw):
@@ -57,9 +68,10 @@ def client(monkeypatch):
     monkeypatch.setattr(app, 'SUPABASE_URL', 'https://fake.supabase.co')
     monkeypatch.setattr(app, 'SUPABASE_KEY', 'sk-fake')
     faux = FauxSupabase()
-    monkeypatch.setattr(app.requests, 'get', faux.get)
-    monkeypatch.setattr(app.requests, 'patch', faux.patch)
-    monkeypatch.setattr(app.requests, 'post', faux.post)
+    app.vider_cache_schema()
+    monkeypatch.setattr(app.supabase_http, 'get', faux.get)
+    monkeypatch.setattr(app.supabase_http, 'patch', faux.patch)
+    monkeypatch.setattr(app.supabase_http, 'post', faux.post)
     c = app.app.test_client()
     c.faux = faux
     return c
@@ -111,14 +123,65 @@ def test_maj_patche_par_id(client):
 def test_maj_sans_id_400(client):
     assert client.post('/affiliations/maj', headers=H, json={'statut': 'done'}).status_code == 400
 
-def test_maj_colonne_optionnelle_absente_retente_sans(client):
-    # 1er PATCH -> 400 (colonne 'manquants' absente), 2e PATCH -> 200 sans elle.
+def _patchs(faux):
+    return [a for a in faux.appels if a[0] == 'PATCH']
+
+def test_maj_colonne_optionnelle_absente_non_envoyee(client):
+    # La sonde voit 'manquants' absente -> UN seul PATCH, déjà sans elle.
+    client.faux.absentes = {'manquants'}
+    r = client.post('/affiliations/maj', headers=H,
+                    json={'id': 1, 'statut': 'done', 'manquants': ['x'], 'institutions': ['y']})
+    assert r.status_code == 200
+    (patch,) = _patchs(client.faux)
+    assert 'manquants' not in patch[2]['json'] and patch[2]['json']['institutions'] == ['y']
+
+def test_schema_sonde_une_seule_fois(client):
+    for _ in range(3):
+        client.post('/affiliations/maj', headers=H, json={'id': 1, 'manquants': ['x']})
+    sondes = [a for a in client.faux.appels if a[0] == 'GET' and 'limit=0' in a[1]]
+    assert len(sondes) == 1 and len(_patchs(client.faux)) == 3
+
+def test_schema_perime_resonde_et_renvoie(client):
+    # Sonde en cache « présente », colonne supprimée depuis : erreur de colonne ->
+    # schéma oublié, resondé, PATCH renvoyé une fois sans elle.
+    client.post('/affiliations/maj', headers=H, json={'id': 1, 'manquants': ['x']})
+    client.faux.absentes = {'manquants'}
     client.faux.patch_status = [400, 200]
     r = client.post('/affiliations/maj', headers=H,
                     json={'id': 1, 'statut': 'done', 'manquants': ['x']})
     assert r.status_code == 200
-    dernier = client.faux.appels[-1][2]['json']
-    assert 'manquants' not in dernier   # retenté sans la colonne absente
+    dernier = _patchs(client.faux)[-1][2]['json']
+    assert 'manquants' not in dernier and dernier['statut'] == 'done'
+
+@pytest.mark.parametrize('statut', [401, 429])
+def test_sonde_en_echec_ne_retire_rien(client, statut, monkeypatch):
+    # Quota ou auth en défaut pendant la sonde : on ne sait pas -> colonne
+    # envoyée, rien en cache, resondée à la requête suivante.
+    vrai = client.faux.get
+
+    def get(url, **kw):
+        if 'limit=0' in url:
+            client.faux.appels.append(('GET', url, kw))
+            client.faux.erreur = {'code': 'PGRST301', 'message': 'JWT expired'}
+            return client.faux._rep([], statut)
+        return vrai(url, **kw)
+    monkeypatch.setattr(app.supabase_http, 'get', get)
+    for _ in range(2):
+        client.post('/affiliations/maj', headers=H, json={'id': 1, 'manquants': ['x']})
+    assert all(p[2]['json']['manquants'] == ['x'] for p in _patchs(client.faux))
+    assert len([a for a in client.faux.appels if a[0] == 'GET' and 'limit=0' in a[1]]) == 2
+    assert app.schema_stats() == {}
+
+def test_autre_erreur_de_colonne_ne_resonde_pas(client):
+    # NOT NULL violé : le message parle de « column » mais le schéma est bon.
+    client.post('/affiliations/maj', headers=H, json={'id': 1, 'manquants': ['x']})
+    client.faux.erreur = {'code': '23502',
+                          'message': 'null value in column "statut" violates not-null constraint'}
+    client.faux.patch_status = [400]
+    r = client.post('/affiliations/maj', headers=H, json={'id': 1, 'manquants': ['x']})
+    assert r.status_code >= 400
+    sondes = [a for a in client.faux.appels if a[0] == 'GET' and 'limit=0' in a[1]]
+    assert len(sondes) == 1 and len(_patchs(client.faux)) == 2
 
 def test_orphelines_repasse_processing_en_pending(client):
     r = client.post('/affiliations/recuperer-orphelines', headers=H, json={})
@@ -147,3 +210,12 @@ def test_creer_upsert_sur_num_entreprise(client):
     _, url, kw = client.faux.appels[-1]
     assert 'on_conflict=num_entreprise' in url
     assert kw['json']['statut'] == 'pending' and kw['json']['numero_employeur'] is None
+
+def test_liste_employeurs_un_seul_select(client, monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'gest@test.be')
+    client.faux.absentes = {'manquants', 'message'}
+    assert client.get('/employeurs').status_code == 200
+    lectures = [a[2] for a in client.faux.appels if a[0] == 'GET' and 'limit=0' not in a[1]]
+    assert len(lectures) == 1
+    assert lectures[0]['params']['select'] == \
+        'num_entreprise,nom_societe,email,statut,numero_employeur,data,updated_at'
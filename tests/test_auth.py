@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""verify_user_token : vérification locale des JWT Supabase + cache TTL.
+
+Ce qu'on verrouille ici :
+- HS256 signé avec SUPABASE_JWT_SECRET : accepté SANS appel réseau ;
+- jeton expiré, audience autre que 'authenticated', jeton mal formé -> None ;
+- signature HS256 fausse (secret peut-être périmé) -> Supabase Auth, au plus
+  AUTH_REPLI_MINUTE fois par minute, puis refus local ;
+- ES256 via le JWKS du projet (clé relue quand un kid inconnu apparaît) ;
+- jeton non vérifiable localement -> Supabase Auth UNE fois, puis cache ;
+- le cache ne survit pas à l'expiration du jeton, et les refus n'y entrent pas.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+SECRET = 'secret-jwt-de-test-assez-long-pour-hs256'
+
+
+def _b64(b):
+    return base64.urlsafe_b64encode(b).rstrip(b'=').decode()
+
+
+def _jwt(charge=None, secret=SECRET, alg='HS256', signer=None, **entete):
+    charge = {'aud': 'authenticated', 'email': 'gest@test.be',
+              'exp': int(time.time()) + 3600, **(charge or {})}
+    tete = _b64(json.dumps({'alg': alg, 'typ': 'JWT', **entete}).encode())
+    corps = _b64(json.dumps(charge).encode())
+    signe = f"{tete}.{corps}".encode()
+    sig = signer(signe) if signer else hmac.new(secret.encode(), signe, hashlib.sha256).digest()
+    return f"{tete}.{corps}.{_b64(sig)}"
+
+
+class Req:
+    def __init__(self, token):
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+
+class FauxAuth:
+    """Supabase Auth simulé : compte les appels, /user renvoie un email."""
+    def __init__(self):
+        self.appels = []
+        self.jwks = {'keys': []}
+        self.statut_user = 200
+
+    def get(self, url, **kw):
+        self.appels.append(url)
+
+        class R:
+            status_code = 200 if url.endswith('/jwks.json') else self.statut_user
+            text = ''
+        r = R()
+        corps = self.jwks if url.endswith('/jwks.json') else {'email': 'distant@test.be'}
+        r.json = lambda: corps
+        return r
+
+
+@pytest.fixture
+def faux(monkeypatch):
+    monkeypatch.setattr(app, 'SUPABASE_URL', 'https://fake.supabase.co')
+    monkeypatch.setattr(app, 'SUPABASE_KEY', 'sk-fake')
+    monkeypatch.setenv('SUPABASE_JWT_SECRET', SECRET)
+    for nom in ('AUTH_CACHE', 'AUTH_CACHE_TTL', 'AUTH_CACHE_MAX', 'JWKS_TTL', 'AUTH_REPLI_MINUTE'):
+        monkeypatch.delenv(nom, raising=False)
+    f = FauxAuth()
+    monkeypatch.setattr(app.supabase_http, 'get', f.get)
+    app.vider_cache_auth()
+    yield f
+    app.vider_cache_auth()
+
+
+def test_hs256_local_sans_reseau(faux):
+    assert app.verify_user_token(Req(_jwt())) == 'gest@test.be'
+    assert faux.appels == []
+    assert app.verify_user_token(Req(_jwt())) == 'gest@test.be'
+    assert app.auth_cache_stats()['hit'] == 1
+
+
+@pytest.mark.parametrize('token', [
+    lambda: _jwt({'exp': int(time.time()) - 5}),
+    lambda: _jwt({'aud': 'anon'}),
+    lambda: _jwt({'nbf': int(time.time()) + 3600}),
+    lambda: 'pas.un.jwt',
+    lambda: 'deux.parties',
+])
+def test_refus_local(faux, token):
+    assert app.verify_user_token(Req(token())) is None
+    assert faux.appels == [] and app.auth_cache_stats()['entrees'] == 0
+
+
+def test_hs256_refuse_repli_distant_borne(faux, monkeypatch):
+    monkeypatch.setenv('AUTH_REPLI_MINUTE', '2')
+    faux.statut_user = 401                               # jeton forgé : Supabase refuse
+    for i in range(3):
+        assert app.verify_user_token(Req(_jwt({'sub': str(i)}, secret='mauvais'))) is None
+    assert len(faux.appels) == 2                         # 3e : refus local, quota atteint
+    assert app.auth_cache_stats()['repli_hs256'] == 2
+    # secret périmé (rotation) : Supabase reconnaît le jeton
+    app.vider_cache_auth()
+    faux.statut_user = 200
+    assert app.verify_user_token(Req(_jwt(secret='nouveau-secret'))) == 'distant@test.be'
+    assert app.auth_cache_stats()['distant'] == 1
+
+
+def test_non_verifiable_distant_puis_cache(faux, monkeypatch):
+    monkeypatch.delenv('SUPABASE_JWT_SECRET')
+    t = _jwt()
+    assert app.verify_user_token(Req(t)) == 'distant@test.be'
+    assert app.verify_user_token(Req(t)) == 'distant@test.be'
+    assert [u for u in faux.appels if u.endswith('/auth/v1/user')] == \
+        ['https://fake.supabase.co/auth/v1/user']
+    st = app.auth_cache_stats()
+    assert st['distant'] == 1 and st['hit'] == 1
+
+
+def test_cache_borne_par_exp(faux, monkeypatch):
+    monkeypatch.delenv('SUPABASE_JWT_SECRET')
+    t = _jwt({'exp': int(time.time()) + 1})
+    assert app.verify_user_token(Req(t)) == 'distant@test.be'
+    monkeypatch.setattr(app.time, 'time', lambda: 10 ** 10)
+    app.verify_user_token(Req(t))
+    assert len([u for u in faux.appels if u.endswith('/auth/v1/user')]) == 2
+
+
+def test_cache_desactivable(faux, monkeypatch):
+    monkeypatch.setenv('AUTH_CACHE', '0')
+    app.verify_user_token(Req(_jwt()))
+    assert app.auth_cache_stats()['entrees'] == 0
+
+
+def test_es256_via_jwks_et_rotation(faux, monkeypatch):
+    pytest.importorskip('cryptography')
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+
+    def cle(kid):
+        privee = ec.generate_private_key(ec.SECP256R1())
+        nb = privee.public_key().public_numbers()
+        publique = {'kty': 'EC', 'crv': 'P-256', 'kid': kid,
+                    'x': _b64(nb.x.to_bytes(32, 'big')), 'y': _b64(nb.y.to_bytes(32, 'big'))}
+
+        def signer(donnees):
+            r, s = decode_dss_signature(privee.sign(donnees, ec.ECDSA(hashes.SHA256())))
+            return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+        return publique, signer
+
+    monkeypatch.delenv('SUPABASE_JWT_SECRET')
+    pub1, signer1 = cle('k1')
+    faux.jwks = {'keys': [pub1]}
+    assert app.verify_user_token(Req(_jwt(alg='ES256', kid='k1', signer=signer1))) == 'gest@test.be'
+    assert app.auth_cache_stats()['local'] == 1
+    # signature d'une autre clé sous le même kid -> refus, pas de repli distant
+    _pub, intrus = cle('k1')
+    assert app.verify_user_token(Req(_jwt({'sub': 'x'}, alg='ES256', kid='k1', signer=intrus))) is None
+    # rotation : nouveau kid -> JWKS relu (délai mini de 30 s écoulé)
+    pub2, signer2 = cle('k2')
+    faux.jwks = {'keys': [pub1, pub2]}
+    app._JWKS['lu_a'] -= 60
+    assert app.verify_user_token(Req(_jwt(alg='ES256', kid='k2', signer=signer2))) == 'gest@test.be'
+    assert len([u for u in faux.appels if u.endswith('/jwks.json')]) == 2
+    assert not [u for u in faux.appels if u.endswith('/auth/v1/user')]
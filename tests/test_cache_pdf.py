@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Cache des PDF générés (clé = contenu).
+
+Ce qu'on verrouille ici :
+- un 2e téléchargement identique est servi par le cache, octet pour octet ;
+- un champ que le document n'imprime pas ne change pas la clé, un champ imprimé oui ;
+- l'empreinte du template fait partie de la clé (nouveau template = nouveau PDF) ;
+- LRU mémoire bornée en octets, niveau disque optionnel borné en taille ;
+- /fill-* et /download-all-zip passent par le même cache.
+"""
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+PROCURATION = {'num_entreprise': 'BE 0555.123.456', 'denomination': 'TEST SRL',
+               'date_signature': '17/07/2026', 'nom_mandant': 'Jean Dupont'}
+
+
+@pytest.fixture(autouse=True)
+def cache_vide(monkeypatch):
+    monkeypatch.delenv('CACHE_PDF', raising=False)
+    monkeypatch.delenv('CACHE_PDF_DOSSIER', raising=False)
+    app.vider_cache_pdf()
+    yield
+    app.vider_cache_pdf()
+
+
+def _stats():
+    s = app.cache_pdf_stats()
+    return s['memoire'], s['disque'], s['absent']
+
+
+def test_deuxieme_generation_servie_par_le_cache():
+    a = app.fill_procuration_pdf(PROCURATION)
+    b = app.fill_procuration_pdf(dict(PROCURATION))
+    assert a == b
+    assert _stats() == (1, 0, 1)
+
+
+def test_champ_non_imprime_ne_change_pas_la_cle():
+    app.fill_procuration_pdf(PROCURATION)
+    app.fill_procuration_pdf(dict(PROCURATION, gsm='+32 470 00 00 00'))   # absent du document
+    assert _stats() == (1, 0, 1)
+    app.fill_procuration_pdf(dict(PROCURATION, denomination='AUTRE SRL'))
+    assert _stats() == (1, 0, 2)
+
+
+def test_date_normalisee_meme_cle():
+    app.fill_procuration_pdf(PROCURATION)
+    app.fill_procuration_pdf(dict(PROCURATION, date_signature='2026-07-17'))
+    assert _stats() == (1, 0, 1)
+
+
+def test_empreinte_du_template_dans_la_cle(monkeypatch):
+    app.fill_procuration_pdf(PROCURATION)
+    gab = app._gabarit(app.TEMPLATES['procuration'])
+    monkeypatch.setitem(gab, 'empreinte', '0' * 64)
+    app.fill_procuration_pdf(PROCURATION)
+    assert _stats() == (0, 0, 2)
+
+
+def test_empreinte_du_code_dans_la_cle(monkeypatch, tmp_path):
+    # dossier disque conservé d'un déploiement à l'autre : nouveau code -> nouvelle clé
+    monkeypatch.setenv('CACHE_PDF_DOSSIER', str(tmp_path))
+    app.fill_procuration_pdf(PROCURATION)
+    app.vider_cache_pdf()                       # mémoire perdue au redémarrage
+    monkeypatch.setattr(app, '_EMPREINTE_CODE', 'autre-version')
+    app.fill_procuration_pdf(PROCURATION)
+    assert _stats() == (0, 0, 1)
+
+
+def test_empreinte_du_code_sha_de_build(monkeypatch):
+    monkeypatch.setattr(app, '_EMPREINTE_CODE', None)
+    monkeypatch.setenv('RAILWAY_GIT_COMMIT_SHA', 'abc123')
+    assert app._empreinte_code() == 'abc123'
+    monkeypatch.setattr(app, '_EMPREINTE_CODE', None)
+    monkeypatch.delenv('RAILWAY_GIT_COMMIT_SHA')
+    monkeypatch.delenv('BUILD_SHA', raising=False)
+    assert len(app._empreinte_code()) == 64
+
+
+def test_langue_et_mode_dans_la_cle():
+    app.fill_offre_pdf({'nom_societe': 'X'}, 'fr')
+    app.fill_offre_pdf({'nom_societe': 'X'}, 'nl')
+    app._remplir('offre_fr', {'nom_societe': 'X'}, reportlab=True)
+    assert _stats() == (0, 0, 3)
+
+
+def test_desactivable(monkeypatch):
+    monkeypatch.setenv('CACHE_PDF', '0')
+    app.fill_procuration_pdf(PROCURATION)
+    app.fill_procuration_pdf(PROCURATION)
+    assert _stats() == (0, 0, 0)
+
+
+def test_lru_memoire_bornee_en_octets(monkeypatch):
+    taille = len(app.fill_procuration_pdf(PROCURATION))
+    monkeypatch.setenv('CACHE_PDF_MEMOIRE_MO', str(2.5 * taille / 1024 / 1024))
+    app.fill_procuration_pdf(dict(PROCURATION, denomination='B'))
+    app.fill_procuration_pdf(PROCURATION)                 # rafraîchit la 1re
+    app.fill_procuration_pdf(dict(PROCURATION, denomination='C'))   # évince 'B'
+    s = app.cache_pdf_stats()
+    assert s['entrees'] == 2 and s['octets'] <= 2.5 * taille
+    app.fill_procuration_pdf(PROCURATION)
+    assert app.cache_pdf_stats()['memoire'] == 2
+    app.fill_procuration_pdf(dict(PROCURATION, denomination='B'))
+    assert app.cache_pdf_stats()['absent'] == 4
+
+
+def test_niveau_disque_partage_et_borne(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_PDF_DOSSIER', str(tmp_path))
+    a = app.fill_procuration_pdf(PROCURATION)
+    assert len(list(tmp_path.glob('*.pdf'))) == 1
+    app.vider_cache_pdf()                   # autre worker : mémoire vide
+    assert app.fill_procuration_pdf(PROCURATION) == a
+    assert _stats() == (0, 1, 0)
+    # budget disque = un seul document : le plus ancien est évincé
+    monkeypatch.setenv('CACHE_PDF_DISQUE_MO', str(1.5 * len(a) / 1024 / 1024))
+    app.fill_procuration_pdf(dict(PROCURATION, denomination='AUTRE SRL'))
+    assert len(list(tmp_path.glob('*.pdf'))) == 1
+
+
+def test_fill_et_zip_partagent_le_cache(monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    monkeypatch.setattr(app, 'save_employeur', lambda d: None)
+    monkeypatch.setenv('ZIP_PROCESSUS', '1')
+    c = app.app.test_client()
+    un = c.post('/fill-procuration', json=PROCURATION).data
+    r = c.post('/download-all-zip', json={'documents': ['procuration'],
+                                          'form_data': PROCURATION})
+    with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+        assert z.read('Procuration_ONSS.pdf') == un
+    assert _stats() == (1, 0, 1)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Tables de champs (FORM_LAYOUT / OFFRE_LAYOUT) et moteur de rendu unique.
+
+Ce qu'on verrouille ici :
+- chaque table vise un template existant et ne déborde pas de ses pages ;
+- le moteur ne pose QUE les champs remplis (cases à cocher selon la valeur,
+  replis de champs de l'Offre, date ISO remise à l'endroit) ;
+- une seule police par taille et par page (plus de setFont champ par champ).
+"""
+import io
+import os
+import sys
+
+import pytest
+from pypdf import PdfReader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+@pytest.mark.parametrize('cle', sorted(app.PLANS))
+def test_plan_vise_un_template_existant(cle):
+    assert cle in app.TEMPLATES
+    assert app.PLANS[cle]['nb_pages'] <= app._gabarit(app.TEMPLATES[cle])['nb_pages']
+
+
+def _textes(pages):
+    return [t for groupes in pages.values() for _taille, traits in groupes
+            for _x, _y, t in traits]
+
+
+def test_champ_vide_ne_pose_rien():
+    assert _textes(app._rendre(app.PLANS['employer'], {})) == []
+    assert _textes(app._rendre(app.PLANS['employer'], {'nom_societe': ''})) == []
+
+
+def test_choix_pose_une_seule_croix_au_bon_endroit():
+    plan = app.PLANS['employer']
+    srl = app._rendre(plan, {'forme_juridique': 'SRL'})[0]
+    sa = app._rendre(plan, {'forme_juridique': 'SA'})[0]
+    assert srl == [(12, [(*app.cvt(195, 235), 'X')])]
+    assert sa == [(12, [(*app.cvt(285, 235), 'X')])]
+    assert app._rendre(plan, {'forme_juridique': 'INCONNUE'})[0] == []
+    assert app._rendre(plan, {'forme_juridique': ['SRL']})[0] == []
+
+
+def test_case_cochee_si_vrai():
+    plan = app.PLANS['travailleur']
+    assert _textes(app._rendre(plan, {'transport_bus': True})) == ['X']
+    assert _textes(app._rendre(plan, {'transport_bus': False})) == []
+
+
+def test_offre_repli_et_date_iso():
+    pages = app._rendre(app.PLANS['offre_fr'], {'nom_prenom_gerant': 'Jean Dupont',
+                                                'date_fait': '2026-07-17'})
+    mandat = app.OFFRE_LAYOUT['fr']['pages']['mandat']
+    textes = _textes({mandat: pages[mandat]})
+    assert 'Jean Dupont' in textes          # soussigné : repli sur le gérant
+    assert '17/07/2026' in textes           # date : repli + remise à l'endroit
+
+
+def test_une_police_par_taille_et_par_page():
+    for plan in app.PLANS.values():
+        for _idx, groupes in plan['pages']:
+            tailles = [t for t, _ops in groupes]
+            assert len(tailles) == len(set(tailles))
+
+
+# ---------- calque direct (flux pypdf) == calque reportlab, au pixel ----------
+
+def _donnees_completes():
+    """Une valeur pour CHAQUE champ de chaque table (cases cochées, 1er choix)."""
+    d = {}
+    for cle, plan in app.PLANS.items():
+        for _idx, groupes in plan['pages']:
+            for _taille, ops in groupes:
+                for genre, champ, arg in ops:
+                    if genre == app._TEXTE:
+                        d.setdefault(champ[0], f'{champ[0][:10]} éè (1)')
+                    elif genre == app._COCHE:
+                        d[champ] = True
+                    else:
+                        d.setdefault(champ, next(iter(arg)))
+    d['date_signature'] = '2026-07-17'
+    return d
+
+
+@pytest.mark.parametrize('cle', sorted(app.PLANS))
+def test_calque_direct_identique_au_pixel(cle):
+    pdfium = pytest.importorskip('pypdfium2')
+    d = _donnees_completes()
+    direct = pdfium.PdfDocument(app._remplir(cle, d))
+    ref = pdfium.PdfDocument(app._remplir(cle, d, reportlab=True))
+    assert len(direct) == len(ref)
+    for idx, _groupes in app.PLANS[cle]['pages']:
+        a = direct[idx].render(scale=1.5).to_pil()
+        b = ref[idx].render(scale=1.5).to_pil()
+        assert a.tobytes() == b.tobytes(), f'{cle} : page {idx} différente'
+
+
+def test_texte_hors_winansi_repli_reportlab():
+    """Un caractère hors WinAnsi (ex. « Ł ») : reportlab sait le substituer."""
+    b = app._remplir('procuration', {'denomination': 'Łódź SRL'})
+    assert b.startswith(b'%PDF')
+    with pytest.raises(UnicodeEncodeError):
+        app._flux_texte([(10, [(0, 0, 'Łódź')])])
+
+
+def test_flux_texte_echappe_les_parentheses():
+    flux = app._flux_texte([(10, [(10, 20, 'a (b) \\ c')])])
+    assert b'(a \\(b\\) \\\\ c) Tj' in flux
+    assert flux.count(b' Tf') == 1
+
+
+@pytest.mark.parametrize('reportlab', [False, True])
+def test_pages_sans_texte_passent_intactes(reportlab):
+    """Mensura : seules les pages 1 et 4 ont des champs ; les pages 2-3 (calque
+    vierge) ne doivent pas être fusionnées, dans aucun des deux modes."""
+    b = app._remplir('mensura', _donnees_completes(), reportlab=reportlab)
+    src = app._gabarit(app.TEMPLATES['mensura'])['lecteur'].pages
+    out = PdfReader(io.BytesIO(b)).pages
+    for i in (1, 2):
+        assert out[i].get_contents().get_data() == src[i].get_contents().get_data(), i
+    assert out[0].get_contents().get_data() != src[0].get_contents().get_data()
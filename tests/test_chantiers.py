@@ -7,7 +7,7 @@ Ce qu'on verrouille ici :
 - décocher EFFACE la trace (fait_par='', fait_le=None) ;
 - création sans titre -> 400 (pas de lignes fantômes).
 
-Supabase est simulé (monkeypatch de requests.*) : on teste NOTRE logique
+Supabase est simulé (monkeypatch de supabase_http.*) : on teste NOTRE logique
 d'auth et de traçage, pas PostgREST.
 """
 import os
@@ -60,13 +60,13 @@ def client(monkeypatch):
     monkeypatch.setattr(app, 'SUPABASE_URL', 'https://fake.supabase.co')
     monkeypatch.setattr(app, 'SUPABASE_KEY', 'sk-fake')
     faux = FauxSupabase()
-    # Les endpoints chantiers passent par app.requests ; verify_user_token aussi
+    # Les endpoints chantiers passent par app.supabase_http ; verify_user_token aussi
     # (GET /auth/v1/user) -> notre faux GET renvoie 200 mais SANS email : on force
     # le chemin token invalide en faisant échouer côté statut quand pas de token.
-    monkeypatch.setattr(app.requests, 'get', faux.get)
-    monkeypatch.setattr(app.requests, 'post', faux.post)
-    monkeypatch.setattr(app.requests, 'patch', faux.patch)
-    monkeypatch.setattr(app.requests, 'delete', faux.delete)
+    monkeypatch.setattr(app.supabase_http, 'get', faux.get)
+    monkeypatch.setattr(app.supabase_http, 'post', faux.post)
+    monkeypatch.setattr(app.supabase_http, 'patch', faux.patch)
+    monkeypatch.setattr(app.supabase_http, 'delete', faux.delete)
     c = app.app.test_client()
     c.faux = faux
     return c
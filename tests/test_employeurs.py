@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""GET /employeurs : recherche et pagination faites par Supabase.
+
+Ce qu'on verrouille ici :
+- la recherche part dans la requête (ilike sur nom ET numéro), plus de filtre
+  Python sur 500 lignes ;
+- une page = `limit` lignes (50 par défaut, 200 max) ; X-Suivant porte le
+  curseur (updated_at, num_entreprise) de la dernière, absent en fin de liste ;
+- le curseur redonne un filtre « strictement après », lignes sans updated_at
+  comprises (servies en dernier) ; curseur illisible -> 400 ;
+- data=0 retire le blob `data` du SELECT ;
+- la saisie est mise entre guillemets PostgREST (" et \\ échappés), jokers
+  LIKE (% _) ramenés au joker *.
+
+Supabase est simulé (monkeypatch de supabase_http.*) : on vérifie la requête
+construite, pas PostgREST.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+class FauxSupabase:
+    def __init__(self):
+        self.appels = []
+        self.lignes = []
+
+    def get(self, url, **kw):
+        self.appels.append((url, kw))
+        lignes = [] if 'limit=0' in url else self.lignes[:kw['params']['limit']]
+
+        class R:
+            status_code = 200
+            text = ''
+            def json(self):
+                return lignes
+        return R()
+
+
+def _ligne(i):
+    return {'num_entreprise': f'0{i:09d}', 'nom_societe': f'SOC {i}',
+            'updated_at': f'2026-07-{1 + i % 28:02d}T10:00:00+00:00'}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'SUPABASE_URL', 'https://fake.supabase.co')
+    monkeypatch.setattr(app, 'SUPABASE_KEY', 'sk-fake')
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'gest@test.be')
+    faux = FauxSupabase()
+    monkeypatch.setattr(app.supabase_http, 'get', faux.get)
+    app.vider_cache_schema()
+    c = app.app.test_client()
+    c.faux = faux
+    return c
+
+
+def _params(client):
+    (url, kw), = [a for a in client.faux.appels if 'limit=0' not in a[0]]
+    assert url == 'https://fake.supabase.co/rest/v1/employeurs'
+    return kw['params']
+
+
+def test_recherche_dans_la_requete(client):
+    assert client.get('/employeurs?q=Acme').status_code == 200
+    p = _params(client)
+    assert p['and'] == '(or(nom_societe.ilike."*Acme*",num_entreprise.ilike."*Acme*"))'
+    assert p['limit'] == 51 and p['order'] == 'updated_at.desc.nullslast,num_entreprise.desc'
+
+
+def test_page_et_curseur(client):
+    client.faux.lignes = [_ligne(i) for i in range(30, 0, -1)]
+    r = client.get('/employeurs?limit=10')
+    assert len(r.get_json()) == 10 and 'X-Suivant' in r.headers
+    client.faux.appels.clear()
+    client.get('/employeurs?limit=10&q=soc&apres=' + r.headers['X-Suivant'])
+    dernier = r.get_json()[-1]
+    assert _params(client)['and'] == (
+        '(or(nom_societe.ilike."*soc*",num_entreprise.ilike."*soc*"),'
+        f'or(updated_at.lt."{dernier["updated_at"]}",and(updated_at.eq."{dernier["updated_at"]}",'
+        f'num_entreprise.lt."{dernier["num_entreprise"]}"),updated_at.is.null))')
+
+
+def test_curseur_sur_ligne_sans_updated_at(client):
+    client.faux.lignes = [dict(_ligne(i), updated_at=None) for i in range(9, 0, -1)]
+    r = client.get('/employeurs?limit=3')
+    assert 'X-Suivant' in r.headers                       # la suite n'est pas perdue
+    client.faux.appels.clear()
+    client.get('/employeurs?limit=3&apres=' + r.headers['X-Suivant'])
+    assert _params(client)['and'] == \
+        f'(and(updated_at.is.null,num_entreprise.lt."{r.get_json()[-1]["num_entreprise"]}"))'
+
+
+def test_derniere_page_sans_curseur(client):
+    client.faux.lignes = [_ligne(i) for i in range(3)]
+    r = client.get('/employeurs')
+    assert len(r.get_json()) == 3 and 'X-Suivant' not in r.headers
+
+
+def test_limite_bornee_et_curseur_invalide(client):
+    client.get('/employeurs?limit=5000')
+    assert _params(client)['limit'] == 201
+    assert client.get('/employeurs?limit=abc').status_code == 400
+    assert client.get('/employeurs?apres=%%%').status_code == 400
+    assert client.get('/employeurs?apres=WzEsMl0').status_code == 400    # [1,2]
+
+
+def test_sans_data(client):
+    client.get('/employeurs?data=0')
+    assert 'data' not in _params(client)['select'].split(',')
+
+
+def test_saisie_entre_guillemets_echappee(client):
+    client.get('/employeurs', query_string={'q': 'a,b)*%_"c\\d'})
+    motif = r'"*a,b)***\"c\\d*"'
+    assert _params(client)['and'] == f'(or(nom_societe.ilike.{motif},num_entreprise.ilike.{motif}))'
+    client.faux.appels.clear()
+    client.get('/employeurs?q=%20%20')
+    assert 'and' not in _params(client)
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""Parser des états de prestations Prisma (/parse-prestations).
+
+Ce qu'on verrouille ici :
+- en-tête (client, n° employeur, ONSS, période) et blocs travailleurs ;
+- un bloc coupé par un saut de page est lu comme s'il était d'un seul tenant ;
+- automate à un seul passage : mêmes résultats que l'ancienne lecture par
+  tranches de 15 lignes, y compris valeurs passées à la ligne ;
+- mémoire bornée : pages extraites une à une, cache du lecteur vidé entre deux ;
+- PRESTATIONS_PAGES_MAX arrête la lecture et marque le résultat « tronque » ;
+- la route recopie l'upload dans un fichier temporaire avant de le lire ;
+- un upload identique est resservi par le cache (SHA-256 + version du parser),
+  sans extraction ; LRU borné, X-Cache-Etat dit hit/miss/off ;
+- /parse-prestations-lot : N fichiers en une requête, résultats par nom de
+  fichier dans l'ordre d'envoi, erreur et durée par fichier (jamais nulle),
+  fichiers identiques lus une seule fois, pool de processus.
+"""
+import io
+import os
+import sys
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from pypdf import PdfReader
+from reportlab.pdfgen import canvas
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def _etat(pages, par_page=8, lignes_par_page=None):
+    """Faux état Prisma : en-tête sur la 1re page, puis des blocs travailleurs.
+    lignes_par_page : force le saut de page après N lignes (blocs coupés)."""
+    lignes = ["0012/002586        ETAT DE PRESTATIONS", "CLIENT TEST SRL",
+              "No ONSS: 123-4567-89", "Période du 01/06/2026 jusqu'au 30/06/2026"]
+    for k in range(1, pages * par_page + 1):
+        lignes += [f"{10000 + k}DUPONT JEAN {k}",
+                   f"No.rég.nat.: 85.01.{k % 28 + 1:02d} 123-{k % 100:02d}07,60",
+                   f"Régime Mois {30 + k % 9}", "Entrée 01/02/2024", "Code 0001  38,00"]
+    n = lignes_par_page or -(-len(lignes) // pages)
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf)
+    for debut in range(0, len(lignes), n):
+        for j, t in enumerate(lignes[debut:debut + n]):
+            c.drawString(40, 800 - 12 * j, t)
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def cache_etats_vide(monkeypatch):
+    monkeypatch.delenv('CACHE_ETATS', raising=False)
+    monkeypatch.delenv('CACHE_ETATS_MAX', raising=False)
+    app.vider_cache_etats()
+    yield
+    app.vider_cache_etats()
+
+
+def _parse(b, **kw):
+    return app.parse_etat_prestation(PdfReader(io.BytesIO(b)), **kw)
+
+
+def test_entete_et_travailleurs():
+    r = _parse(_etat(2))
+    assert r['client'] == 'CLIENT TEST SRL' and r['numero_employeur'] == '2586'
+    assert r['onss'] == '123-4567-89'
+    assert r['periode'] == {'debut': '01/06/2026', 'fin': '30/06/2026'}
+    assert len(r['travailleurs']) == 16 and r['tronque'] is False
+    assert r['travailleurs'][0] == {
+        'matricule': '10001', 'nom': 'DUPONT JEAN 1', 'niss': '85.01.02 123-01',
+        'heures_jour': '07,60', 'regime': '31', 'date_entree': '01/02/2024'}
+
+
+def test_bloc_coupe_par_un_saut_de_page():
+    d_un_tenant = _parse(_etat(1, par_page=6))
+    coupe = _parse(_etat(1, par_page=6, lignes_par_page=11))    # coupe dans les blocs
+    assert coupe['travailleurs'] == d_un_tenant['travailleurs']
+
+
+def test_automate_valeurs_a_la_ligne():
+    r = app._scanner_etat(iter([
+        "0012/000007", " CLIENT ", "No ONSS:", "", "  987-65", "du 01/06/2026", "jusqu'au",
+        "", "30/06/2026",
+        "12345MARTIN ÉRIC", "No.rég.nat.: 90.02.03 456-78", "Régime Mois", "", "19",
+        "Entrée 05/05/2025",
+        "23456DURAND ANNE", "No.rég.nat.: 91.02.03 456-7807,60"] + ["-"] * 13 + ["Mois 38"]))
+    assert (r['client'], r['numero_employeur'], r['onss']) == ('CLIENT', '7', '987-65')
+    assert r['periode'] == {'debut': '01/06/2026', 'fin': '30/06/2026'}
+    martin, durand = r['travailleurs']
+    assert (martin['regime'], martin['date_entree'], martin['heures_jour']) == ('19', '05/05/2025', '')
+    assert durand['regime'] == '' and durand['date_entree'] == ''   # « Mois » hors des 15 lignes
+
+
+def test_travailleur_sans_ligne_niss_ignore():
+    r = app._scanner_etat(iter(["x", "y", "12345FAUX", "autre chose", "23456VRAI",
+                                " No.rég.nat.: 90.02.03 456-78"]))
+    assert [w['nom'] for w in r['travailleurs']] == ['VRAI']
+
+
+def test_cache_du_lecteur_vide_entre_les_pages(monkeypatch):
+    rd = PdfReader(io.BytesIO(_etat(4)))
+    tailles = []
+    vrai = app._avancer_bloc
+
+    def espion(bloc, l):
+        tailles.append(len(rd.resolved_objects))
+        return vrai(bloc, l)
+
+    monkeypatch.setattr(app, '_avancer_bloc', espion)
+    app.parse_etat_prestation(rd)
+    assert max(tailles) == 0
+
+
+def test_limite_de_pages(monkeypatch):
+    b = _etat(5)
+    r = _parse(b, pages_max=2)
+    assert r['tronque'] is True and len(r['travailleurs']) == 16
+    monkeypatch.setenv('PRESTATIONS_PAGES_MAX', '1')
+    r = _parse(b)
+    assert r['tronque'] is True and len(r['travailleurs']) == 8
+    assert r['client'] == 'CLIENT TEST SRL'
+
+
+def test_route_fichier_temporaire(monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    lus = []
+    vrai = app.parse_etat_prestation
+
+    def espion(reader, **kw):
+        lus.append(reader.stream)
+        return vrai(reader, **kw)
+
+    monkeypatch.setattr(app, 'parse_etat_prestation', espion)
+    r = app.app.test_client().post('/parse-prestations', data={
+        'file': (io.BytesIO(_etat(2)), 'etat.pdf')}, content_type='multipart/form-data')
+    assert r.status_code == 200 and len(r.get_json()['travailleurs']) == 16
+    assert not isinstance(lus[0], io.BytesIO) and lus[0].closed      # fichier temporaire refermé
+
+
+def test_route_sans_fichier_400(monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    assert app.app.test_client().post('/parse-prestations', data={}).status_code == 400
+
+
+@pytest.mark.parametrize('contenu', [b'pas un pdf', b''])
+def test_route_fichier_illisible_500(monkeypatch, contenu):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    r = app.app.test_client().post('/parse-prestations', data={
+        'file': (io.BytesIO(contenu), 'etat.pdf')}, content_type='multipart/form-data')
+    assert r.status_code == 500 and 'error' in r.get_json()
+
+
+# ---------- cache des états lus ----------
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    appels = []
+    vrai = app.parse_etat_prestation
+    monkeypatch.setattr(app, 'parse_etat_prestation',
+                        lambda reader, **kw: appels.append(1) or vrai(reader, **kw))
+    c = app.app.test_client()
+    c.appels = appels
+    return c
+
+
+def _envoyer(client, b):
+    return client.post('/parse-prestations', data={'file': (io.BytesIO(b), 'etat.pdf')},
+                       content_type='multipart/form-data')
+
+
+def test_meme_etat_resservi_sans_extraction(client):
+    b = _etat(2)
+    r1, r2 = _envoyer(client, b), _envoyer(client, b)
+    assert r1.headers['X-Cache-Etat'] == 'miss' and r2.headers['X-Cache-Etat'] == 'hit'
+    assert r1.get_json() == r2.get_json() and len(client.appels) == 1
+    assert _envoyer(client, _etat(1)).headers['X-Cache-Etat'] == 'miss'
+    assert app.cache_etats_stats() == {'hit': 1, 'miss': 2, 'entrees': 2}
+
+
+def test_limite_de_pages_dans_la_cle(client, monkeypatch):
+    b = _etat(3)
+    _envoyer(client, b)
+    monkeypatch.setenv('PRESTATIONS_PAGES_MAX', '1')
+    r = _envoyer(client, b)
+    assert r.headers['X-Cache-Etat'] == 'miss' and r.get_json()['tronque'] is True
+
+
+def test_version_du_parser_dans_la_cle(client, monkeypatch):
+    b = _etat(1)
+    _envoyer(client, b)
+    monkeypatch.setattr(app, '_VERSION_PARSER_ETAT', app._VERSION_PARSER_ETAT + 1)
+    assert _envoyer(client, b).headers['X-Cache-Etat'] == 'miss'
+
+
+def test_lru_borne(client, monkeypatch):
+    monkeypatch.setenv('CACHE_ETATS_MAX', '2')
+    a, b, c = _etat(1), _etat(2), _etat(3)
+    for x in (a, b, a, c):                   # c évince b (a vient d'être relu)
+        _envoyer(client, x)
+    assert app.cache_etats_stats()['entrees'] == 2
+    assert _envoyer(client, a).headers['X-Cache-Etat'] == 'hit'
+    assert _envoyer(client, b).headers['X-Cache-Etat'] == 'miss'
+
+
+def test_cache_desactivable(client, monkeypatch):
+    monkeypatch.setenv('CACHE_ETATS', '0')
+    b = _etat(1)
+    assert [_envoyer(client, b).headers['X-Cache-Etat'] for _ in range(2)] == ['off', 'off']
+    assert len(client.appels) == 2
+
+
+# ---------- plusieurs états en une requête ----------
+
+@pytest.fixture
+def lot(monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    monkeypatch.setenv('ZIP_PROCESSUS', '1')
+    c = app.app.test_client()
+
+    def envoyer(fichiers):
+        return c.post('/parse-prestations-lot', content_type='multipart/form-data', data={
+            'files': [(io.BytesIO(b), nom) for nom, b in fichiers]})
+    return envoyer
+
+
+def test_lot_resultats_par_fichier_dans_l_ordre(lot):
+    r = lot([('b.pdf', _etat(2)), ('a.pdf', _etat(1)), ('casse.pdf', b'pas un pdf'),
+             ('a.pdf', _etat(3))])
+    assert r.status_code == 200
+    f = r.get_json()['fichiers']
+    assert r.get_json()['ordre'] == ['b.pdf', 'a.pdf', 'casse.pdf', 'a.pdf (2)']
+    assert [len(f[n]['resultat']['travailleurs']) for n in ('b.pdf', 'a.pdf', 'a.pdf (2)')] \
+        == [16, 8, 24]
+    assert f['casse.pdf']['ok'] is False and f['casse.pdf']['error']
+    assert all(isinstance(x['ms'], float) for x in f.values())
+
+
+def test_lot_passe_par_le_cache(lot):
+    b = _etat(2)
+    lot([('janvier.pdf', b)])
+    f = lot([('copie.pdf', b), ('autre.pdf', _etat(1))]).get_json()['fichiers']
+    assert f['copie.pdf']['cache'] == 'hit' and f['autre.pdf']['cache'] == 'miss'
+    assert f['copie.pdf']['resultat']['client'] == 'CLIENT TEST SRL'
+
+
+def test_lot_fichiers_identiques_lus_une_fois(lot, monkeypatch):
+    lus, vrai = [], app.parser_etats
+    monkeypatch.setattr(app, 'parser_etats', lambda c, p: lus.append(len(c)) or vrai(c, p))
+    b = _etat(2)
+    f = lot([('a.pdf', b), ('copie.pdf', b), ('autre.pdf', _etat(1))]).get_json()['fichiers']
+    assert lus == [2]
+    assert f['a.pdf'] == f['copie.pdf'] and f['copie.pdf']['cache'] in ('miss', 'off')
+    assert len(f['autre.pdf']['resultat']['travailleurs']) == 8
+
+
+def test_lot_pool_meme_resultat(lot, monkeypatch):
+    fichiers = [(f'{k}.pdf', _etat(k)) for k in (1, 2, 3)]
+    sequentiel = lot(fichiers).get_json()['fichiers']
+    app.vider_cache_etats()
+    monkeypatch.setenv('ZIP_PROCESSUS', '2')
+    parallele = lot(fichiers).get_json()['fichiers']
+    assert set(parallele) == set(sequentiel)
+    for nom in sequentiel:
+        assert parallele[nom]['resultat'] == sequentiel[nom]['resultat']
+        assert parallele[nom]['cache'] == 'miss'
+
+
+class FauxPool:
+    """Exécute tout de suite ; le 1er fichier casse le pool, le 2e lève."""
+    def __init__(self):
+        self.n = 0
+
+    def submit(self, fn, *args):
+        f, self.n = Future(), self.n + 1
+        if self.n == 1:
+            f.set_exception(BrokenProcessPool('processus tué'))
+        elif self.n == 2:
+            f.set_exception(RuntimeError('boum'))
+        else:
+            f.set_result(fn(*args))
+        return f
+
+
+def test_lot_pool_casse_rattrape_et_erreur_isolee(lot, monkeypatch):
+    monkeypatch.setenv('ZIP_PROCESSUS', '2')
+    pool = FauxPool()
+    monkeypatch.setattr(app, '_pool', lambda: pool)
+    monkeypatch.setattr(app, '_abandonner_pool', lambda: None)
+    f = lot([(f'{k}.pdf', _etat(k)) for k in (1, 2, 3)]).get_json()['fichiers']
+    assert f['1.pdf']['ok'] and len(f['1.pdf']['resultat']['travailleurs']) == 8   # refait sur place
+    assert f['2.pdf']['ok'] is False and f['2.pdf']['error'] == 'boum'
+    assert isinstance(f['2.pdf']['ms'], float)       # mesuré côté worker
+    assert len(f['3.pdf']['resultat']['travailleurs']) == 24
+
+
+def test_lot_sans_jeton_401():
+    r = app.app.test_client().post('/parse-prestations-lot', data={})
+    assert r.status_code == 401
+
+
+def test_lot_vide_ou_trop_grand_400(lot, monkeypatch):
+    assert lot([]).status_code == 400
+    monkeypatch.setattr(app, 'LOT_ETATS_MAX', 2)
+    assert lot([(f'{k}.pdf', b'x') for k in range(3)]).status_code == 400
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Gabarits PDF analysés une fois par worker.
+
+Ce qu'on verrouille ici :
+- chaque template n'est analysé qu'UNE fois (le cache rend le même lecteur) ;
+- une requête travaille sur une COPIE : générer deux fois de suite donne deux
+  fois le même document ;
+- les templates tournés (Procuration, /Rotate 270) sont redressés une fois au
+  chargement ;
+- le temps passé est exposé dans l'en-tête Server-Timing.
+"""
+import io
+import os
+import sys
+
+from pypdf import PdfReader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+PROCURATION = {'num_entreprise': 'BE 0555.123.456', 'denomination': 'TEST SRL',
+               'date_signature': '17/07/2026', 'nom_mandant': 'Jean Dupont'}
+
+
+def test_gabarit_analyse_une_seule_fois():
+    g1 = app._gabarit(app.TEMPLATES['offre_fr'])
+    g2 = app._gabarit(app.TEMPLATES['offre_fr'])
+    assert g1 is g2
+    assert g1['nb_pages'] == 20
+
+
+def test_tous_les_templates_sont_prechauffes():
+    for fn in app.TEMPLATES.values():
+        assert app._chemin_gabarit(fn) in app._GABARITS, fn
+
+
+def test_gabarit_partage_jamais_modifie():
+    gab = app._gabarit(app.TEMPLATES['procuration'])
+    page = gab['lecteur'].pages[0]
+    rotation = page.get('/Rotate')
+    contenu = page.get_contents().get_data()
+    a = app.fill_procuration_pdf(PROCURATION)
+    b = app.fill_procuration_pdf(PROCURATION)
+    assert page.get('/Rotate') == rotation
+    assert page.get_contents().get_data() == contenu
+    pa, pb = PdfReader(io.BytesIO(a)).pages[0], PdfReader(io.BytesIO(b)).pages[0]
+    assert pa.get_contents().get_data() == pb.get_contents().get_data()
+
+
+def test_templates_tournes_redresses_au_chargement():
+    # PROCURATION.pdf est en /Rotate 270 sur disque ; le gabarit en mémoire
+    # est déjà droit, le chemin chaud n'a plus de rotation à transférer.
+    assert PdfReader(app._chemin_gabarit(app.TEMPLATES['procuration'])).pages[0].get('/Rotate')
+    for fn in app.TEMPLATES.values():
+        for pg in app._gabarit(fn)['lecteur'].pages:
+            assert not pg.get('/Rotate'), fn
+
+
+def test_xobjects_du_template_construits_une_fois():
+    tpl = app.TEMPLATES['offre_fr']
+    for i in app.OFFRE_LAYOUT['fr']['pages'].values():
+        assert app._fond(tpl, i) is app._fond(tpl, i)   # précalculé au démarrage
+    fond = app._fond(tpl, 0)
+    corps = fond['corps']
+    app.fill_offre_pdf({'nom_societe': 'TEST SRL'}, 'fr')
+    app._remplir('offre_fr', {'nom_societe': 'TEST SRL'}, reportlab=True)
+    # Ni la mise à jour incrémentale ni le repli reportlab ne touchent au cache.
+    assert app._fond(tpl, 0) is fond and fond['corps'] == corps
+    assert getattr(fond['objet'], 'indirect_reference', None) is None
+
+
+def test_server_timing_expose():
+    app.vider_cache_pdf()                  # sinon servi par le cache, sans gabarit
+    c = app.app.test_client()
+    r = c.post('/fill-procuration', json=PROCURATION)
+    assert r.status_code == 200
+    assert 'gabarit;dur=' in r.headers.get('Server-Timing', '')
+    r = c.post('/fill-procuration', json=PROCURATION)
+    timing = r.headers.get('Server-Timing', '')
+    assert 'cache;dur=' in timing and 'gabarit' not in timing
@@ -6,7 +6,7 @@ Ce qu'on verrouille ici (même modèle que test_chantiers) :
 - création sans titre -> 400, création valide stampe cree_par ;
 - on n'envoie jamais à Supabase une colonne hors ITIA_COLS.
 
-Supabase est simulé (monkeypatch de requests.*) : on teste NOTRE logique,
+Supabase est simulé (monkeypatch de supabase_http.*) : on teste NOTRE logique,
 pas PostgREST.
 """
 import os
@@ -57,10 +57,10 @@ def client(monkeypatch):
     monkeypatch.setattr(app, 'SUPABASE_URL', 'https://fake.supabase.co')
     monkeypatch.setattr(app, 'SUPABASE_KEY', 'sk-fake')
     faux = FauxSupabase()
-    monkeypatch.setattr(app.requests, 'get', faux.get)
-    monkeypatch.setattr(app.requests, 'post', faux.post)
-    monkeypatch.setattr(app.requests, 'patch', faux.patch)
-    monkeypatch.setattr(app.requests, 'delete', faux.delete)
+    monkeypatch.setattr(app.supabase_http, 'get', faux.get)
+    monkeypatch.setattr(app.supabase_http, 'post', faux.post)
+    monkeypatch.setattr(app.supabase_http, 'patch', faux.patch)
+    monkeypatch.setattr(app.supabase_http, 'delete', faux.delete)
     c = app.app.test_client()
     c.faux = faux
     return c
@@ -13,7 +13,7 @@ Ce qu'on verrouille ici :
 - le mapping dump -> champs règlement (CP, langue, heures/sem, adresse, SEPPT,
   assurance-loi) ne renvoie QUE ce qui a été trouvé.
 
-Supabase est simulé (monkeypatch de requests.*) : on teste NOTRE logique.
+Supabase est simulé (monkeypatch de supabase_http.*) : on teste NOTRE logique.
 """
 import json
 import os
@@ -61,9 +61,9 @@ def client(monkeypatch):
     monkeypatch.setattr(app, 'SUPABASE_URL', 'https://fake.supabase.co')
     monkeypatch.setattr(app, 'SUPABASE_KEY', 'sk-fake')
     faux = FauxSupabase()
-    monkeypatch.setattr(app.requests, 'get', faux.get)
-    monkeypatch.setattr(app.requests, 'patch', faux.patch)
-    monkeypatch.setattr(app.requests, 'post', faux.post)
+    monkeypatch.setattr(app.supabase_http, 'get', faux.get)
+    monkeypatch.setattr(app.supabase_http, 'patch', faux.patch)
+    monkeypatch.setattr(app.supabase_http, 'post', faux.post)
     # utilisateur portail « connecté » par défaut ; les tests 401 le débranchent
     monkeypatch.setattr(app, 'verify_user_token', lambda req: 'gest@test.be')
     c = app.app.test_client()
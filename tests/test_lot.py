@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Publipostage (/fill-lot) : N exemplaires dans un seul PDF.
+
+Ce qu'on verrouille ici :
+- un exemplaire par élément du lot, dans l'ordre, chacun avec SES données ;
+- le template n'est stocké qu'une fois (XObject partagé par toutes les pages) :
+  chaque exemplaire supplémentaire coûte quelques Ko, pas des centaines ;
+- chaque exemplaire est identique au pixel au document rempli seul ;
+- la route est authentifiée et bornée.
+"""
+import io
+import os
+import sys
+
+import pytest
+from pypdf import PdfReader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def _lot(n):
+    return [{'denomination': f'CLIENT {i} SRL', 'nom_societe': f'CLIENT {i} SRL',
+             'nom_soussigne': f'Gérant {i}', 'num_entreprise': f'BE 0555.123.{i:03d}',
+             'date_signature': '2026-07-17'} for i in range(n)]
+
+
+@pytest.mark.parametrize('doc_type', ['seppt', 'accident', 'procuration'])
+def test_un_exemplaire_par_element_dans_l_ordre(doc_type):
+    lot = _lot(5)
+    b = app.remplir_lot(doc_type, lot)
+    n = len(PdfReader(io.BytesIO(app.generate_pdf_bytes(doc_type, lot[0]))).pages)
+    pages = PdfReader(io.BytesIO(b)).pages
+    assert len(pages) == 5 * n
+    for i, d in enumerate(lot):
+        flux = b''.join(p.get_contents().get_data() for p in pages[i * n:(i + 1) * n])
+        # le texte pointillé du template gêne l'extraction : on lit nos Tj
+        attendus = [app._chaine_pdf(d[c]) for c in ('denomination', 'nom_soussigne')]
+        assert any(a in flux for a in attendus), i
+        autres = [app._chaine_pdf(x['nom_soussigne']) for x in lot if x is not d]
+        assert not any(a in flux for a in autres), i
+
+
+def test_template_stocke_une_seule_fois():
+    tpl = set()
+    for pg in PdfReader(io.BytesIO(app.remplir_lot('procuration', _lot(10)))).pages:
+        tpl.add(pg['/Resources']['/XObject'].raw_get('/__tpl').idnum)
+    assert len(tpl) == 1
+
+
+def test_quelques_ko_par_exemplaire():
+    un = len(app.remplir_lot('procuration', _lot(1)))
+    vingt = len(app.remplir_lot('procuration', _lot(20)))
+    assert un > 500_000                     # le template lui-même (~780 Ko)
+    assert (vingt - un) / 19 < 4096
+
+
+@pytest.mark.parametrize('doc_type', ['seppt', 'procuration'])
+def test_identique_au_document_seul(doc_type):
+    pdfium = pytest.importorskip('pypdfium2')
+    lot = _lot(3)
+    lot[1]['denomination'] = 'Łódź SRL'      # hors WinAnsi : repli reportlab
+    b = pdfium.PdfDocument(app.remplir_lot(doc_type, lot))
+    for k, d in enumerate(lot):
+        seul = pdfium.PdfDocument(app.generate_pdf_bytes(doc_type, d))
+        n = len(seul)
+        for i in range(n):
+            a = b[k * n + i].render(scale=1.5).to_pil().tobytes()
+            assert a == seul[i].render(scale=1.5).to_pil().tobytes(), (k, i)
+
+
+def test_document_hors_publipostage_refuse():
+    with pytest.raises(ValueError):
+        app.remplir_lot('offre', _lot(2))
+
+
+# ---------- route ----------
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    return app.app.test_client()
+
+
+def test_route_sans_jeton_401():
+    r = app.app.test_client().post('/fill-lot', json={'doc_type': 'seppt', 'lot': _lot(2)})
+    assert r.status_code == 401
+
+
+def test_route_renvoie_le_pdf(client):
+    r = client.post('/fill-lot', json={'doc_type': 'accident', 'lot': _lot(3),
+                                       'language_prefs': {'accident': 'nl'}})
+    assert r.status_code == 200 and r.mimetype == 'application/pdf'
+    assert len(PdfReader(io.BytesIO(r.data)).pages) == 3
+
+
+@pytest.mark.parametrize('corps', [
+    {'doc_type': 'offre', 'lot': [{}]},
+    {'doc_type': 'seppt', 'lot': []},
+    {'doc_type': 'seppt', 'lot': ['pas un objet']},
+    {'doc_type': 'seppt', 'lot': [{}] * (app.LOT_MAX + 1)},
+])
+def test_route_lot_invalide_400(client, corps):
+    assert client.post('/fill-lot', json=corps).status_code == 400
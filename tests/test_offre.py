@@ -161,3 +161,26 @@ def test_champ_vide_nimprime_rien(offres):
         for idx in app.OFFRE_LAYOUT['fr']['pages'].values():
             t = pdf.pages[idx].extract_text() or ''
             assert 'None' not in t, f'page {idx} : « None » imprimé'
+
+
+@pytest.mark.parametrize('lang', LANGUES)
+def test_mise_a_jour_incrementale(offres, lang):
+    """Sortie = octets du template inchangés + mise à jour incrémentale : seules
+    les pages remplies sont réécrites, les pages statiques restent les objets
+    d'origine (même numéro, jamais recopiés)."""
+    tpl = app.TEMPLATES['offre_nl' if lang == 'nl' else 'offre_fr']
+    octets = app._gabarit(tpl)['octets']
+    assert offres[lang].startswith(octets)
+    ajout = offres[lang][len(octets):]
+    assert re.search(rb'/Prev \d+', ajout) and ajout.rstrip().endswith(b'%%EOF')
+
+    src = PdfReader(io.BytesIO(octets))
+    out = PdfReader(io.BytesIO(offres[lang]), strict=True)
+    touchees = set(app.OFFRE_LAYOUT[lang]['pages'].values())
+    reecrites = {int(n) for n in re.findall(rb'(\d+) 0 obj', ajout)}
+    for i, (a, b) in enumerate(zip(src.pages, out.pages)):
+        assert a.indirect_reference.idnum == b.indirect_reference.idnum
+        if i in touchees:
+            assert a.indirect_reference.idnum in reecrites, f'{lang} : page {i} pas réécrite'
+        else:
+            assert a.indirect_reference.idnum not in reecrites, f'{lang} : page {i} recopiée'
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Optimisation de taille des PDF (pdf_optim, PDF_OPTIMISER / ?optimiser=1).
+
+Ce qu'on verrouille ici :
+- la sortie est un PDF 1.5 à flux d'objets + xref compressée, lisible par pypdf ;
+- les objets identiques (polices Helvetica des calques…) sont fusionnés ;
+- rendu identique au pixel, et jamais plus gros que l'original ;
+- désactivée par défaut ; activable par env ou paramètre de requête, tailles
+  avant/après dans X-PDF-Taille ; entrée de cache distincte ;
+- un échec de l'optimisation sert le PDF d'origine ;
+- sortie linéarisée (offre, procuration) : dictionnaire /Linearized en tête,
+  page 1 et ses ressources avant /E, tables d'indices cohérentes avec le
+  fichier ; demandée par ?lineariser=1 ou PDF_LINEARISER=<types>.
+"""
+import io
+import os
+import re
+import sys
+
+import pytest
+from pypdf import PdfReader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+import pdf_optim  # noqa: E402
+
+DONNEES = {'nom_societe': 'TEST SRL', 'denomination': 'TEST SRL', 'nom': 'Dupont',
+           'prenom': 'Jean', 'num_entreprise': 'BE 0555.123.456',
+           'date_signature': '17/07/2026', 'nom_soussigne': 'Jean Dupont'}
+
+
+@pytest.fixture(autouse=True)
+def sans_optimisation(monkeypatch):
+    monkeypatch.delenv('PDF_OPTIMISER', raising=False)
+    monkeypatch.delenv('PDF_LINEARISER', raising=False)
+    app.vider_cache_pdf()
+    yield
+    app.vider_cache_pdf()
+
+
+def _reportlab(cle):
+    return app._remplir(cle, DONNEES, reportlab=True)
+
+
+def test_flux_objets_et_xref_compressee():
+    avant = _reportlab('mensura')
+    apres, st = pdf_optim.optimiser_pdf(avant)
+    assert apres.startswith(b'%PDF-1.5') and b'/ObjStm' in apres and b'/XRef' in apres
+    assert b'\nxref' not in apres and b'trailer' not in apres
+    assert st['avant'] == len(avant) and st['apres'] == len(apres) < len(avant)
+    assert st['objets_apres'] < st['objets_avant']
+    rd = PdfReader(io.BytesIO(apres), strict=True)
+    origine = PdfReader(io.BytesIO(avant))
+    assert [p.extract_text() for p in rd.pages] == [p.extract_text() for p in origine.pages]
+
+
+def test_polices_identiques_fusionnees():
+    lot = [dict(DONNEES, denomination=f'Łódź {i}') for i in range(4)]   # calques reportlab
+    avant = app.remplir_lot('procuration', lot)
+    apres, _st = pdf_optim.optimiser_pdf(avant)
+
+    def polices(b):
+        par_page = [{f.idnum for f in pg['/Resources']['/XObject']['/__ovl']['/Resources']['/Font'].values()}
+                    for pg in PdfReader(io.BytesIO(b)).pages]
+        return par_page[0], set().union(*par_page)
+    serie, toutes = polices(apres)
+    assert toutes == serie                   # une seule série de polices pour tout le lot
+    assert len(polices(avant)[1]) > len(serie)
+
+
+@pytest.mark.parametrize('cle', ['employer', 'offre_fr', 'att_accident_nl'])
+def test_identique_au_pixel(cle):
+    pdfium = pytest.importorskip('pypdfium2')
+    avant = _reportlab(cle)
+    a, b = pdfium.PdfDocument(avant), pdfium.PdfDocument(pdf_optim.optimiser_pdf(avant)[0])
+    assert len(a) == len(b)
+    for i in range(len(a)):
+        assert a[i].render(scale=1).to_pil().tobytes() == b[i].render(scale=1).to_pil().tobytes()
+
+
+def test_jamais_plus_gros():
+    avant = app._remplir('procuration', DONNEES)
+    apres, st = pdf_optim.optimiser_pdf(avant)
+    assert len(apres) <= len(avant) and st['apres'] == len(apres)
+
+
+# ---------- branchement dans l'app ----------
+
+def test_desactivee_par_defaut():
+    assert b'/ObjStm' not in app.fill_att_accident_pdf(DONNEES)
+
+
+def test_activee_par_env_cache_distinct(monkeypatch):
+    brut = app.fill_att_accident_pdf(DONNEES)
+    monkeypatch.setenv('PDF_OPTIMISER', '1')
+    opt = app.fill_att_accident_pdf(DONNEES)
+    assert b'/ObjStm' in opt and len(opt) < len(brut)
+    assert app.cache_pdf_stats()['absent'] == 2
+    assert app.fill_att_accident_pdf(DONNEES) == opt
+
+
+def test_parametre_de_requete_et_entete(monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    monkeypatch.setattr(app, 'save_employeur', lambda d: None)
+    c = app.app.test_client()
+    r = c.post('/fill-employer-form', json=DONNEES)
+    assert 'X-PDF-Taille' not in r.headers
+    r = c.post('/fill-employer-form?optimiser=1', json=DONNEES)
+    assert r.status_code == 200 and b'/ObjStm' in r.data
+    avant, apres = (int(x.split('=')[1]) for x in r.headers['X-PDF-Taille'].split('; '))
+    assert apres == len(r.data) and avant > apres
+
+
+def test_echec_sert_l_original(monkeypatch):
+    def boum(octets):
+        raise ValueError('boum')
+    monkeypatch.setattr(app, 'optimiser_pdf', boum)
+    monkeypatch.setenv('PDF_OPTIMISER', '1')
+    assert app.fill_att_accident_pdf(DONNEES).startswith(b'%PDF')
+
+
+# ---------- linéarisation ----------
+
+def _dict_lin(b):
+    m = re.match(rb'%PDF-1\.\d\n%....\n\d+ 0 obj\n<< /Linearized 1 (.*?)>>', b, re.S)
+    assert m, b[:120]
+    return {k.decode(): int(v) for k, v in re.findall(rb'/(\w) (\d+)', m.group(1))} | {
+        'H': [int(x) for x in re.search(rb'/H \[ (\d+) (\d+) \]', m.group(1)).groups()]}
+
+
+def _debut_objet(b, num):
+    return re.search(rb'(?<=\n)%d 0 obj\n' % num, b).start()
+
+
+@pytest.mark.parametrize('cle', ['offre_fr', 'procuration'])
+def test_structure_linearisee(cle):
+    lin, st = pdf_optim.lineariser_pdf(app._remplir(cle, DONNEES))
+    d = _dict_lin(lin)
+    rd = PdfReader(io.BytesIO(lin))
+    assert d['L'] == len(lin) == st['apres'] and d['N'] == len(rd.pages)
+    assert rd.pages[0].indirect_reference.idnum == d['O']
+    assert d['E'] == st['premiere_page'] and lin[:d['E']].endswith(b'endobj\n')
+    # tout ce que la page 1 utilise est avant /E, le reste après
+    page1 = {o.idnum for o in rd.pages[0]['/Resources']['/XObject'].values()}
+    contenu = rd.pages[0].raw_get('/Contents')
+    page1.update(o.idnum for o in (contenu if isinstance(contenu, list) else [contenu]))
+    assert all(_debut_objet(lin, n) < d['E'] for n in page1)
+    if len(rd.pages) > 1:
+        assert _debut_objet(lin, rd.pages[1].indirect_reference.idnum) >= d['E']
+    # table des pages : item 2 = décalage de la page 1, hors flux d'indices
+    h0, hl = d['H']
+    flux = lin[h0:h0 + hl]
+    donnees = flux[flux.index(b'stream\n') + 7:]
+    assert int.from_bytes(donnees[4:8], 'big') == _debut_objet(lin, d['O']) - hl
+    # xref principale : /T désigne le blanc qui précède l'entrée de l'objet 0
+    assert lin[d['T']:d['T'] + 1].isspace()
+    assert lin[d['T'] + 1:d['T'] + 21] == b'0000000000 65535 f\r\n'
+
+
+def test_linearisation_incoherente_sortie_non_linearisee(monkeypatch):
+    def incoherente(octets):
+        raise pdf_optim.LinearisationIncoherente('/L faux')
+    monkeypatch.setattr(app, 'lineariser_pdf', incoherente)
+    monkeypatch.setenv('PDF_LINEARISER', 'procuration')
+    pdf = app.fill_procuration_pdf(DONNEES)
+    assert b'/Linearized' not in pdf[:1024] and b'/ObjStm' in pdf
+
+
+def test_linearise_identique_au_pixel():
+    pdfium = pytest.importorskip('pypdfium2')
+    avant = app._remplir('offre_nl', DONNEES)
+    a, b = pdfium.PdfDocument(avant), pdfium.PdfDocument(pdf_optim.lineariser_pdf(avant)[0])
+    assert len(a) == len(b) > 1
+    for i in range(len(a)):
+        assert a[i].render(scale=1).to_pil().tobytes() == b[i].render(scale=1).to_pil().tobytes()
+
+
+def test_lineariser_par_parametre(monkeypatch):
+    c = app.app.test_client()
+    assert b'/Linearized' not in c.post('/fill-offre', json=DONNEES).data[:1024]
+    r = c.post('/fill-offre?lineariser=1', json=DONNEES)
+    assert r.status_code == 200 and _dict_lin(r.data)['L'] == len(r.data)
+    assert 'X-PDF-Taille' in r.headers
+
+
+def test_lineariser_par_type_de_document(monkeypatch):
+    monkeypatch.setenv('PDF_LINEARISER', 'procuration')
+    assert _dict_lin(app.fill_procuration_pdf(DONNEES))
+    assert b'/Linearized' not in app.fill_offre_pdf(DONNEES, 'fr')[:1024]
+    monkeypatch.setenv('PDF_LINEARISER', 'offre,procuration,employer')
+    assert b'/Linearized' not in app.fill_employer_pdf(DONNEES)[:1024]    # non concerné
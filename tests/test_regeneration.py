@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Régénération en masse (/regeneration) : tous les employeurs stockés.
+
+Ce qu'on verrouille ici :
+- le job parcourt TOUTE la table par pages (keyset id=gt.<dernier>) ;
+- un fichier par (employeur, document) dans le dossier du job, sous
+  « <id>_<numéro> » (jamais « . » ni « .. »), sans passer par
+  le cache des PDF (il garde les entrées utiles du portail) ;
+- un document qui plante est compté et détaillé sans arrêter le job ;
+- l'état (progression, débit, échecs) est lisible par la route de suivi, y
+  compris depuis un autre worker (statut.json) ;
+- pool cassé avant ou pendant le job : documents refaits sur place, nombre de
+  tâches en vol borné ;
+- auth requise, une seule régénération à la fois, tous workers confondus
+  (verrou fichier) ; un job dont le processus a disparu passe en 'interrompu'.
+"""
+import json
+import os
+import re
+import socket
+import sys
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+class FauxSupabase:
+    """Table employeurs de `n` lignes, servie par pages (order=id.asc, id=gt.)."""
+    def __init__(self, n):
+        self.lignes = [{'id': i, 'num_entreprise': f'BE 0555.000.{i:03d}',
+                        'data': {'denomination': f'CLIENT {i}', 'nom_societe': f'CLIENT {i}'}}
+                       for i in range(1, n + 1)]
+        self.appels = []
+
+    def get(self, url, **kw):
+        self.appels.append(url)
+        limite = int(re.search(r'limit=(\d+)', url).group(1))
+        m = re.search(r'id=gt\.(\d+)', url)
+        apres = int(m.group(1)) if m else 0
+        rows = [x for x in self.lignes if x['id'] > apres][:limite]
+
+        class R:
+            status_code = 200
+            text = ''
+            def json(self):
+                return rows
+        return R()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'SUPABASE_URL', 'https://fake.supabase.co')
+    monkeypatch.setattr(app, 'SUPABASE_KEY', 'sk-fake')
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    monkeypatch.setenv('REGEN_DOSSIER', str(tmp_path))
+    monkeypatch.setenv('ZIP_PROCESSUS', '1')
+    faux = FauxSupabase(7)
+    monkeypatch.setattr(app.supabase_http, 'get', faux.get)
+    monkeypatch.setattr(app, '_REGEN_JOBS', {})
+    c = app.app.test_client()
+    c.faux = faux
+    c.dossier = tmp_path
+    return c
+
+
+def _attendre(client, job_id, delai=60):
+    fin = time.time() + delai
+    while time.time() < fin:
+        etat = client.get(f'/regeneration/{job_id}').get_json()
+        if etat['statut'] != 'en_cours':
+            return etat
+        time.sleep(0.05)
+    raise AssertionError('job toujours en cours')
+
+
+def test_tous_les_employeurs_par_pages(client):
+    r = client.post('/regeneration', json={'documents': ['procuration', 'accident'],
+                                           'language_prefs': {'accident': 'nl'},
+                                           'taille_page': 3})
+    assert r.status_code == 202
+    etat = _attendre(client, r.get_json()['id'])
+    assert etat['statut'] == 'termine'
+    assert etat['employeurs_traites'] == 7 and etat['documents_generes'] == 14
+    assert etat['nb_echecs'] == 0 and etat['documents_par_s'] > 0
+    # 3 pages (3 + 3 + 1), la 2e et la 3e reprennent après le dernier id lu
+    assert len(client.faux.appels) == 3
+    assert 'id=gt.3' in client.faux.appels[1] and 'id=gt.6' in client.faux.appels[2]
+    dossier = os.path.join(etat['dossier'], '7_BE_0555.000.007')
+    assert sorted(os.listdir(dossier)) == ['Attestation_accident_travail_NL.pdf',
+                                           'Procuration_ONSS.pdf']
+
+
+def test_echec_compte_sans_arreter_le_job(client, monkeypatch):
+    vrai = app._rendre
+
+    def parfois(plan, d):
+        if d.get('denomination') == 'CLIENT 2':
+            raise RuntimeError('données corrompues')
+        return vrai(plan, d)
+
+    monkeypatch.setattr(app, '_rendre', parfois)
+    r = client.post('/regeneration', json={'documents': ['procuration']})
+    etat = _attendre(client, r.get_json()['id'])
+    assert etat['statut'] == 'termine' and etat['documents_generes'] == 6
+    assert etat['nb_echecs'] == 1
+    assert etat['echecs'][0]['num_entreprise'] == 'BE 0555.000.002'
+    assert 'corrompues' in etat['echecs'][0]['erreur']
+
+
+def test_dossiers_par_id_sans_remontee(client):
+    client.faux.lignes[:4] = [
+        dict(client.faux.lignes[0], num_entreprise='..'),
+        dict(client.faux.lignes[1], num_entreprise='.'),
+        dict(client.faux.lignes[2], num_entreprise='BE 0555/000'),
+        dict(client.faux.lignes[3], num_entreprise='BE 0555:000'),   # même nom assaini
+    ]
+    r = client.post('/regeneration', json={'documents': ['procuration']})
+    etat = _attendre(client, r.get_json()['id'])
+    assert etat['documents_generes'] == 7
+    assert sorted(os.listdir(etat['dossier']))[:4] == [
+        '1_sans_numero', '2_sans_numero', '3_BE_0555_000', '4_BE_0555_000']
+    assert sorted(os.listdir(client.dossier)) == [r.get_json()['id']]   # rien au-dessus
+
+
+def test_hors_cache_des_pdf(client):
+    app.vider_cache_pdf()
+    r = client.post('/regeneration', json={'documents': ['procuration', 'accident']})
+    assert _attendre(client, r.get_json()['id'])['documents_generes'] == 14
+    st = app.cache_pdf_stats()
+    assert st['entrees'] == 0 and st['absent'] == 0
+
+
+def test_etat_lisible_depuis_un_autre_worker(client, monkeypatch):
+    r = client.post('/regeneration', json={'documents': ['procuration']})
+    job_id = r.get_json()['id']
+    _attendre(client, job_id)
+    monkeypatch.setattr(app, '_REGEN_JOBS', {})          # autre worker : rien en mémoire
+    etat = client.get(f'/regeneration/{job_id}').get_json()
+    assert etat['statut'] == 'termine' and etat['documents_generes'] == 7
+
+
+def test_supabase_en_panne_job_en_echec(client, monkeypatch):
+    class R:
+        status_code = 500
+        text = 'boom'
+    monkeypatch.setattr(app.supabase_http, 'get', lambda url, **kw: R())
+    r = client.post('/regeneration', json={'documents': ['procuration']})
+    etat = _attendre(client, r.get_json()['id'])
+    assert etat['statut'] == 'echec' and 'Supabase 500' in etat['message']
+
+
+def test_une_seule_regeneration_a_la_fois(client, monkeypatch):
+    monkeypatch.setitem(app._REGEN_JOBS, 'x' * 32, {'id': 'x' * 32, 'statut': 'en_cours'})
+    r = client.post('/regeneration', json={'documents': ['procuration']})
+    assert r.status_code == 409
+
+
+class PoolFragile:
+    """Exécute tout de suite ; la 1re soumission trouve le pool cassé, la 3e
+    tâche casse au résultat."""
+    def __init__(self):
+        self.soumis = 0
+
+    def submit(self, fn, *args):
+        self.soumis += 1
+        if self.soumis == 1:
+            raise BrokenProcessPool('cassé avant le job')
+        f = Future()
+        if self.soumis == 3:
+            f.set_exception(BrokenProcessPool('processus tué'))
+        else:
+            f.set_result(fn(*args))
+        return f
+
+
+def test_pool_casse_documents_refaits_sur_place_en_vol_borne(client, monkeypatch):
+    monkeypatch.setenv('ZIP_PROCESSUS', '2')
+    pool = PoolFragile()
+    monkeypatch.setattr(app, '_pool', lambda: pool)
+    monkeypatch.setattr(app, '_abandonner_pool', lambda: None)
+    vrai, ecart = app._regen_recolter, []
+
+    def recolter(job, tache):
+        ecart.append(pool.soumis - len(ecart))
+        vrai(job, tache)
+    monkeypatch.setattr(app, '_regen_recolter', recolter)
+    r = client.post('/regeneration', json={'documents': ['procuration', 'accident']})
+    etat = _attendre(client, r.get_json()['id'])
+    assert etat['statut'] == 'termine' and etat['documents_generes'] == 14
+    assert etat['nb_echecs'] == 0
+    assert max(ecart) <= 2 * 2 + 1          # jamais plus de 2 tâches par processus en vol
+
+
+def test_job_d_un_processus_disparu_interrompu(client):
+    mort = 'd' * 32
+    os.makedirs(client.dossier / mort)
+    (client.dossier / mort / 'statut.json').write_text(json.dumps(
+        {'id': mort, 'statut': 'en_cours', 'hote': socket.gethostname(), 'pid': 2 ** 22 + 7}))
+    r = client.post('/regeneration', json={'documents': ['procuration']})
+    assert r.status_code == 202
+    assert client.get(f'/regeneration/{mort}').get_json()['statut'] == 'interrompu'
+    _attendre(client, r.get_json()['id'])
+
+
+def test_job_d_un_autre_worker_vivant_bloque(client):
+    autre = 'a' * 32
+    os.makedirs(client.dossier / autre)
+    (client.dossier / autre / 'statut.json').write_text(json.dumps(
+        {'id': autre, 'statut': 'en_cours', 'hote': socket.gethostname(), 'pid': os.getppid()}))
+    r = client.post('/regeneration', json={'documents': ['procuration']})
+    assert r.status_code == 409 and r.get_json()['id'] == autre
+    assert not (client.dossier / '.verrou').exists()
+
+
+def test_verrou_fichier_tenu_par_un_autre_worker(client, monkeypatch):
+    monkeypatch.setattr(app, '_REGEN_VERROU_DELAI', 0.2)
+    (client.dossier / '.verrou').write_text('12345')
+    assert client.post('/regeneration', json={'documents': ['procuration']}).status_code == 503
+    # verrou orphelin (processus mort en le tenant) : retiré, le job part
+    vieux = time.time() - app._REGEN_VERROU_ORPHELIN - 1
+    os.utime(client.dossier / '.verrou', (vieux, vieux))
+    r = client.post('/regeneration', json={'documents': ['procuration']})
+    assert r.status_code == 202
+    _attendre(client, r.get_json()['id'])
+
+
+def test_jobs_termines_quittent_la_memoire(client):
+    premier = client.post('/regeneration', json={'documents': ['procuration']}).get_json()['id']
+    _attendre(client, premier)
+    second = client.post('/regeneration', json={'documents': ['procuration']}).get_json()['id']
+    assert list(app._REGEN_JOBS) == [second]
+    assert client.get(f'/regeneration/{premier}').get_json()['statut'] == 'termine'
+    _attendre(client, second)
+
+
+@pytest.mark.parametrize('corps', [{}, {'documents': []}, {'documents': ['inconnu']},
+                                   {'documents': ['offre'], 'taille_page': 'x'}])
+def test_requete_invalide_400(client, corps):
+    assert client.post('/regeneration', json=corps).status_code == 400
+
+
+def test_job_inconnu_404(client):
+    assert client.get('/regeneration/' + '0' * 32).status_code == 404
+    assert client.get('/regeneration/../../etc').status_code == 404
+
+
+def test_sans_auth_401(monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: None)
+    c = app.app.test_client()
+    assert c.post('/regeneration', json={'documents': ['offre']}).status_code == 401
+    assert c.get('/regeneration/' + '0' * 32).status_code == 401
@@ -655,6 +655,25 @@ class TestInstitutions:
         assert any('Rue Courte' in str(x) for x in v.values())        # a bien pris AG
         assert all('Rue Longue' not in str(x) for x in v.values())    # pas AGACHE
 
+    def test_index_prebati_meme_resultat(self):
+        # index construit une fois (répertoire en cache côté app) == parcours de la liste
+        idx = R.index_institutions(self.INSTS)
+        for payload, idd in (({'assurance_loi': ' axa '}, {}), ({'seppt': 'mensura bxl'}, {}),
+                             ({}, {'adresse_siege_social_2': '4000 Liège'})):
+            assert R._valeurs_institutions(payload, idd, None, index=idx) == \
+                R._valeurs_institutions(payload, idd, self.INSTS)
+        assert idx['par_nom'][('assurance', 'axa')]['rue'] == 'Boulevard du Souverain'
+
+    def test_build_reglement_avec_index(self):
+        idd = {'nom_societe': 'X', 'adresse_siege_social_2': '1000 Bruxelles'}
+        payload = {'reglement_langue': 'FR', 'assurance_loi': 'AXA', 'commission_paritaire': '112'}
+        liste = _texte(R.build_reglement(payload, idd, _tpl(TPL_FR), repertoire=self.INSTS,
+                                         cp_repertoire=CP_REP))
+        index = _texte(R.build_reglement(payload, idd, _tpl(TPL_FR),
+                                         inst_index=R.index_institutions(self.INSTS),
+                                         cp_index=R.index_cp(CP_REP)))
+        assert index == liste and 'Souverain' in index
+
 
 class TestCamerasRobustesse:
     def test_texte_regex_special(self):
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Répertoires institutions / commissions en cache (REPERTOIRES_TTL).
+
+Ce qu'on verrouille ici :
+- deux lectures successives = UN appel Supabase, index construit une fois ;
+- une écriture de CE processus (upsert, supprimer) vide le cache de la table ;
+- le TTL expire ; REPERTOIRES_TTL=0 coupe le cache ;
+- une lecture en échec n'est pas mise en cache.
+
+Supabase est simulé (monkeypatch de supabase_http.*).
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+class FauxSupabase:
+    def __init__(self):
+        self.lectures = []
+        self.statut = 200
+
+    def _rep(self, corps, status=200):
+        class R:
+            status_code = status
+            text = ''
+            def json(self):
+                return corps
+        return R()
+
+    def get(self, url, **kw):
+        self.lectures.append(url)
+        if '/commissions' in url:
+            return self._rep([{'cp': '112', 'heures_semaine': '36h30',
+                               'denomination': 'Entreprises de garage'}], self.statut)
+        return self._rep([{'type': 'assurance', 'nom': 'AXA ', 'rue': 'Bd du Souverain'}],
+                         self.statut)
+
+    def post(self, url, **kw):
+        return self._rep([{**kw['json'], 'id': 7}])
+
+    def delete(self, url, **kw):
+        return self._rep([])
+
+
+@pytest.fixture
+def faux(monkeypatch):
+    monkeypatch.setattr(app, 'SUPABASE_URL', 'https://fake.supabase.co')
+    monkeypatch.setattr(app, 'SUPABASE_KEY', 'sk-fake')
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'gest@test.be')
+    monkeypatch.delenv('REPERTOIRES_TTL', raising=False)
+    f = FauxSupabase()
+    for verbe in ('get', 'post', 'delete'):
+        monkeypatch.setattr(app.supabase_http, verbe, getattr(f, verbe))
+    app.vider_cache_repertoires()
+    yield f
+    app.vider_cache_repertoires()
+
+
+def test_une_lecture_index_prebati(faux):
+    lignes, idx = app._repertoire('institutions')
+    assert app._repertoire('institutions')[1] is idx
+    assert len(faux.lectures) == 1
+    assert idx['par_nom'][('assurance', 'axa')] is lignes[0]
+    _, lut = app._repertoire('commissions')
+    assert lut['112']['hebdo'] == '36h30' and len(faux.lectures) == 2
+    assert set(app.repertoires_stats()) == {'institutions', 'commissions'}
+    assert app.repertoires_stats()['institutions'] == len(lignes)
+
+
+@pytest.mark.parametrize('table,route,corps', [
+    ('institutions', '/institutions/upsert', {'nom': 'AG', 'type': 'assurance'}),
+    ('institutions', '/institutions/supprimer', {'id': 3}),
+    ('commissions', '/commissions/upsert', {'cp': '200'}),
+    ('commissions', '/commissions/supprimer', {'id': 3}),
+])
+def test_ecriture_vide_le_cache(faux, table, route, corps):
+    app._repertoire('institutions')
+    app._repertoire('commissions')
+    assert app.app.test_client().post(route, json=corps).status_code == 200
+    faux.lectures.clear()
+    app._repertoire('institutions')
+    app._repertoire('commissions')
+    assert [u for u in faux.lectures if f'/{table}' in u] and len(faux.lectures) == 1
+
+
+def test_ttl(faux, monkeypatch):
+    app._repertoire('commissions')
+    t = app.time.time()
+    monkeypatch.setattr(app.time, 'time', lambda: t + 601)
+    app._repertoire('commissions')
+    assert len(faux.lectures) == 2
+    monkeypatch.setenv('REPERTOIRES_TTL', '0')
+    app._repertoire('commissions')
+    app._repertoire('commissions')
+    assert len(faux.lectures) == 4
+
+
+def test_echec_non_mis_en_cache(faux):
+    faux.statut = 503
+    assert app._repertoire('institutions') == ([], None)
+    faux.statut = 200
+    assert app._repertoire('institutions')[0]
+    assert len(faux.lectures) == 2
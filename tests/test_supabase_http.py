@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Client HTTP partagé Supabase (supabase_http).
+
+Ce qu'on verrouille ici :
+- une seule session par processus, réutilisée d'un appel à l'autre ; une
+  nouvelle après un fork (PID différent) ;
+- pool dimensionné (SUPABASE_POOL), délai de connexion homogène, timeout de
+  l'appelant appliqué à la lecture ;
+- keep-alive réel : N appels successifs = UNE connexion TCP ;
+- GET rejoué sur 503, POST jamais rejoué sur une réponse du serveur.
+"""
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import supabase_http  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def session_neuve(monkeypatch):
+    for nom in ('SUPABASE_POOL', 'SUPABASE_ESSAIS', 'SUPABASE_TIMEOUT_CONNEXION'):
+        monkeypatch.delenv(nom, raising=False)
+    supabase_http.fermer()
+    yield
+    supabase_http.fermer()
+
+
+@pytest.fixture
+def serveur():
+    """Petit serveur HTTP/1.1 local : compte connexions et requêtes ; les
+    `echecs` premières réponses sont des 503."""
+    etat = {'connexions': 0, 'requetes': [], 'echecs': 0}
+
+    class H(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            etat['connexions'] += 1
+            super().setup()
+
+        def _repondre(self):
+            n = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(n)
+            etat['requetes'].append(self.command)
+            code = 503 if etat['echecs'] > 0 else 200
+            etat['echecs'] -= 1
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'[]')
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _repondre
+
+        def log_message(self, *a):
+            pass
+
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), H)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    etat['url'] = f'http://127.0.0.1:{srv.server_address[1]}'
+    yield etat
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_session_partagee_et_recreee_apres_fork(monkeypatch):
+    s = supabase_http.session()
+    assert supabase_http.session() is s
+    monkeypatch.setattr(supabase_http.os, 'getpid', lambda: -1)   # « autre processus »
+    assert supabase_http.session() is not s
+
+
+def test_pool_et_delais(monkeypatch):
+    monkeypatch.setenv('SUPABASE_POOL', '16')
+    monkeypatch.setenv('SUPABASE_TIMEOUT_CONNEXION', '3')
+    adaptateur = supabase_http.session().get_adapter('https://x.supabase.co')
+    assert adaptateur._pool_maxsize == 16
+    assert adaptateur.max_retries.total == 2 and 503 in adaptateur.max_retries.status_forcelist
+    assert 'POST' not in adaptateur.max_retries.allowed_methods
+    assert supabase_http._timeout(15) == (3.0, 15)
+    assert supabase_http._timeout(None) == (3.0, supabase_http.LECTURE_DEFAUT)
+
+
+def test_keep_alive_une_seule_connexion(serveur):
+    for verbe in ('get', 'post', 'patch', 'delete', 'get'):
+        r = getattr(supabase_http, verbe)(serveur['url'] + '/rest/v1/t', json={}, timeout=5)
+        assert r.status_code == 200
+    assert serveur['connexions'] == 1
+    assert serveur['requetes'] == ['GET', 'POST', 'PATCH', 'DELETE', 'GET']
+    assert supabase_http.stats()['hotes'] == 1
+
+
+def test_get_rejoue_sur_503(serveur):
+    serveur['echecs'] = 1
+    assert supabase_http.get(serveur['url'] + '/rest/v1/t', timeout=5).status_code == 200
+    assert serveur['requetes'] == ['GET', 'GET']
+
+
+def test_post_jamais_rejoue_sur_reponse(serveur):
+    serveur['echecs'] = 1
+    r = supabase_http.post(serveur['url'] + '/rest/v1/t', json={'a': 1}, timeout=5)
+    assert r.status_code == 503 and serveur['requetes'] == ['POST']
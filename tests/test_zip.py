@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""/download-all-zip : l'archive part EN FLUX.
+
+Ce qu'on verrouille ici :
+- la réponse est un générateur : le premier morceau (1re entrée) est envoyé
+  avant que le document suivant ne soit généré ;
+- les entrées utilisent un data descriptor (CRC/tailles après les données) et
+  l'archive reste lisible par zipfile ;
+- un document qui plante est sauté sans casser les autres ; le document
+  statique du bundle n'est ajouté qu'une fois ;
+- compression par entrée : déjà compressé -> STORED, le reste -> DEFLATED,
+  politique annoncée dans X-Zip-Compression, choix par entrée au journal
+  [ZIP] seulement (l'archive part chez le client : commentaire vide) ;
+- les documents statiques sont préparés une fois et recopiés tels quels ;
+- en parallèle (pool de processus) : même archive, même ordre, échec isolé ;
+- tailles avant/après optimisation (X-PDF-Taille) au journal [ZIP], y compris
+  pour les documents optimisés dans le pool.
+"""
+import io
+import os
+import sys
+import zipfile
+import zlib
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'verify_user_token', lambda req: 'test@persoproject.be')
+    monkeypatch.setattr(app, 'save_employeur', lambda d: None)
+    monkeypatch.setenv('ZIP_PROCESSUS', '1')       # séquentiel : les espions voient tout
+    app.vider_cache_pdf()
+    return app.app.test_client()
+
+
+def _post(client, documents, **kw):
+    return client.post('/download-all-zip', json={
+        'documents': documents, 'form_data': {'nom_societe': 'TEST SRL'},
+        'language_prefs': {'offre': 'nl'}}, **kw)
+
+
+def test_archive_complete_et_lisible(client):
+    r = _post(client, ['employer', 'travailleur', 'offre'])
+    assert r.status_code == 200 and r.is_streamed
+    assert r.mimetype == 'application/zip'
+    assert 'attachment; filename=documents_persoproject_' in r.headers['Content-Disposition']
+    with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+        assert z.testzip() is None
+        noms = z.namelist()
+        infos = z.infolist()
+    assert noms == ['Fiche_employeur.pdf', 'Obligation_Employeur_2025.pdf',
+                    'Fiche_travailleur.pdf', 'Offre_de_collaboration_NL.pdf']
+    for i in infos:       # data descriptor pour les PDF générés, pas pour le statique préparé
+        assert bool(i.flag_bits & 0x08) == (i.filename != 'Obligation_Employeur_2025.pdf')
+
+
+def test_premier_document_envoye_avant_le_suivant(client, monkeypatch):
+    generes = []
+    vrai = app.generate_pdf_bytes
+
+    def espion(doc_type, form_data, lang_prefs):
+        generes.append(doc_type)
+        return vrai(doc_type, form_data, lang_prefs)
+
+    monkeypatch.setattr(app, 'generate_pdf_bytes', espion)
+    r = _post(client, ['procuration', 'dispense'], buffered=False)
+    flux = iter(r.response)
+    premier = next(flux)
+    assert premier.startswith(b'PK\x03\x04') and generes == ['procuration']
+    reste = b''.join(flux)
+    assert generes == ['procuration', 'dispense']
+    with zipfile.ZipFile(io.BytesIO(premier + reste)) as z:
+        assert z.namelist() == ['Procuration_ONSS.pdf', 'Dispense_precompte.pdf']
+
+
+def test_document_en_echec_isole(client, monkeypatch):
+    vrai = app.generate_pdf_bytes
+
+    def parfois(doc_type, form_data, lang_prefs):
+        if doc_type == 'employer':
+            raise RuntimeError('boum')
+        return vrai(doc_type, form_data, lang_prefs)
+
+    monkeypatch.setattr(app, 'generate_pdf_bytes', parfois)
+    r = _post(client, ['employer', 'procuration'])
+    with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+        assert z.namelist() == ['Procuration_ONSS.pdf']
+
+
+# ---------- compression par entrée ----------
+
+def test_deja_compresse_stocke_sinon_deflate():
+    deja = zlib.compress(os.urandom(200_000))     # incompressible
+    texte = b'BT /F1 9 Tf (Rue de la Loi) Tj ET\n' * 5000
+    assert app._methode_zip(deja) == zipfile.ZIP_STORED
+    assert app._methode_zip(texte) == zipfile.ZIP_DEFLATED
+
+
+def test_politique_annoncee_et_appliquee(client):
+    r = _post(client, ['employer', 'offre'])
+    assert r.headers['X-Zip-Compression'] == 'auto'
+    with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+        methodes = {i.filename: i.compress_type for i in z.infolist()}
+    assert methodes['Fiche_employeur.pdf'] == zipfile.ZIP_STORED          # flux Flate
+    assert methodes['Offre_de_collaboration_NL.pdf'] == zipfile.ZIP_DEFLATED
+
+
+def test_choix_par_entree_au_journal_seulement(client, capsys):
+    r = _post(client, ['employer', 'offre'])
+    with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+        assert z.comment == b''
+        noms = z.namelist()
+    journal = [l for l in capsys.readouterr().out.splitlines() if l.startswith('[ZIP]')]
+    assert len(journal) == len(noms)                  # une ligne par entrée, pas deux
+    assert '[ZIP] Fiche_employeur.pdf : stored' in journal
+    assert '[ZIP] Offre_de_collaboration_NL.pdf : deflated' in journal
+
+
+def test_deflate_force_par_env(client, monkeypatch):
+    monkeypatch.setenv('ZIP_COMPRESSION', 'deflate')
+    r = _post(client, ['employer'])
+    assert r.headers['X-Zip-Compression'] == 'deflate'
+    with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+        assert all(i.compress_type == zipfile.ZIP_DEFLATED for i in z.infolist())
+
+
+# ---------- entrées statiques préparées ----------
+
+def test_entree_statique_preparee_une_fois_et_recopiee(client, monkeypatch):
+    entree = app.entree_zip_statique('obligation_employeur')
+    assert app.entree_zip_statique('obligation_employeur') is entree
+    lectures = []
+    monkeypatch.setattr(app, 'get_static_document_bytes',
+                        lambda k: lectures.append(k) or (None, None))
+    r = _post(client, ['employer', 'travailleur'])
+    assert lectures == []                  # plus de lecture disque par requête
+    with open(os.path.join(os.path.dirname(app.__file__),
+                           'Obligation_Employeur_2025.pdf'), 'rb') as f:
+        original = f.read()
+    with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+        assert z.testzip() is None
+        assert z.namelist().count('Obligation_Employeur_2025.pdf') == 1
+        assert z.read('Obligation_Employeur_2025.pdf') == original
+
+
+@pytest.mark.parametrize('politique', ['auto', 'deflate'])
+def test_entree_statique_sans_internes_zipfile(monkeypatch, politique):
+    # zipfile d'une autre version de Python : repli writestr(), même contenu
+    monkeypatch.setenv('ZIP_COMPRESSION', politique)
+    monkeypatch.setattr(app, '_ZIP_INTERNES', app._ZIP_INTERNES + ('_attribut_disparu',))
+    entree = app.entree_zip_statique('obligation_employeur')
+    data = b''.join(app.zip_en_flux(iter([(entree['nom'], entree)])))
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.testzip() is None
+        info = z.getinfo(entree['nom'])
+        assert info.compress_type == entree['methode'] and info.CRC == entree['crc']
+        assert len(z.read(entree['nom'])) == entree['taille']
+
+
+# ---------- génération en parallèle ----------
+
+DOSSIER = ['employer', 'travailleur', 'offre', 'seppt', 'accident', 'dispense',
+           'procuration', 'mensura']
+
+
+def test_pool_meme_archive_meme_ordre(client, monkeypatch):
+    sequentiel = _post(client, DOSSIER).data
+    app.vider_cache_pdf()
+    monkeypatch.setenv('ZIP_PROCESSUS', '2')
+    parallele = _post(client, DOSSIER).data
+    with zipfile.ZipFile(io.BytesIO(sequentiel)) as a, zipfile.ZipFile(io.BytesIO(parallele)) as b:
+        assert a.namelist() == b.namelist()
+        for nom in a.namelist():
+            assert a.read(nom) == b.read(nom), nom
+    assert app.cache_pdf_stats()['absent'] == len(DOSSIER)   # résultats rangés au cache
+
+
+class FauxPool:
+    """Exécute tout de suite ; 'employer' échoue, 'procuration' casse le pool."""
+    def submit(self, fn, cle, *args):
+        f = Future()
+        if cle == 'employer':
+            f.set_exception(RuntimeError('boum'))
+        elif cle == 'procuration':
+            f.set_exception(BrokenProcessPool('processus tué'))
+        else:
+            f.set_result(fn(cle, *args))
+        return f
+
+
+def test_pool_echec_isole_et_pool_casse_rattrape(client, monkeypatch):
+    monkeypatch.setenv('ZIP_PROCESSUS', '2')
+    monkeypatch.setattr(app, '_pool', lambda: FauxPool())
+    monkeypatch.setattr(app, '_abandonner_pool', lambda: None)
+    res = list(app.generer_documents(['employer', 'procuration', 'inconnu', 'mensura'],
+                                     {'nom_societe': 'X'}, {}))
+    assert [d for d, _o, _e in res] == ['employer', 'procuration', 'inconnu', 'mensura']
+    (_, o1, e1), (_, o2, e2), (_, o3, e3), (_, o4, e4) = res
+    assert o1 is None and isinstance(e1, RuntimeError)
+    assert o2.startswith(b'%PDF') and e2 is None        # refait dans le worker
+    assert o3 is None and e3 is None
+    assert o4.startswith(b'%PDF') and e4 is None
+
+
+class PoolCasseASoumission:
+    def submit(self, *a):
+        raise BrokenProcessPool('cassé avant la requête')
+
+
+class PoolBloque:
+    """Le futur n'aboutit jamais (processus enfant bloqué)."""
+    def submit(self, *a):
+        return Future()
+
+
+def test_pool_casse_a_la_soumission_calcul_sur_place(monkeypatch):
+    monkeypatch.setenv('ZIP_PROCESSUS', '2')
+    abandons = []
+    monkeypatch.setattr(app, '_pool', lambda: PoolCasseASoumission())
+    monkeypatch.setattr(app, '_abandonner_pool', lambda: abandons.append(1))
+    res = list(app.generer_documents(['employer', 'mensura'], {'nom_societe': 'X'}, {}))
+    assert [(d, o[:4], e) for d, o, e in res] == [('employer', b'%PDF', None),
+                                                  ('mensura', b'%PDF', None)]
+    assert abandons
+
+
+def test_processus_bloque_delai_depasse(monkeypatch):
+    monkeypatch.setenv('ZIP_PROCESSUS', '2')
+    monkeypatch.setenv('ZIP_DELAI_PROCESSUS', '1')
+    monkeypatch.setattr(app, '_pool', lambda: PoolBloque())
+    app.vider_cache_pdf()
+    res = list(app.generer_documents(['employer', 'mensura'], {'nom_societe': 'Bloqué'}, {}))
+    assert [d for d, _o, _e in res] == ['employer', 'mensura']
+    assert all(o is None and isinstance(e, TimeoutError) for _d, o, e in res)
+
+
+@pytest.mark.parametrize('processus', ['1', '2'])
+def test_tailles_pdf_au_journal(client, monkeypatch, capsys, processus):
+    monkeypatch.setenv('ZIP_PROCESSUS', processus)
+    if processus != '1':
+        monkeypatch.setattr(app, '_pool', lambda: FauxPool())   # _produire hors requête
+    r = client.post('/download-all-zip?optimiser=1', json={
+        'documents': ['travailleur', 'mensura'], 'form_data': {'nom_societe': 'TEST SRL'}})
+    assert 'X-PDF-Taille' not in r.headers              # parti avant la génération
+    with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+        assert z.comment == b''
+        total = sum(i.file_size for i in z.infolist() if i.filename != 'Obligation_Employeur_2025.pdf')
+    ligne = [x for x in capsys.readouterr().out.splitlines() if x.startswith('[ZIP] X-PDF-Taille : ')]
+    assert len(ligne) == 1
+    avant, apres = (int(x.split('=')[1]) for x in ligne[0].split(' : ', 1)[1].split('; '))
+    assert apres == total and avant > apres